@@ -0,0 +1,238 @@
+"""
+End-to-end benchmark of the API endpoints. The requests are sent over HTTP to a running server (typically one using the
+database created by benchmarks/synthetic_db.py), with payloads shaped as in demo/parameters_examples. For each endpoint
+the benchmark measures the latency percentiles and the throughput, then stores the results as JSON and, if a baseline is
+given, reports the endpoints whose latency got worse than the baseline by more than the tolerance.
+
+Usage:
+
+    python -m benchmarks.bench [--url http://localhost:51992/popstudy/api/] [--repetitions 10] [--concurrency 1]
+                               [--output benchmark.json] [--baseline baseline.json] [--tolerance 0.2]
+
+The exit status is 1 if a regression is detected.
+"""
+from typing import Dict, List, Optional
+from prettytable import PrettyTable
+from loguru import logger
+import concurrent.futures
+import urllib.request
+import urllib.error
+import itertools
+import argparse
+import json
+import math
+import time
+import sys
+
+DEFAULT_URL = 'http://localhost:51992/popstudy/api/'
+PERCENTILES = [50, 90, 95, 99]
+COMPARED_STATISTICS = ['p50', 'p95']
+
+
+class BenchmarkCase:
+    def __init__(self, name: str, path: str, body: Optional[dict] = None):
+        """
+        :param path: the path of the endpoint relative to the base URL of the API
+        :param body: the JSON body of a POST request, or None for a GET request
+        """
+        self.name = name
+        self.path = path
+        self.body = body
+
+
+def send(base_url: str, path: str, body: Optional[dict], timeout: float, headers: Optional[dict] = None) \
+        -> (int, Optional[dict]):
+    """
+    :return: the status code and the JSON body of the response (None if the body isn't JSON)
+    """
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    http_request = urllib.request.Request(base_url + path, data=data, method='POST' if body is not None else 'GET',
+                                          headers=dict(headers or {}, **{'Content-Type': 'application/json'}))
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            status, content = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, content = e.code, e.read()
+    try:
+        return status, json.loads(content)
+    except ValueError:
+        return status, None
+
+
+def discover_variants(base_url: str, timeout: float, how_many: int = 3) -> List[dict]:
+    """
+    Returns some variants existing in the database, in the format of the request parameters, in order to build requests
+    with non-empty results independently of the database content.
+    """
+    status, response = send(base_url, 'variants_in_region',
+                            {'of': {'assembly': 'hg19'}, 'chrom': 1, 'start': 0, 'stop': 5000000}, timeout)
+    if status != 200 or not response or not response.get('rows'):
+        logger.warning(f'unable to find variants to use in the benchmark requests (status {status})')
+        return []
+    columns = [column_name.lower() for column_name in response['columns']]
+    return [dict(zip(columns, row)) for row in response['rows'][:how_many]]
+
+
+def build_cases(variants: List[dict]) -> List[BenchmarkCase]:
+    cases = [
+        BenchmarkCase('values gender', 'values/gender'),
+        BenchmarkCase('values disease', 'values/disease'),
+        BenchmarkCase('annotate interval', 'annotate',
+                      {'assembly': 'hg19', 'chrom': 17, 'start': 7565097, 'stop': 7590856}),
+        BenchmarkCase('variants_in_region gene', 'variants_in_region',
+                      {'of': {'assembly': 'hg19'}, 'name': 'TP53'}),
+        BenchmarkCase('variants_in_region interval', 'variants_in_region',
+                      {'of': {'assembly': 'hg19'}, 'chrom': 1, 'start': 0, 'stop': 1000000}),
+        BenchmarkCase('donor_grouping meta', 'donor_grouping',
+                      {'group_by': ['gender', 'population'],
+                       'having_meta': {'healthy': True, 'super_population': ['SAS'], 'assembly': 'hg19'}}),
+        # the same shape of demo/parameters_examples
+        BenchmarkCase('most_common_variants small population', 'most_common_variants',
+                      {'having_meta': {'healthy': True, 'population': ['BEB'], 'gender': 'female', 'assembly': 'hg19'},
+                       'filter_output': {'limit': 10}}),
+        BenchmarkCase('rarest_variants small population', 'rarest_variants',
+                      {'having_meta': {'healthy': True, 'population': ['ITU'], 'gender': 'male', 'assembly': 'hg19'},
+                       'filter_output': {'limit': 10}}),
+        BenchmarkCase('download_donors meta', 'download_donors',
+                      {'having_meta': {'population': ['GBR'], 'assembly': 'hg19'}})
+    ]
+    if variants:
+        variant = {key: variants[0][key] for key in ['chrom', 'start', 'ref', 'alt']}
+        cases.extend([
+            BenchmarkCase('donor_grouping with variant', 'donor_grouping',
+                          {'group_by': ['super_population'],
+                           'having_meta': {'assembly': 'hg19'},
+                           'having_variants': {'with': [variant]}}),
+            BenchmarkCase('variant_grouping', 'variant_grouping',
+                          {'group_by': ['population'],
+                           'having_meta': {'super_population': ['EUR'], 'assembly': 'hg19'},
+                           'target_variant': variant}),
+            BenchmarkCase('most_common_variants with variants', 'most_common_variants',
+                          {'having_meta': {'assembly': 'hg19'},
+                           'having_variants': {'with': [variant]},
+                           'filter_output': {'limit': 10}}),
+            BenchmarkCase('annotate variant', 'annotate', dict(variant, assembly='hg19'))
+        ])
+    return cases
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    # nearest-rank method
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_case(base_url: str, case: BenchmarkCase, repetitions: int, concurrency: int, timeout: float,
+             distinct_requests: bool) -> dict:
+    nonce = itertools.count()
+
+    def one_request():
+        body = case.body
+        if body is not None and distinct_requests:
+            # the server coalesces identical concurrent requests; an unknown field makes each request unique
+            body = dict(body, benchmark_request=next(nonce))
+        start = time.perf_counter()
+        status, _ = send(base_url, case.path, body, timeout)
+        return status, time.perf_counter() - start
+
+    one_request()   # warm up (connection pool, tables reflected by the sources, caches)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(lambda _: one_request(), range(repetitions)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for _, latency in outcomes)
+    status_codes: Dict[str, int] = {}
+    for status, _ in outcomes:
+        status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+    result = {
+        'endpoint': case.path,
+        'requests': repetitions,
+        'status_codes': status_codes,
+        'throughput_rps': repetitions / elapsed,
+        'mean': sum(latencies) / len(latencies),
+        'min': latencies[0],
+        'max': latencies[-1]
+    }
+    for p in PERCENTILES:
+        result[f'p{p}'] = percentile(latencies, p)
+    return result
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    :return: the names of the cases slower than the baseline by more than the tolerance (e.g. 0.2 = 20%)
+    """
+    table = PrettyTable(['CASE', 'STATISTIC', 'BASELINE (s)', 'CURRENT (s)', 'CHANGE'])
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for statistic in COMPARED_STATISTICS:
+            before, now = baseline[name][statistic], result[statistic]
+            change = (now - before) / before if before > 0 else 0
+            flag = ''
+            if change > tolerance:
+                flag = ' REGRESSION'
+                if name not in regressions:
+                    regressions.append(name)
+            table.add_row([name, statistic, f'{before:.3f}', f'{now:.3f}', f'{change:+.1%}{flag}'])
+    print(table)
+    return regressions
+
+
+def print_results(results: Dict[str, dict]):
+    table = PrettyTable(['CASE', 'STATUS CODES', 'REQ/S'] + [f'P{p} (s)' for p in PERCENTILES] + ['MAX (s)'])
+    for name, result in results.items():
+        table.add_row([name, result['status_codes'], f"{result['throughput_rps']:.2f}"] +
+                      [f"{result[f'p{p}']:.3f}" for p in PERCENTILES] + [f"{result['max']:.3f}"])
+    print(table)
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark of the VarSum API endpoints.')
+    parser.add_argument('--url', default=DEFAULT_URL, help='base URL of the API')
+    parser.add_argument('--repetitions', type=int, default=10, help='requests measured for each case')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight at the same time')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds')
+    parser.add_argument('--cases', nargs='*', help='names of the cases to run (default all)')
+    parser.add_argument('--allow-coalescing', action='store_true',
+                        help='sends identical requests, which the server may execute only once when concurrent')
+    parser.add_argument('--output', default='benchmark.json', help='file where results are saved')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown considered a regression')
+    options = parser.parse_args(args)
+    base_url = options.url if options.url.endswith('/') else options.url + '/'
+
+    cases = build_cases(discover_variants(base_url, options.timeout))
+    if options.cases:
+        cases = [case for case in cases if case.name in options.cases]
+    results = {}
+    for case in cases:
+        logger.info(f'benchmarking {case.name}')
+        results[case.name] = run_case(base_url, case, options.repetitions, options.concurrency, options.timeout,
+                                      not options.allow_coalescing)
+    print_results(results)
+
+    with open(options.output, 'w') as output_file:
+        json.dump({
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'url': base_url,
+            'repetitions': options.repetitions,
+            'concurrency': options.concurrency,
+            'results': results
+        }, output_file, indent=2)
+    logger.info(f'results saved in {options.output}')
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, options.tolerance)
+        if regressions:
+            logger.error(f'performance regression in: {", ".join(regressions)}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
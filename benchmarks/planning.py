@@ -0,0 +1,135 @@
+"""
+Micro-benchmark of the planning overhead of the frequent lookups (details of a variant in 1000Genomes and TCGA, region of
+a gene in Gencode). Each lookup is repeated for different variants/genes sampled from the database and executed with
+EXPLAIN ANALYZE in two ways:
+- LITERAL: the statement rendered with literal values, i.e. a new SQL text for every request, as before the statements
+were executed with bind parameters;
+- PREPARED: the prepared statement created by database.db_utils.prepare_stmt, whose plan is cached by the database
+session after the first executions.
+For each lookup and each way, the mean and the 95th percentile of the planning and execution times are reported.
+
+Usage:
+
+    python -m benchmarks.planning <db_user> <db_password> <db_port> [--repetitions 100] [--assembly hg19]
+                                  [--output planning.json]
+"""
+from typing import Callable, Dict, List, Optional
+from prettytable import PrettyTable
+from loguru import logger
+from sqlalchemy import text
+import database.database as database
+import database.db_utils as db_utils
+from data_sources.io_parameters import Gene, Mutation, Vocabulary
+from data_sources.kgenomes.kgenomes import KGenomes
+from data_sources.tcga.tcga import TCGA
+from data_sources.gencode_v19_hg19.gencode import Gencode
+import argparse
+import json
+import math
+import random
+import sys
+
+VARIANT_DETAILS = [Vocabulary.CHROM, Vocabulary.START, Vocabulary.STOP]
+GENE_DETAILS = [Vocabulary.GENE_TYPE, Vocabulary.CHROM, Vocabulary.START, Vocabulary.STOP, Vocabulary.GENE_ID]
+
+
+def sample(connection, query: str, size: int) -> List[tuple]:
+    rows = [tuple(row) for row in connection.execute(text(query), limit=size * 10)]
+    return random.sample(rows, min(size, len(rows)))
+
+
+def lookups(connection, repetitions: int, assembly: str) -> Dict[str, List]:
+    """
+    :return: for each lookup, the statements to benchmark
+    """
+    kgenomes_variants = sample(connection, 'SELECT DISTINCT chrom, start, ref, alt FROM rr.kgenomes_red LIMIT :limit',
+                               repetitions)
+    tcga_variants = sample(connection, 'SELECT DISTINCT chrom, start, ref, alt FROM rr.tcga_dnaseq_2 LIMIT :limit',
+                           repetitions)
+    genes = sample(connection, 'SELECT DISTINCT gene_name FROM rr.gencode_red LIMIT :limit', repetitions)
+    # the sources initialize the tables they use
+    KGenomes(logger), TCGA(logger)
+    gencode = Gencode(logger)
+    return {
+        'variant_details (1000Genomes)': [KGenomes._stmt_variant_details(Mutation(*variant), VARIANT_DETAILS, assembly)
+                                          for variant in kgenomes_variants],
+        'variant_details (TCGA)': [TCGA._stmt_variant_details(Mutation(*variant), VARIANT_DETAILS, assembly)
+                                   for variant in tcga_variants],
+        'find_gene': [gencode.find_gene_region(connection, Gene(gene_name), GENE_DETAILS, assembly)
+                      for gene_name, in genes]
+    }
+
+
+def explain_analyze_literal(connection, name: str, stmt) -> dict:
+    compiled_stmt = stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    return connection.execute(text('EXPLAIN (ANALYZE, FORMAT JSON) ' + str(compiled_stmt))).scalar()[0]
+
+
+def explain_analyze_prepared(connection, name: str, stmt) -> dict:
+    execute_stmt, values = db_utils.prepare_stmt(connection, name, stmt)
+    return connection.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + execute_stmt, values).scalar()[0]
+
+
+def percentile(values: List[float], p: int) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def measure(connection, name: str, statements: List, explain_analyze: Callable) -> dict:
+    plans = [explain_analyze(connection, name, stmt) for stmt in statements]
+    planning_times = [plan['Planning Time'] / 1000 for plan in plans]
+    execution_times = [plan['Execution Time'] / 1000 for plan in plans]
+    return {
+        'executions': len(plans),
+        'planning_mean': sum(planning_times) / len(plans),
+        'planning_p95': percentile(planning_times, 95),
+        'execution_mean': sum(execution_times) / len(plans),
+        'execution_p95': percentile(execution_times, 95)
+    }
+
+
+def print_results(results: List[dict]):
+    table = PrettyTable(['LOOKUP', 'MODE', 'EXECUTIONS', 'PLANNING MEAN (ms)', 'PLANNING P95 (ms)',
+                         'EXECUTION MEAN (ms)', 'EXECUTION P95 (ms)'])
+    for result in results:
+        table.add_row([result['lookup'], result['mode'], result['executions']] +
+                      [f'{result[statistic] * 1000:.3f}'
+                       for statistic in ['planning_mean', 'planning_p95', 'execution_mean', 'execution_p95']])
+    print(table)
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark of the planning overhead of the frequent lookups.')
+    parser.add_argument('db_user')
+    parser.add_argument('db_password')
+    parser.add_argument('db_port')
+    parser.add_argument('--repetitions', type=int, default=100, help='executions of each lookup')
+    parser.add_argument('--assembly', choices=['hg19', 'grch38'], default='hg19')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='planning.json', help='file where results are saved')
+    options = parser.parse_args(args)
+
+    random.seed(options.seed)
+    database.config_db_engine_for_tests(options.db_user, options.db_password, options.db_port)
+    connection = database.check_and_get_connection()
+    results = []
+    try:
+        for name, statements in lookups(connection, options.repetitions, options.assembly).items():
+            if not statements:
+                logger.warning(f'no sample found for {name}')
+                continue
+            for mode, explain_analyze in [('LITERAL', explain_analyze_literal),
+                                          ('PREPARED', explain_analyze_prepared)]:
+                logger.info(f'{name}: {len(statements)} executions, {mode}')
+                results.append(dict(lookup=name, mode=mode, **measure(connection, name.split(' ')[0], statements,
+                                                                      explain_analyze)))
+    finally:
+        connection.close()
+    print_results(results)
+    with open(options.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
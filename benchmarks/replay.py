@@ -0,0 +1,238 @@
+"""
+Replays the requests recorded in the log files of the server (./logs, written by main.py) against a running server, so
+that capacity tests reflect the real mix of requests. The original timing of the requests is preserved, optionally sped
+up by a time scale factor, and the number of requests in flight is bounded by the given concurrency.
+
+The report contains the latency percentiles, the error rate and the throughput of each endpoint; if requested, the
+saturation of the database connection pool is sampled from the endpoint /metrics during the replay.
+
+Usage:
+
+    python -m benchmarks.replay [--logs ./logs] [--url http://localhost:51992/popstudy/api/] [--concurrency 8]
+                                [--time-scale 10] [--clients 4] [--sample-pool] [--output replay.json]
+"""
+from benchmarks.bench import DEFAULT_URL, PERCENTILES, send, percentile
+from typing import Dict, List, Optional
+from datetime import datetime
+from threading import Event, Semaphore, Thread
+from prettytable import PrettyTable
+from loguru import logger
+import concurrent.futures
+import urllib.request
+import urllib.error
+import argparse
+import glob
+import json
+import ast
+import os
+import re
+import time
+
+# as formatted by the file logger of main.py, e.g.
+# 2020-11-26 10:52:25.081 | 12 | INFO     | server.api:go:88 - new request to /annotate with request_body: {...}
+LOG_LINE = re.compile(r'^(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}) \| (?P<request_id>[^|]+) \| INFO\s*\| '
+                      r'.* - new request to /(?P<log_name>\w+) with (?:request_body: (?P<body>.*)|attribute (?P<attribute>\S+))$')
+LOG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# some endpoints log a name different from their path
+ENDPOINT_PATH = {
+    'donor_distribution': 'donor_grouping',
+    'variant_distribution': 'variant_grouping'
+}
+POOL_METRICS = ['varsum_db_pool_size', 'varsum_db_pool_checked_out', 'varsum_db_pool_overflow']
+POOL_SAMPLING_PERIOD = 1.0  # seconds
+
+
+class RecordedRequest:
+    def __init__(self, timestamp: float, endpoint: str, path: str, body: Optional[dict]):
+        self.timestamp = timestamp
+        self.endpoint = endpoint
+        self.path = path
+        self.body = body
+
+
+def parse_logs(log_dir: str) -> List[RecordedRequest]:
+    """
+    :return: the requests found in the log files of log_dir, sorted by time.
+    """
+    workload = []
+    for file_name in sorted(glob.glob(os.path.join(log_dir, 'log_*.log'))):
+        with open(file_name, encoding='utf-8', errors='replace') as log_file:
+            for line in log_file:
+                match = LOG_LINE.match(line.rstrip('\n'))
+                if match is None:
+                    continue
+                timestamp = datetime.strptime(match.group('time'), LOG_TIME_FORMAT).timestamp()
+                endpoint = ENDPOINT_PATH.get(match.group('log_name'), match.group('log_name'))
+                if match.group('attribute') is not None:
+                    workload.append(RecordedRequest(timestamp, 'values', f'values/{match.group("attribute")}', None))
+                    continue
+                try:
+                    # the body is logged as the repr of a python dictionary
+                    body = ast.literal_eval(match.group('body'))
+                except (ValueError, SyntaxError):
+                    logger.warning(f'unable to parse the request body in {file_name}: {match.group("body")[:100]}')
+                    continue
+                workload.append(RecordedRequest(timestamp, endpoint, endpoint, body))
+    workload.sort(key=lambda r: r.timestamp)
+    return workload
+
+
+class PoolSampler(Thread):
+    """
+    Periodically reads the status of the database connection pool from the endpoint /metrics of the server.
+    """
+    def __init__(self, base_url: str):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.samples: List[Dict[str, float]] = []
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.wait(POOL_SAMPLING_PERIOD):
+            try:
+                with urllib.request.urlopen(self.base_url + 'metrics', timeout=5) as response:
+                    text = response.read().decode('utf-8')
+            except (urllib.error.URLError, OSError):
+                continue
+            sample = {}
+            for line in text.splitlines():
+                name, _, value = line.partition(' ')
+                if name in POOL_METRICS:
+                    sample[name] = float(value)
+            if sample:
+                self.samples.append(sample)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        checked_out = [s.get('varsum_db_pool_checked_out', 0) for s in self.samples]
+        saturated = [s for s in self.samples
+                     if s.get('varsum_db_pool_checked_out', 0) >= s.get('varsum_db_pool_size', float('inf'))]
+        return {
+            'samples': len(self.samples),
+            'pool_size': self.samples[-1].get('varsum_db_pool_size'),
+            'max_checked_out': max(checked_out),
+            'mean_checked_out': sum(checked_out) / len(checked_out),
+            'max_overflow': max(s.get('varsum_db_pool_overflow', 0) for s in self.samples),
+            'saturated_fraction': len(saturated) / len(self.samples)
+        }
+
+
+def replay(workload: List[RecordedRequest], base_url: str, concurrency: int, time_scale: float, clients: int,
+           timeout: float) -> List[tuple]:
+    """
+    Sends the requests at their original relative time divided by time_scale, with at most concurrency requests in
+    flight (later requests are delayed while the limit is reached).
+    :param clients: number of distinct clients to simulate (through the header X-Forwarded-For)
+    :return: a list of (endpoint, status, latency) for each request; status is 0 if the server is unreachable.
+    """
+    slots = Semaphore(concurrency)
+
+    def one_request(index: int, recorded: RecordedRequest):
+        headers = {'X-Forwarded-For': f'10.0.0.{index % clients + 1}'} if clients > 1 else None
+        start = time.perf_counter()
+        try:
+            status, _ = send(base_url, recorded.path, recorded.body, timeout, headers)
+        except (urllib.error.URLError, OSError):
+            status = 0
+        finally:
+            slots.release()
+        return recorded.endpoint, status, time.perf_counter() - start
+
+    replay_start = time.perf_counter()
+    first_timestamp = workload[0].timestamp
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, recorded in enumerate(workload):
+            delay = (recorded.timestamp - first_timestamp) / time_scale - (time.perf_counter() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+            slots.acquire()
+            futures.append(executor.submit(one_request, index, recorded))
+    return [future.result() for future in futures]
+
+
+def report(outcomes: List[tuple], elapsed: float) -> Dict[str, dict]:
+    by_endpoint: Dict[str, List[tuple]] = {}
+    for endpoint, status, latency in outcomes:
+        by_endpoint.setdefault(endpoint, []).append((status, latency))
+    by_endpoint['ALL'] = [(status, latency) for _, status, latency in outcomes]
+    result = {}
+    for endpoint, endpoint_outcomes in by_endpoint.items():
+        latencies = sorted(latency for _, latency in endpoint_outcomes)
+        status_codes: Dict[str, int] = {}
+        for status, _ in endpoint_outcomes:
+            status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+        # 4xx responses are answers of the API (e.g. empty population), 429, 5xx and unreachable server are errors
+        errors = sum(1 for status, _ in endpoint_outcomes if status == 0 or status == 429 or status >= 500)
+        result[endpoint] = {
+            'requests': len(endpoint_outcomes),
+            'status_codes': status_codes,
+            'error_rate': errors / len(endpoint_outcomes),
+            'throughput_rps': len(endpoint_outcomes) / elapsed,
+            'mean': sum(latencies) / len(latencies),
+            'max': latencies[-1]
+        }
+        for p in PERCENTILES:
+            result[endpoint][f'p{p}'] = percentile(latencies, p)
+    table = PrettyTable(['ENDPOINT', 'REQUESTS', 'ERROR RATE', 'REQ/S'] + [f'P{p} (s)' for p in PERCENTILES])
+    for endpoint, stats in result.items():
+        table.add_row([endpoint, stats['requests'], f"{stats['error_rate']:.1%}", f"{stats['throughput_rps']:.2f}"] +
+                      [f"{stats[f'p{p}']:.3f}" for p in PERCENTILES])
+    print(table)
+    return result
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Replays the requests recorded in the server logs.')
+    parser.add_argument('--logs', default='./logs', help='directory of the log files')
+    parser.add_argument('--url', default=DEFAULT_URL, help='base URL of the API')
+    parser.add_argument('--concurrency', type=int, default=8, help='maximum number of requests in flight')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='speed-up of the replay with respect to the recorded time (e.g. 10 = 10 times faster)')
+    parser.add_argument('--clients', type=int, default=1, help='number of distinct clients to simulate')
+    parser.add_argument('--endpoints', nargs='*', help='replay only these endpoints (e.g. donor_grouping values)')
+    parser.add_argument('--limit', type=int, help='replay only the first LIMIT requests')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds')
+    parser.add_argument('--sample-pool', action='store_true',
+                        help='samples the saturation of the database connection pool from /metrics')
+    parser.add_argument('--output', help='file where results are saved as JSON')
+    options = parser.parse_args(args)
+    base_url = options.url if options.url.endswith('/') else options.url + '/'
+
+    workload = parse_logs(options.logs)
+    if options.endpoints:
+        workload = [r for r in workload if r.endpoint in options.endpoints]
+    if options.limit:
+        workload = workload[:options.limit]
+    if not workload:
+        logger.error(f'no request found in {options.logs}')
+        return
+    logger.info(f'replaying {len(workload)} requests recorded in '
+                f'{workload[-1].timestamp - workload[0].timestamp:.0f} seconds')
+
+    sampler = PoolSampler(base_url) if options.sample_pool else None
+    if sampler is not None:
+        sampler.start()
+    start = time.perf_counter()
+    outcomes = replay(workload, base_url, options.concurrency, options.time_scale, options.clients, options.timeout)
+    elapsed = time.perf_counter() - start
+    if sampler is not None:
+        sampler.stop()
+
+    results = {'elapsed': elapsed, 'endpoints': report(outcomes, elapsed)}
+    if sampler is not None:
+        results['db_pool'] = sampler.summary()
+        print(f"database connection pool: {results['db_pool']}")
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        logger.info(f'results saved in {options.output}')
+
+
+if __name__ == '__main__':
+    main()
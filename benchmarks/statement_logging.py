@@ -0,0 +1,127 @@
+"""
+Micro-benchmark of the CPU spent by a request for logging its SQL statements. It runs without a database: a request is
+simulated by building statements shaped like the ones of the sources (a filter on a panel of variants and an aggregation
+of the population by strata) and by logging them as the sources do. The compared configurations are:
+- ALWAYS: every statement rendered with literal values and logged at DEBUG into a synchronous file sink at level TRACE,
+as before the introduction of database.sql_logging;
+- DISABLED: no sink for the SQL statements, so no statement is rendered;
+- SAMPLED: the statements of a fraction of the requests are rendered and written by the enqueued sink of
+database.sql_logging.
+
+Usage:
+
+    python -m benchmarks.statement_logging [--requests 200] [--variants 100] [--sample-rate 0.01]
+                                           [--output statement_logging.json]
+"""
+from typing import Callable, List, Optional
+from types import SimpleNamespace
+from prettytable import PrettyTable
+from loguru import logger
+from sqlalchemy import MetaData, Table, Column, Integer, SmallInteger, BigInteger, String, select, func
+from sqlalchemy.dialects import postgresql
+import database.db_utils as db_utils
+from database import sql_logging
+from data_sources.kgenomes.kgenomes import KGenomes
+from data_sources.io_parameters import Mutation
+import argparse
+import tempfile
+import random
+import json
+import time
+import sys
+import os
+
+STATEMENTS_PER_REQUEST = 10
+
+db_meta = MetaData()
+genomes = Table('kgenomes_red', db_meta,
+                Column('item_id', Integer), Column('chrom', SmallInteger), Column('start', BigInteger),
+                Column('stop', BigInteger), Column('ref', String), Column('alt', String), Column('id', String),
+                Column('al1', SmallInteger), Column('al2', SmallInteger),
+                schema='rr')
+metadata = Table('genomes_metadata_3', db_meta,
+                 Column('item_id', Integer), Column('gender', String), Column('population', String),
+                 Column('super_population', String), Column('dna_source', String), Column('assembly', String),
+                 schema='dw')
+# show_stmt only needs the dialect of the connection
+connection = SimpleNamespace(dialect=postgresql.dialect())
+
+
+def request_statements(number_of_variants: int) -> list:
+    variants = [Mutation(random.randint(1, 22), random.randint(1, 10 ** 8), 'A', 'T')
+                for _ in range(number_of_variants)]
+    with_variants = KGenomes._stmt_where_region_is_any_of_mutations(
+        *variants, from_table=genomes, select_expression=select([genomes.c.item_id])).alias('with_variants')
+    by_strata = select([metadata.c.population, metadata.c.gender, func.count().label('POPULATION_SIZE')]) \
+        .where(metadata.c.assembly == 'hg19') \
+        .where(metadata.c.super_population == random.choice(['EUR', 'AFR', 'EAS'])) \
+        .where(metadata.c.item_id.in_(select([with_variants.c.item_id]))) \
+        .group_by(metadata.c.population, metadata.c.gender)
+    return [by_strata] * STATEMENTS_PER_REQUEST
+
+
+def log_literal(stmt, log_function, intro):
+    log_function('###   ' + intro + '   ###')
+    log_function(str(stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})))
+
+
+def simulate(requests: List[list], log_sql: Callable, log_stmt: Callable, log_function: Callable) -> float:
+    """
+    :return: the CPU time spent by the requests, in seconds
+    """
+    start = time.process_time()
+    for statements in requests:
+        log_sql_statements = log_sql()
+        for stmt in statements:
+            if log_sql_statements:
+                log_stmt(stmt, log_function, 'BENCHMARK STATEMENT')
+    return time.process_time() - start
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark of the CPU spent for logging the SQL statements.')
+    parser.add_argument('--requests', type=int, default=200, help='number of simulated requests')
+    parser.add_argument('--variants', type=int, default=100, help='variants in the filter of each request')
+    parser.add_argument('--sample-rate', type=float, default=0.01, help='fraction of requests logged by SAMPLED')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='statement_logging.json', help='file where results are saved')
+    options = parser.parse_args(args)
+
+    random.seed(options.seed)
+    requests = [request_statements(options.variants) for _ in range(options.requests)]
+    request_logger = logger.bind(request_id='benchmark')
+    results = []
+    with tempfile.TemporaryDirectory() as log_dir:
+        logger.remove()
+        logger.add(os.path.join(log_dir, 'always.log'), level='TRACE', backtrace=True, diagnose=True)
+        cpu_time = simulate(requests, lambda: True, log_literal, request_logger.debug)
+        results.append(dict(configuration='ALWAYS', cpu_time=cpu_time))
+
+        logger.remove()
+        logger.add(os.path.join(log_dir, 'server.log'), level='DEBUG', enqueue=True)
+        cpu_time = simulate(requests, sql_logging.sample, lambda stmt, log_function, intro:
+                            db_utils.show_stmt(connection, stmt, log_function, intro),
+                            sql_logging.log_function(request_logger))
+        results.append(dict(configuration='DISABLED', cpu_time=cpu_time))
+
+        sql_logging.configure(os.path.join(log_dir, 'sql.log'), options.sample_rate)
+        cpu_time = simulate(requests, sql_logging.sample, lambda stmt, log_function, intro:
+                            db_utils.show_stmt(connection, stmt, log_function, intro),
+                            sql_logging.log_function(request_logger))
+        results.append(dict(configuration=f'SAMPLED ({options.sample_rate})', cpu_time=cpu_time))
+        logger.complete()
+        logger.remove()
+
+    table = PrettyTable(['CONFIGURATION', 'CPU TIME (s)', 'CPU TIME PER REQUEST (ms)'])
+    for result in results:
+        result['cpu_time_per_request'] = result['cpu_time'] / options.requests
+        table.add_row([result['configuration'], f"{result['cpu_time']:.3f}",
+                       f"{result['cpu_time_per_request'] * 1000:.3f}"])
+    print(table)
+    with open(options.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,453 @@
+"""
+Generator of a synthetic database with the same schema used by VarSum (tables dw.genomes_metadata_3, rr.kgenomes_red,
+rr.tcga_dnaseq_2, rr.gencode_red, public.item, public.dataset and the functions in assets/), so that the API can be run,
+benchmarked and profiled without access to the GeCo repository.
+
+Data is random but has realistic characteristics: 1000Genomes-like individuals with phased genotypes (al1/al2) drawn from
+a site frequency spectrum dominated by rare variants, hemizygous sex chromosomes for males (outside the pseudo-autosomal
+regions), TCGA-like patients with a few hundreds of somatic mutations and recurrent hotspots, rsIDs and Gencode-like
+genes. Tables are loaded with COPY and indexed afterwards.
+
+The server connects to a database named as in database/database.py, so the synthetic database is meant to be created
+in a separate local PostgreSQL instance. Usage:
+
+    python -m benchmarks.synthetic_db <db_user> <db_password> <db_port> [--scale toy|small|medium|1000genomes] [--seed N]
+"""
+from typing import Dict, Iterator, List, Optional, Sequence
+from loguru import logger
+import numpy
+import psycopg2
+import argparse
+import os
+import time
+
+DEFAULT_DATABASE_NAME = 'gmql_meta_new16_tom2'
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+ASSEMBLIES = ['hg19', 'grch38']
+
+# number of 1000Genomes individuals, TCGA patients, variants per 1000Genomes individual, somatic mutations per TCGA
+# patient, genes per assembly
+SCALES = {
+    'toy': dict(kgenomes_donors=60, tcga_donors=60, variants_per_donor=2000, mutations_per_donor=50, genes=300),
+    'small': dict(kgenomes_donors=500, tcga_donors=500, variants_per_donor=20000, mutations_per_donor=232, genes=5000),
+    'medium': dict(kgenomes_donors=2504, tcga_donors=2000, variants_per_donor=200000, mutations_per_donor=232,
+                   genes=20000),
+    # the size of the data in the GeCo repository
+    '1000genomes': dict(kgenomes_donors=2504, tcga_donors=10000, variants_per_donor=4144924, mutations_per_donor=232,
+                        genes=60000)
+}
+
+# chromosome lengths (hg19); 23 = X, 24 = Y, 25 = MT
+CHROM_LENGTH = {
+    1: 249250621, 2: 243199373, 3: 198022430, 4: 191154276, 5: 180915260, 6: 171115067, 7: 159138663,
+    8: 146364022, 9: 141213431, 10: 135534747, 11: 135006516, 12: 133851895, 13: 115169878, 14: 107349540,
+    15: 102531392, 16: 90354753, 17: 81195210, 18: 78077248, 19: 59128983, 20: 63025520, 21: 48129895,
+    22: 51304566, 23: 155270560, 24: 59373566, 25: 16569
+}
+# pseudo-autosomal regions of chromosome X as in assets/rr.mut_frequency_new_*.sql
+PAR_BOUNDS = {
+    'hg19': (2699520, 154931044),
+    'grch38': (2781479, 155701383)
+}
+SUPER_POPULATIONS = {
+    'AFR': ['YRI', 'LWK', 'GWD', 'MSL', 'ESN', 'ASW', 'ACB'],
+    'AMR': ['MXL', 'PUR', 'CLM', 'PEL'],
+    'EAS': ['CHB', 'JPT', 'CHS', 'CDX', 'KHV'],
+    'EUR': ['CEU', 'TSI', 'FIN', 'GBR', 'IBS'],
+    'SAS': ['GIH', 'PJL', 'BEB', 'STU', 'ITU']
+}
+TCGA_DISEASES = ['breast invasive carcinoma', 'brain lower grade glioma', 'glioblastoma multiforme',
+                 'lung adenocarcinoma', 'colon adenocarcinoma', 'ovarian serous cystadenocarcinoma',
+                 'kidney renal clear cell carcinoma', 'skin cutaneous melanoma', 'prostate adenocarcinoma',
+                 'thyroid carcinoma']
+TCGA_ETHNICITIES = ['white', 'black or african american', 'asian', 'not reported', 'american indian or alaska native',
+                    'native hawaiian or other pacific islander']
+TCGA_ETHNICITY_WEIGHTS = [0.72, 0.09, 0.06, 0.11, 0.01, 0.01]
+# genes with known coordinates (chrom, hg19 start, hg19 stop, grch38 start, grch38 stop, strand); somatic hotspots are
+# placed inside them
+KNOWN_GENES = {
+    'TP53': (17, 7565097, 7590856, 7661779, 7687550, -1),
+    'BRCA1': (17, 41196312, 41277500, 43044295, 43125483, -1),
+    'BRCA2': (13, 32889611, 32973805, 32315474, 32400266, 1),
+    'EGFR': (7, 55086725, 55275031, 55019017, 55211628, 1),
+    'IDH1': (2, 209100951, 209119806, 208236227, 208255071, -1)
+}
+GENE_TYPES = ['protein_coding', 'pseudogene', 'lincRNA', 'antisense', 'miRNA', 'snRNA', 'misc_RNA', 'snoRNA',
+              'processed_transcript', 'sense_intronic']
+GENE_TYPE_WEIGHTS = [0.35, 0.25, 0.12, 0.1, 0.06, 0.04, 0.03, 0.02, 0.02, 0.01]
+GERMLINE_MUT_TYPES = ['SNP', 'DEL', 'INS', 'MNP', 'CNV', 'SVA', 'ALU', 'LINE1']
+GERMLINE_MUT_TYPE_WEIGHTS = [0.9, 0.045, 0.045, 0.005, 0.002, 0.001, 0.001, 0.001]
+SOMATIC_MUT_TYPES = ['SNP', 'DEL', 'INS', 'DNP', 'TNP']
+SOMATIC_MUT_TYPE_WEIGHTS = [0.9, 0.05, 0.03, 0.015, 0.005]
+SOMATIC_HOTSPOT_PROBABILITY = 0.03
+SITES_PER_CHUNK = 1000
+BASES = numpy.array(list('ACGT'))
+
+
+class _RowStream:
+    """
+    File-like object returning rows in the text format of COPY, generated only when read. This allows loading tables
+    larger than the available memory.
+    """
+    def __init__(self, rows: Iterator[Sequence]):
+        self._lines = (_copy_line(row) for row in rows)
+        self._buffer = bytearray()
+        self.num_rows = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+            self.num_rows += 1
+        if size < 0:
+            size = len(self._buffer)
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return chunk
+
+    def readline(self, size: int = -1) -> bytes:
+        return next(self._lines, b'')
+
+
+def _copy_line(row: Sequence) -> bytes:
+    return ('\t'.join('\\N' if value is None else str(value) for value in row) + '\n').encode('utf-8')
+
+
+def copy_rows(cursor, table: str, columns: List[str], rows: Iterator[Sequence]) -> int:
+    stream = _RowStream(rows)
+    cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', stream)
+    logger.info(f'{table}: {stream.num_rows} rows loaded')
+    return stream.num_rows
+
+
+# ###########################       SCHEMA
+SCHEMA_DDL = [
+    'CREATE SCHEMA IF NOT EXISTS dw',
+    'CREATE SCHEMA IF NOT EXISTS rr',
+    'CREATE SCHEMA IF NOT EXISTS temp',
+    'CREATE TABLE public.dataset ('
+    '   dataset_id integer PRIMARY KEY, dataset_name varchar NOT NULL, assembly varchar)',
+    'CREATE TABLE public.item ('
+    '   item_id integer PRIMARY KEY, dataset_id integer REFERENCES public.dataset, item_source_id varchar, '
+    '   file_name varchar, local_url varchar)',
+    # in the GeCo repository this is a materialized view (see assets/dw.genomes_metadata_3.sql) over the tables of
+    # the metadata manager, which are not needed by VarSum
+    'CREATE TABLE dw.genomes_metadata_3 ('
+    '   donor_id integer, donor_source_id varchar, item_id integer, item_source_id varchar, file_name varchar, '
+    '   local_url varchar, assembly text, gender varchar, health_status boolean, disease text, population varchar, '
+    '   ethnicity varchar, super_population varchar, dna_source varchar)',
+    'CREATE TABLE rr.kgenomes_red ('
+    '   item_id integer, chrom smallint, start bigint, stop bigint, strand smallint, ref varchar, alt varchar, '
+    '   length integer, mut_type varchar, id varchar, quality double precision, filter varchar, al1 smallint, '
+    '   al2 smallint)',
+    'CREATE TABLE rr.tcga_dnaseq_2 ('
+    '   item_id integer, chrom smallint, start bigint, stop bigint, strand smallint, ref varchar, alt varchar, '
+    '   mut_type varchar, id varchar, al1 smallint, al2 smallint)',
+    'CREATE TABLE rr.gencode_red ('
+    '   item_id integer, chrom smallint, start bigint, stop bigint, strand smallint, gene_name varchar, '
+    '   gene_type varchar, gene_id varchar)'
+]
+INDEX_DDL = [
+    'CREATE INDEX ON dw.genomes_metadata_3 (item_id)',
+    'CREATE INDEX ON rr.kgenomes_red (chrom, start, ref, alt)',
+    'CREATE INDEX ON rr.kgenomes_red (id)',
+    'CREATE INDEX ON rr.kgenomes_red (item_id)',
+    'CREATE INDEX ON rr.tcga_dnaseq_2 (chrom, start, ref, alt)',
+    'CREATE INDEX ON rr.tcga_dnaseq_2 (id)',
+    'CREATE INDEX ON rr.tcga_dnaseq_2 (item_id)',
+    'CREATE INDEX ON rr.gencode_red (gene_name)',
+    'CREATE INDEX ON rr.gencode_red (chrom, start, stop)'
+]
+DROP_DDL = [
+    'DROP SCHEMA IF EXISTS dw CASCADE',
+    'DROP SCHEMA IF EXISTS rr CASCADE',
+    'DROP SCHEMA IF EXISTS temp CASCADE',
+    'DROP TABLE IF EXISTS public.item CASCADE',
+    'DROP TABLE IF EXISTS public.dataset CASCADE'
+]
+FUNCTION_FILES = ['dw.kgenomes_ethnicity.sql', 'rr.mut_frequency_new_hg19.sql', 'rr.mut_frequency_new_grch38.sql']
+
+
+def create_schema(cursor, drop_existing: bool):
+    if drop_existing:
+        for stmt in DROP_DDL:
+            cursor.execute(stmt)
+    for stmt in SCHEMA_DDL:
+        cursor.execute(stmt)
+    for file_name in FUNCTION_FILES:
+        with open(os.path.join(ASSETS_DIR, file_name)) as sql_file:
+            cursor.execute(sql_file.read())
+
+
+# ###########################       DATA
+class Generator:
+
+    def __init__(self, kgenomes_donors: int, tcga_donors: int, variants_per_donor: int, mutations_per_donor: int,
+                 genes: int, seed: int):
+        self.kgenomes_donors = kgenomes_donors
+        self.tcga_donors = tcga_donors
+        self.variants_per_donor = variants_per_donor
+        self.mutations_per_donor = mutations_per_donor
+        self.genes = genes
+        self.rng = numpy.random.default_rng(seed)
+        self.next_item_id = 1
+        self.next_rs_id = 1
+        self.datasets: List[tuple] = []
+        self.items: List[tuple] = []
+        self.metadata: List[tuple] = []
+        # item_id of every donor in each assembly, with the donor gender
+        self.kgenomes_items: Dict[str, List[tuple]] = {}
+        self.tcga_items: Dict[str, List[tuple]] = {}
+        self.gencode_items: Dict[str, int] = {}
+
+    def _new_item(self, dataset_id: int, item_source_id: str) -> int:
+        item_id = self.next_item_id
+        self.next_item_id += 1
+        file_name = f'{item_source_id}.bed'
+        self.items.append((item_id, dataset_id, item_source_id, file_name,
+                           f'http://www.gmql.eu/gmql-rest/datasets/public.{dataset_id}/{file_name}'))
+        return item_id
+
+    def generate_items_and_metadata(self):
+        dataset_id = 0
+        # 1000Genomes
+        populations = [(pop, super_pop) for super_pop, pops in SUPER_POPULATIONS.items() for pop in pops]
+        donors = []
+        for donor_idx in range(self.kgenomes_donors):
+            population, super_population = populations[self.rng.integers(len(populations))]
+            donors.append((donor_idx + 1,
+                           f'{"HG" if donor_idx % 2 else "NA"}{donor_idx:05d}',
+                           'female' if self.rng.random() < 0.5 else 'male',
+                           population,
+                           super_population,
+                           'lcl' if self.rng.random() < 0.95 else 'blood'))
+        for assembly in ASSEMBLIES:
+            dataset_id += 1
+            self.datasets.append((dataset_id, f'{assembly.upper()}_1000GENOMES_2019_10', assembly))
+            self.kgenomes_items[assembly] = []
+            for donor_id, donor_source_id, gender, population, super_population, dna_source in donors:
+                item_source_id = f'{donor_source_id}_{assembly}'
+                item_id = self._new_item(dataset_id, item_source_id)
+                self.kgenomes_items[assembly].append((item_id, gender))
+                self.metadata.append((donor_id, donor_source_id, item_id, item_source_id, f'{item_source_id}.bed',
+                                      self.items[-1][4], assembly, gender, True, 'none', population,
+                                      _ethnicity_of_super_population(super_population), super_population, dna_source))
+        # TCGA
+        donors = []
+        for donor_idx in range(self.tcga_donors):
+            gender_draw = self.rng.random()
+            donors.append((self.kgenomes_donors + donor_idx + 1,
+                           f'{self.rng.integers(16**8):08x}-{self.rng.integers(16**4):04x}-{donor_idx:012x}',
+                           'female' if gender_draw < 0.49 else 'male' if gender_draw < 0.98 else 'not reported',
+                           TCGA_ETHNICITIES[self.rng.choice(len(TCGA_ETHNICITIES), p=TCGA_ETHNICITY_WEIGHTS)],
+                           TCGA_DISEASES[self.rng.integers(len(TCGA_DISEASES))]))
+        for assembly, dataset_name in [('hg19', 'HG19_TCGA_dnaseq'), ('grch38', 'GRCh38_TCGA_somatic_mutation_masked')]:
+            dataset_id += 1
+            self.datasets.append((dataset_id, dataset_name, assembly))
+            self.tcga_items[assembly] = []
+            for donor_id, donor_source_id, gender, ethnicity, disease in donors:
+                item_source_id = f'{donor_source_id}_{assembly}'
+                item_id = self._new_item(dataset_id, item_source_id)
+                self.tcga_items[assembly].append((item_id, gender))
+                self.metadata.append((donor_id, donor_source_id, item_id, item_source_id, f'{item_source_id}.bed',
+                                      self.items[-1][4], assembly, gender, False, disease, None, ethnicity, None,
+                                      None))
+        # Gencode
+        for assembly, item_source_id in [('hg19', 'Gencode_hg19_v10_gene'), ('grch38', 'Gencode_GRCh38_v27_gene')]:
+            dataset_id += 1
+            self.datasets.append((dataset_id, 'GRCh38_ANNOTATION_GENCODE' if assembly == 'grch38'
+                                  else 'HG19_ANNOTATION_GENCODE', assembly))
+            self.gencode_items[assembly] = self._new_item(dataset_id, item_source_id)
+
+    def _random_positions(self, count: int, chromosomes: Sequence[int]) -> (numpy.ndarray, numpy.ndarray):
+        """Returns chrom and start of count random positions uniformly distributed on the given chromosomes, sorted."""
+        lengths = numpy.array([CHROM_LENGTH[c] for c in chromosomes], dtype=numpy.float64)
+        chroms = numpy.array(chromosomes)[self.rng.choice(len(chromosomes), size=count, p=lengths / lengths.sum())]
+        starts = (self.rng.random(count) * numpy.array([CHROM_LENGTH[c] for c in chroms])).astype(numpy.int64)
+        order = numpy.lexsort((starts, chroms))
+        return chroms[order], starts[order]
+
+    def _random_alleles(self, mut_type: str) -> (str, str):
+        if mut_type == 'SNP':
+            ref, alt = self.rng.choice(4, size=2, replace=False)
+            return BASES[ref], BASES[alt]
+        elif mut_type in ('MNP', 'DNP', 'TNP'):
+            length = 3 if mut_type == 'TNP' else 2
+            return ''.join(BASES[self.rng.integers(4, size=length)]), ''.join(BASES[self.rng.integers(4, size=length)])
+        elif mut_type == 'INS':
+            return '', ''.join(BASES[self.rng.integers(4, size=self.rng.integers(1, 10))])
+        elif mut_type == 'DEL':
+            return ''.join(BASES[self.rng.integers(4, size=self.rng.integers(1, 10))]), ''
+        else:   # structural variants
+            return BASES[self.rng.integers(4)], f'<{mut_type}>'
+
+    def _rs_id(self, probability: float) -> Optional[str]:
+        if self.rng.random() < probability:
+            self.next_rs_id += 1
+            return f'rs{self.next_rs_id}'
+        return None
+
+    def _allele_frequencies(self, count: int) -> numpy.ndarray:
+        # the site frequency spectrum of human populations is dominated by rare variants
+        return numpy.clip(self.rng.beta(0.1, 1.2, size=count), 1e-4, 1.0)
+
+    def kgenomes_rows(self, assembly: str) -> Iterator[tuple]:
+        items = self.kgenomes_items[assembly]
+        item_ids = numpy.array([item_id for item_id, _ in items])
+        is_male = numpy.array([gender == 'male' for _, gender in items])
+        # choose the number of sites so that each individual carries variants_per_donor variants on average
+        sample_af = self._allele_frequencies(100000)
+        carrier_probability = (1 - (1 - sample_af) ** 2).mean()
+        num_sites = max(1, int(self.variants_per_donor / carrier_probability))
+        chroms, starts = self._random_positions(num_sites, list(CHROM_LENGTH.keys()))
+        par_start, par_stop = PAR_BOUNDS[assembly]
+        for chunk_start in range(0, num_sites, SITES_PER_CHUNK):
+            chunk_chroms = chroms[chunk_start:chunk_start + SITES_PER_CHUNK]
+            chunk_starts = starts[chunk_start:chunk_start + SITES_PER_CHUNK]
+            af = self._allele_frequencies(len(chunk_chroms))[:, None]
+            # phased genotypes: each chromosome copy carries the variant independently
+            al1 = self.rng.random((len(chunk_chroms), len(items))) < af
+            al2 = self.rng.random((len(chunk_chroms), len(items))) < af
+            # a single copy for males on X (outside the PAR) and Y, and for everyone on MT
+            haploid = ((chunk_chroms == 23) & ((chunk_starts >= par_start) & (chunk_starts <= par_stop)))[:, None] \
+                & is_male[None, :]
+            haploid |= (chunk_chroms == 24)[:, None] | (chunk_chroms == 25)[:, None]
+            al2 &= ~haploid
+            carriers = (al1 | al2) & ~((chunk_chroms == 24)[:, None] & ~is_male[None, :])
+            sites, donors = numpy.nonzero(carriers)
+            site_attributes = {}
+            for site, donor in zip(sites, donors):
+                attributes = site_attributes.get(site)
+                if attributes is None:
+                    mut_type = GERMLINE_MUT_TYPES[self.rng.choice(len(GERMLINE_MUT_TYPES), p=GERMLINE_MUT_TYPE_WEIGHTS)]
+                    ref, alt = self._random_alleles(mut_type)
+                    start = int(chunk_starts[site])
+                    attributes = site_attributes[site] = (int(chunk_chroms[site]), start, start + max(len(ref), 1),
+                                                          ref, alt, max(len(ref), len(alt)), mut_type,
+                                                          self._rs_id(0.85))
+                chrom, start, stop, ref, alt, length, mut_type, rs_id = attributes
+                yield (int(item_ids[donor]), chrom, start, stop, None, ref, alt, length, mut_type, rs_id, 100.0,
+                       'PASS', int(al1[site, donor]), None if haploid[site, donor] else int(al2[site, donor]))
+
+    def tcga_rows(self, assembly: str) -> Iterator[tuple]:
+        items = self.tcga_items[assembly]
+        hotspots = []
+        for chrom, hg19_start, hg19_stop, grch38_start, grch38_stop, _ in KNOWN_GENES.values():
+            gene_start, gene_stop = (hg19_start, hg19_stop) if assembly == 'hg19' else (grch38_start, grch38_stop)
+            for position in self.rng.integers(gene_start, gene_stop, size=3):
+                mut_type = 'SNP'
+                hotspots.append((chrom, int(position)) + self._random_alleles(mut_type) + (mut_type,))
+        rows = []
+        for item_id, gender in items:
+            # mutational burden is heavy-tailed: a few tumors are hypermutated
+            num_mutations = max(1, int(self.rng.lognormal(numpy.log(self.mutations_per_donor) - 0.5, 1.0)))
+            chromosomes = list(range(1, 24)) + ([24] if gender == 'male' else [])
+            chroms, starts = self._random_positions(num_mutations, chromosomes)
+            for chrom, start in zip(chroms, starts):
+                if self.rng.random() < SOMATIC_HOTSPOT_PROBABILITY:
+                    chrom, start, ref, alt, mut_type = hotspots[self.rng.integers(len(hotspots))]
+                else:
+                    mut_type = SOMATIC_MUT_TYPES[self.rng.choice(len(SOMATIC_MUT_TYPES), p=SOMATIC_MUT_TYPE_WEIGHTS)]
+                    ref, alt = self._random_alleles(mut_type)
+                # somatic mutations are mostly heterozygous
+                al2 = 1 if self.rng.random() < 0.1 else 0
+                rows.append((item_id, int(chrom), int(start), int(start) + max(len(ref), 1), None, ref, alt,
+                             mut_type, self._rs_id(0.1), 1, al2))
+        rows.sort(key=lambda row: (row[1], row[2]))
+        return iter(rows)
+
+    def gencode_rows(self, assembly: str) -> Iterator[tuple]:
+        item_id = self.gencode_items[assembly]
+        gene_idx = 0
+        for gene_name, (chrom, hg19_start, hg19_stop, grch38_start, grch38_stop, strand) in KNOWN_GENES.items():
+            gene_idx += 1
+            start, stop = (hg19_start, hg19_stop) if assembly == 'hg19' else (grch38_start, grch38_stop)
+            yield item_id, chrom, start, stop, strand, gene_name, 'protein_coding', f'ENSG{gene_idx:011d}'
+        chroms, starts = self._random_positions(max(0, self.genes - len(KNOWN_GENES)), list(range(1, 26)))
+        for chrom, start in zip(chroms, starts):
+            gene_idx += 1
+            length = int(min(self.rng.lognormal(9.5, 1.2), 2000000))
+            yield (item_id, int(chrom), int(start), int(min(start + length, CHROM_LENGTH[int(chrom)])),
+                   1 if self.rng.random() < 0.5 else -1, f'SYN{gene_idx}',
+                   GENE_TYPES[self.rng.choice(len(GENE_TYPES), p=GENE_TYPE_WEIGHTS)], f'ENSG{gene_idx:011d}')
+
+
+def _ethnicity_of_super_population(super_population: str) -> str:
+    # same as assets/dw.kgenomes_ethnicity.sql
+    return {
+        'AMR': 'latin american',
+        'EUR': 'white',
+        'AFR': 'black or african american',
+        'SAS': 'asian',
+        'EAS': 'asian'
+    }.get(super_population, 'not reported')
+
+
+def generate(connection, generator: Generator, drop_existing: bool):
+    start_time = time.time()
+    cursor = connection.cursor()
+    create_schema(cursor, drop_existing)
+    generator.generate_items_and_metadata()
+    copy_rows(cursor, 'public.dataset', ['dataset_id', 'dataset_name', 'assembly'], iter(generator.datasets))
+    copy_rows(cursor, 'public.item', ['item_id', 'dataset_id', 'item_source_id', 'file_name', 'local_url'],
+              iter(generator.items))
+    copy_rows(cursor, 'dw.genomes_metadata_3',
+              ['donor_id', 'donor_source_id', 'item_id', 'item_source_id', 'file_name', 'local_url', 'assembly',
+               'gender', 'health_status', 'disease', 'population', 'ethnicity', 'super_population', 'dna_source'],
+              iter(generator.metadata))
+    for assembly in ASSEMBLIES:
+        copy_rows(cursor, 'rr.kgenomes_red',
+                  ['item_id', 'chrom', 'start', 'stop', 'strand', 'ref', 'alt', 'length', 'mut_type', 'id', 'quality',
+                   'filter', 'al1', 'al2'],
+                  generator.kgenomes_rows(assembly))
+        copy_rows(cursor, 'rr.tcga_dnaseq_2',
+                  ['item_id', 'chrom', 'start', 'stop', 'strand', 'ref', 'alt', 'mut_type', 'id', 'al1', 'al2'],
+                  generator.tcga_rows(assembly))
+        copy_rows(cursor, 'rr.gencode_red',
+                  ['item_id', 'chrom', 'start', 'stop', 'strand', 'gene_name', 'gene_type', 'gene_id'],
+                  generator.gencode_rows(assembly))
+    logger.info('creating indexes')
+    for stmt in INDEX_DDL:
+        cursor.execute(stmt)
+    connection.commit()
+    # ANALYZE cannot run inside the transaction block of the loading
+    connection.autocommit = True
+    cursor.execute('ANALYZE')
+    cursor.close()
+    logger.info(f'synthetic database generated in {time.time() - start_time:.1f} seconds')
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Creates a synthetic VarSum database in a local PostgreSQL instance.')
+    parser.add_argument('db_user')
+    parser.add_argument('db_password')
+    parser.add_argument('db_port')
+    parser.add_argument('--database', default=DEFAULT_DATABASE_NAME)
+    parser.add_argument('--scale', choices=SCALES.keys(), default='toy')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--kgenomes-donors', type=int, help='overrides the value given by --scale')
+    parser.add_argument('--tcga-donors', type=int, help='overrides the value given by --scale')
+    parser.add_argument('--variants-per-donor', type=int, help='overrides the value given by --scale')
+    parser.add_argument('--mutations-per-donor', type=int, help='overrides the value given by --scale')
+    parser.add_argument('--genes', type=int, help='overrides the value given by --scale')
+    parser.add_argument('--drop-existing', action='store_true',
+                        help='drops the schemas dw, rr, temp and the tables public.item, public.dataset if they exist')
+    options = parser.parse_args(args)
+
+    size = dict(SCALES[options.scale])
+    for parameter in size.keys():
+        if getattr(options, parameter) is not None:
+            size[parameter] = getattr(options, parameter)
+    logger.info(f'generating a synthetic database with {size}')
+    connection = psycopg2.connect(host='localhost', port=options.db_port, user=options.db_user,
+                                  password=options.db_password, dbname=options.database)
+    try:
+        generate(connection, Generator(seed=options.seed, **size), options.drop_existing)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Micro-benchmark of the statements filtering the region tables by a list of variants, as built by
+_stmt_where_region_is_any_of_mutations in the sources. For panels of increasing size (by default 10, 1k and 100k variants
+sampled from the table), it compares the literal IN list of tuples with the join against the variants passed as array
+parameters, by measuring the length of the SQL text (with bind parameters and with literal values), and the planning
+and execution times reported by EXPLAIN ANALYZE.
+
+Usage:
+
+    python -m benchmarks.variant_filters <db_user> <db_password> <db_port> [--sizes 10 1000 100000]
+                                         [--tables rr.kgenomes_red rr.tcga_dnaseq_2] [--output variant_filters.json]
+"""
+from typing import List, Optional
+from prettytable import PrettyTable
+from loguru import logger
+from sqlalchemy import MetaData, Table, select
+from sqlalchemy.dialects import postgresql
+import database.database as database
+import data_sources.kgenomes.kgenomes as kgenomes
+from data_sources.io_parameters import Mutation
+import argparse
+import json
+import time
+import sys
+
+DEFAULT_SIZES = [10, 1000, 100000]
+DEFAULT_TABLES = ['rr.kgenomes_red', 'rr.tcga_dnaseq_2']
+# the maximum number of variants written as literal IN list by each strategy
+STRATEGIES = {
+    'IN LIST': sys.maxsize,
+    'JOIN': 0
+}
+
+
+def sample_variants(connection, table: Table, size: int) -> List[Mutation]:
+    stmt = select([table.c.chrom, table.c.start, table.c.ref, table.c.alt]).distinct().limit(size)
+    return [Mutation(chrom, start, ref, alt) for chrom, start, ref, alt in connection.execute(stmt)]
+
+
+def statement(table: Table, variants: List[Mutation], max_literal_variants: int):
+    default_max_literal_variants = kgenomes.MAX_LITERAL_VARIANTS
+    kgenomes.MAX_LITERAL_VARIANTS = max_literal_variants
+    try:
+        return kgenomes.KGenomes._stmt_where_region_is_any_of_mutations(*variants, from_table=table,
+                                                                        select_expression=select([table.c.item_id]))
+    finally:
+        kgenomes.MAX_LITERAL_VARIANTS = default_max_literal_variants
+
+
+def measure(connection, stmt) -> dict:
+    dialect = postgresql.dialect()
+    compiled = stmt.compile(dialect=dialect)
+    sql_with_literals = str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    start_time = time.time()
+    plan = connection.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    return {
+        'sql_length': len(str(compiled)),
+        'sql_length_with_literals': len(sql_with_literals),
+        'planning_time': plan[0]['Planning Time'] / 1000,
+        'execution_time': plan[0]['Execution Time'] / 1000,
+        'wall_time': time.time() - start_time,
+        'rows': plan[0]['Plan'].get('Actual Rows')
+    }
+
+
+def print_results(results: List[dict]):
+    table = PrettyTable(['TABLE', 'VARIANTS', 'STRATEGY', 'SQL LENGTH', 'SQL LENGTH (LITERALS)', 'PLANNING (s)',
+                         'EXECUTION (s)', 'WALL (s)', 'ROWS'])
+    for result in results:
+        table.add_row([result['table'], result['variants'], result['strategy'], result['sql_length'],
+                       result['sql_length_with_literals'], f"{result['planning_time']:.4f}",
+                       f"{result['execution_time']:.4f}", f"{result['wall_time']:.4f}", result['rows']])
+    print(table)
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark of the statements filtering regions by a list of variants.')
+    parser.add_argument('db_user')
+    parser.add_argument('db_password')
+    parser.add_argument('db_port')
+    parser.add_argument('--sizes', type=int, nargs='*', default=DEFAULT_SIZES, help='numbers of variants')
+    parser.add_argument('--tables', nargs='*', default=DEFAULT_TABLES, help='region tables as schema.name')
+    parser.add_argument('--output', default='variant_filters.json', help='file where results are saved')
+    options = parser.parse_args(args)
+
+    database.config_db_engine_for_tests(options.db_user, options.db_password, options.db_port)
+    connection = database.check_and_get_connection()
+    results = []
+    try:
+        db_meta = MetaData()
+        for table_name in options.tables:
+            schema, name = table_name.split('.')
+            table = Table(name, db_meta, autoload=True, autoload_with=connection, schema=schema)
+            for size in options.sizes:
+                variants = sample_variants(connection, table, size)
+                for strategy, max_literal_variants in STRATEGIES.items():
+                    logger.info(f'{table_name}: {len(variants)} variants, {strategy}')
+                    result = measure(connection, statement(table, variants, max_literal_variants))
+                    results.append(dict(table=table_name, variants=len(variants), strategy=strategy, **result))
+    finally:
+        connection.close()
+    print_results(results)
+    with open(options.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Frequency of a variant in a population, i.e. the occurrence of the variant divided by the number of alleles of the
+population in the locus of the variant. The number of alleles depends on the chromosome:
+- autosomes (1-22): two alleles per individual;
+- X (23): two alleles per female, one per male, except in the pseudo-autosomal regions at the ends of the chromosome
+  where males have two alleles as well;
+- Y (24): one allele per male;
+- mitochondrial DNA (25): one allele per individual.
+The computation is the same of the database functions rr.mut_frequency_new_hg19 and rr.mut_frequency_new_grch38 (see
+the assets directory), here offered as a SQL expression that the query planner can inline, and as a vectorized
+function for the frequencies computed by the Python process.
+"""
+from sqlalchemy import case, cast, literal, types
+from sqlalchemy.sql.expression import ColumnElement
+import numpy
+
+# bounds of the non pseudo-autosomal region of chromosome X
+PAR_BOUNDS = {
+    'hg19': (2699520, 154931044),
+    'grch38': (2781479, 155701383)
+}
+
+
+def _par_bounds(assembly: str) -> (int, int):
+    # the same choice of the callers of the database functions: anything but hg19 is GRCh38
+    return PAR_BOUNDS['hg19'] if assembly == 'hg19' else PAR_BOUNDS['grch38']
+
+
+def _as_expression(value):
+    return value if isinstance(value, ColumnElement) else literal(value)
+
+
+def frequency_expression(occurrence, males, females, chrom, start, assembly: str) -> ColumnElement:
+    """
+    :param occurrence, males, females, chrom, start: SQL expressions or Python values
+    :return: a SQL expression (of type numeric) computing the frequency of a variant
+    """
+    occurrence, males, females, chrom, start = \
+        [_as_expression(value) for value in (occurrence, males, females, chrom, start)]
+    par_start, par_stop = _par_bounds(assembly)
+    total_alleles = case([
+        (chrom < 23, (males + females) * 2),
+        (chrom == 23, case([((start < par_start) | (start > par_stop), (males + females) * 2)],
+                           else_=males + females * 2)),
+        (chrom == 24, males)
+    ], else_=males + females)
+    return case([
+        ((occurrence > 0) & (total_alleles > 0), cast(occurrence, types.Numeric) / total_alleles)
+    ], else_=cast(literal(0), types.Numeric))
+
+
+def total_alleles(males, females, chrom, start, assembly: str) -> numpy.ndarray:
+    """
+    Vectorized count of the alleles of a population in the locus of each variant.
+    :param males, females, chrom, start: arrays (or scalars) of the same shape
+    :return: the array of the number of alleles as int
+    """
+    males, females, chrom, start = numpy.broadcast_arrays(
+        *[numpy.asarray(value, dtype=numpy.int64) for value in (males, females, chrom, start)])
+    par_start, par_stop = _par_bounds(assembly)
+    return numpy.select(
+        [chrom < 23,
+         (chrom == 23) & ((start < par_start) | (start > par_stop)),
+         chrom == 23,
+         chrom == 24],
+        [(males + females) * 2,
+         (males + females) * 2,
+         males + females * 2,
+         males],
+        default=males + females)
+
+
+def frequency(occurrence, males, females, chrom, start, assembly: str) -> numpy.ndarray:
+    """
+    Vectorized version of frequency_expression.
+    :param occurrence, males, females, chrom, start: arrays (or scalars) of the same shape
+    :return: the array of frequencies as float
+    """
+    occurrence, total = numpy.broadcast_arrays(numpy.asarray(occurrence, dtype=numpy.int64),
+                                               total_alleles(males, females, chrom, start, assembly))
+    valid = (occurrence > 0) & (total > 0)
+    return numpy.divide(occurrence, total, out=numpy.zeros(occurrence.shape, dtype=float), where=valid)
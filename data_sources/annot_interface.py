@@ -1,7 +1,8 @@
 from typing import List, Callable
 from sqlalchemy.engine import Connection
-from sqlalchemy.sql.expression import FromClause
+from sqlalchemy.sql.expression import FromClause, Selectable
 from data_sources.io_parameters import *
+from database import sql_logging
 
 
 def do_not_notify(type: SourceMessage.Type, msg: str) -> None:
@@ -15,7 +16,10 @@ class AnnotInterface:
 
     def __init__(self, logger_instance, notify_message: Callable[[SourceMessage.Type, str], None] = do_not_notify):
         self.logger = logger_instance
+        # logs the SQL statements when the instance field "log_sql_statements" is True (see database.sql_logging)
+        self.sql_logger = sql_logging.log_function(logger_instance)
         self.notify_message = notify_message
+        self.dry_run = False
 
     def annotate(self, connection: Connection, genomic_interval: GenomicInterval,
                  attrs: Optional[List[Vocabulary]], assembly: str) -> FromClause:
@@ -24,9 +28,19 @@ class AnnotInterface:
     def find_gene_region(self, connection: Connection, gene: Gene, output_attrs: List[Vocabulary], assembly: str) -> FromClause:
         raise NotImplementedError('Any subclass of AnnotInterface must implement the abstract method "find_gene_region"')
 
+    def genes(self, connection: Connection, gene_type: Optional[str], assembly: str) -> FromClause:
+        """
+        Returns a statement selecting all the genes of the given assembly (only the ones of gene_type, if given), with
+        the columns GENE_NAME, GENE_ID, GENE_TYPE, CHROM, START, STOP named as in Vocabulary.
+        """
+        raise NotImplementedError('Any subclass of AnnotInterface must implement the abstract method "genes"')
+
     def values_of_attribute(self, connection, attribute: Vocabulary) -> (str, List):
         raise NotImplementedError('Any subclass of AnnotInterface must implement the abstract method "values_of_attribute".')
 
+    def value_catalog_stmt(self, connection) -> Selectable:
+        raise NotImplementedError('Any subclass of AnnotInterface must implement the abstract method "value_catalog_stmt".')
+
     @classmethod
     def get_available_annotation_types(cls):
         if len(cls.col_map) == 0:
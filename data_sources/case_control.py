@@ -0,0 +1,104 @@
+"""
+Allelic association test between a population of cases and one of controls. For each variant, the alleles of the two
+groups form the 2x2 table
+                    variant     other alleles
+    cases           a           b
+    controls        c           d
+from which the odds ratio (with the Haldane-Anscombe correction, so that it is defined also for empty cells) and the
+Pearson chi-square statistic with one degree of freedom are computed, vectorized over chunks of variants.
+"""
+from data_sources.io_parameters import Vocabulary
+from data_sources import allele_frequency
+from typing import Dict, Iterable, List, Tuple
+import numpy
+import math
+
+# names of the columns produced by Source.case_control_counts
+CASE_OCCURRENCE = 'CASE_OCCURRENCE'
+CONTROL_OCCURRENCE = 'CONTROL_OCCURRENCE'
+# keys of the gender composition of the groups returned by Source.case_control_counts
+CASE = 'CASE'
+CONTROL = 'CONTROL'
+# orderings of the result
+BY_P_VALUE = 'p_value'
+BY_ODDS_RATIO = 'odds_ratio'
+
+OUTPUT_COLUMNS = [Vocabulary.CHROM.name, Vocabulary.START.name, Vocabulary.REF.name, Vocabulary.ALT.name,
+                  CASE_OCCURRENCE, 'CASE_FREQUENCY', CONTROL_OCCURRENCE, 'CONTROL_FREQUENCY', 'ODDS_RATIO',
+                  'CHI_SQUARE', 'P_VALUE']
+CHUNK_SIZE = 100000
+
+_erfc = numpy.frompyfunc(math.erfc, 1, 1)
+
+
+def allelic_test(case_occurrence, case_alleles, control_occurrence, control_alleles) \
+        -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    :param case_occurrence, case_alleles, control_occurrence, control_alleles: arrays of the same shape with the number
+    of alleles equal to the variant and the total number of alleles in the two groups
+    :return: the arrays of odds ratios, chi-square statistics and p-values
+    """
+    a = numpy.asarray(case_occurrence, dtype=float)
+    c = numpy.asarray(control_occurrence, dtype=float)
+    # the occurrence can exceed the expected alleles (e.g. homozygous males on chrX outside the PARs, or calls on chrY
+    # in a group without males): the other alleles are never negative
+    b = numpy.maximum(numpy.asarray(case_alleles, dtype=float) - a, 0)
+    d = numpy.maximum(numpy.asarray(control_alleles, dtype=float) - c, 0)
+    odds_ratio = ((a + 0.5) * (d + 0.5)) / ((b + 0.5) * (c + 0.5))
+    denominator = (a + b) * (c + d) * (a + c) * (b + d)
+    chi_square = numpy.divide((a + b + c + d) * (a * d - b * c) ** 2, denominator,
+                              out=numpy.zeros(a.shape, dtype=float), where=denominator > 0)
+    # survival function of the chi-square distribution with one degree of freedom
+    p_value = _erfc(numpy.sqrt(chi_square / 2)).astype(float)
+    return odds_ratio, chi_square, p_value
+
+
+def effect_key(odds_ratio):
+    """
+    :return: the key ordering the odds ratios from the largest effect in either direction (smaller keys come first)
+    """
+    return -numpy.abs(numpy.log(odds_ratio))
+
+
+def top_variants(rows: Iterable, composition: Dict[str, Tuple[int, int]], assembly: str, order_by: str,
+                 limit: int) -> List[list]:
+    """
+    :param rows: the result of the statement of Source.case_control_counts, as an iterable of rows with the columns
+    CHROM, START, REF, ALT, CASE_OCCURRENCE, CONTROL_OCCURRENCE
+    :param composition: the number of (males, females) of the groups CASE and CONTROL
+    :param order_by: BY_P_VALUE (smallest first) or BY_ODDS_RATIO (largest effect in either direction first)
+    :return: the best "limit" variants as rows of OUTPUT_COLUMNS. Rows are consumed in chunks, so only the best
+    variants found so far are kept in memory.
+    """
+    case_males, case_females = composition[CASE]
+    control_males, control_females = composition[CONTROL]
+    best: List[list] = []
+    best_keys = numpy.empty(0, dtype=float)
+    rows = iter(rows)
+    while True:
+        chunk = [row for _, row in zip(range(CHUNK_SIZE), rows)]
+        if len(chunk) == 0:
+            break
+        chrom = numpy.array([row[0] for row in chunk], dtype=numpy.int64)
+        start = numpy.array([row[1] for row in chunk], dtype=numpy.int64)
+        case_occurrence = numpy.array([row[4] for row in chunk], dtype=numpy.int64)
+        control_occurrence = numpy.array([row[5] for row in chunk], dtype=numpy.int64)
+        case_alleles = allele_frequency.total_alleles(case_males, case_females, chrom, start, assembly)
+        control_alleles = allele_frequency.total_alleles(control_males, control_females, chrom, start, assembly)
+        odds_ratio, chi_square, p_value = allelic_test(case_occurrence, case_alleles, control_occurrence,
+                                                       control_alleles)
+        case_frequency = allele_frequency.frequency(case_occurrence, case_males, case_females, chrom, start, assembly)
+        control_frequency = allele_frequency.frequency(control_occurrence, control_males, control_females, chrom,
+                                                       start, assembly)
+        # smaller keys come first
+        keys = p_value if order_by == BY_P_VALUE else effect_key(odds_ratio)
+        candidates = numpy.argsort(keys, kind='stable')[:limit]
+        best.extend([list(chunk[i][0:4]) + [int(case_occurrence[i]), float(case_frequency[i]),
+                                            int(control_occurrence[i]), float(control_frequency[i]),
+                                            float(odds_ratio[i]), float(chi_square[i]), float(p_value[i])]
+                     for i in candidates])
+        best_keys = numpy.concatenate([best_keys, keys[candidates]])
+        keep = numpy.argsort(best_keys, kind='stable')[:limit]
+        best = [best[i] for i in keep]
+        best_keys = best_keys[keep]
+    return best
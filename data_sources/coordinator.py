@@ -1,16 +1,28 @@
 from data_sources.annot_interface import AnnotInterface
 from data_sources.source_interface import *
+from data_sources.source_blocking_small_populations import SourceBlockingSmallPopulations
 from data_sources.kgenomes.kgenomes import KGenomes
 from data_sources.tcga.tcga import TCGA
 from data_sources.gencode_v19_hg19.gencode import Gencode
-from typing import List, Type, Union, Iterable, Sequence
+from typing import Dict, List, Type, Union, Iterable, Sequence
 from sqlalchemy.engine import ResultProxy
-from sqlalchemy import select, union, func, literal, column, cast, types, desc, asc
+from sqlalchemy import select, union, union_all, func, literal, column, cast, types, desc, asc
 import sqlalchemy.exc
 import database.database as database
+import database.db_utils as db_utils
+from database import sql_logging
+from monitoring import metrics
+from data_sources.time_estimator import ExecutionFeatures
+from data_sources import allele_frequency
+from data_sources import case_control
+from data_sources import frequency_matrix
+from data_sources import gene_burden
+from data_sources import linkage
+import data_sources.time_estimator as time_estimator
 import concurrent.futures
 import itertools
 import collections
+import time
 
 
 def default_user_callback(*msg) -> None:
@@ -28,15 +40,65 @@ _annotation_sources: Iterable[Type[AnnotInterface]] = [
     Gencode
 ]
 
-LOG_SQL_STATEMENTS = True
-
 
 class Coordinator:
-    def __init__(self, request_logger, filter_sources: Optional[Sequence[str]] = None, observer: Callable[[str], None] = default_user_callback):
+    def __init__(self, request_logger, filter_sources: Optional[Sequence[str]] = None, observer: Callable[[str], None] = default_user_callback,
+                 dry_run: bool = False, population_observer: Callable[[int], None] = default_user_callback,
+                 population_items: Optional[Dict[str, List[int]]] = None):
+        """
+        :param population_observer: receives the size of the population selected by the request, as soon as the
+        sources notify it. It can interrupt the request by raising AskUserIntervention.
+        :param dry_run: if True, the methods of this class return the execution plan of the statements built by each
+        source instead of executing them. In this mode, sources do not create any table.
+        :param population_items: the item_id of the individuals of a population handle for each source (as returned by
+        population_items_of). If given, only those sources are used and their population is restricted to the items.
+        """
         self.logger = request_logger
+        # the SQL statements of this request are logged only if the request is sampled
+        self.log_sql_statements = sql_logging.sample()
+        self.sql_logger = sql_logging.log_function(request_logger)
         self.notices = collections.deque()
+        self.population_sizes = collections.deque()   # population sizes notified by the sources
         self.use_sources = [gen_var_sources[name] for name in filter_sources] or gen_var_sources.values() if filter_sources else gen_var_sources.values()
+        self.population_items = population_items
+        if population_items is not None:
+            self.use_sources = [source for source in self.use_sources if source.pretty_name() in population_items]
         self.observer_callback = observer
+        self.dry_run = dry_run
+        self.population_observer = population_observer
+
+    def population_items_of(self, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs) -> Dict[str, List[int]]:
+        """
+        Resolves the population having meta_attrs and region_attrs in each source.
+        :return: the item_id of the individuals of the population, for each source that can express it. Sources
+        enforcing a minimum population size are excluded (with a notice) if the population is smaller than that.
+        """
+        region_attrs = self.replace_gene_with_interval(region_attrs, meta_attrs.assembly)
+        eligible_sources = [source for source in self.use_sources if
+                            source.can_express_constraint(meta_attrs, region_attrs, source.item_ids)]
+        answer_204_if_no_source_can_answer(eligible_sources)
+
+        def ask_to_source(source: Type[Source]):
+            def do():
+                obj: Source = source(self.logger)
+
+                def item_ids(a_connection):
+                    return [row[0] for row in a_connection.execute(obj.item_ids(a_connection, meta_attrs, region_attrs))]
+
+                items = self.run_in_source(obj, 'item_ids', item_ids, explainable=False)
+                if isinstance(obj, SourceBlockingSmallPopulations):
+                    obj.block_if_size_below_threshold(len(items), 'item_ids')
+                return source.pretty_name(), items
+            return self.try_catch_source_errors(do, None)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
+            from_sources = executor.map(ask_to_source, eligible_sources)
+
+        # remove failures
+        from_sources = [result for result in from_sources if result is not None]
+        if len(from_sources) == 0:
+            raise NoDataFromSources(self.notices)
+        return dict(from_sources)
 
     def download_donors(self, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs) -> dict:
         region_attrs = self.replace_gene_with_interval(region_attrs, meta_attrs.assembly)
@@ -60,7 +122,7 @@ class Coordinator:
                                 column(Vocabulary.DONOR_ID.name), column(Vocabulary.DOWNLOAD_REGION_URL.name)])\
                         .select_from(source_stmt)
 
-                return database.try_py_function(donors)
+                return self.run_in_source(obj, 'donors', donors)
             return self.try_catch_source_errors(do, None)
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
@@ -71,6 +133,8 @@ class Coordinator:
         if len(from_sources) == 0:
             raise NoDataFromSources(self.notices)
         else:
+            if self.dry_run:
+                return self.plans_as_dictionary(from_sources)
             # aggregate the results of all the queries
             self.warn_if_mixed_germline_somatic_vars(eligible_sources)
 
@@ -110,6 +174,7 @@ class Coordinator:
 
     def donor_distribution(self, by_attributes: List[Vocabulary], meta_attrs: MetadataAttrs,
                            region_attrs: RegionAttrs) -> dict:
+        start_time = time.perf_counter()
         region_attrs = self.replace_gene_with_interval(region_attrs, meta_attrs.assembly)
         eligible_sources = [source for source in self.use_sources if source.can_express_constraint(meta_attrs, region_attrs, source.donors)]
         answer_204_if_no_source_can_answer(eligible_sources)
@@ -142,7 +207,7 @@ class Coordinator:
                         select(select_from_source_output) \
                         .select_from(source_stmt)
     
-                return database.try_py_function(donors)
+                return self.run_in_source(obj, 'donors', donors)
             return self.try_catch_source_errors(do, None)
     
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
@@ -153,6 +218,8 @@ class Coordinator:
         if len(from_sources) == 0:
             raise NoDataFromSources(self.notices)
         else:
+            if self.dry_run:
+                return self.plans_as_dictionary(from_sources)
             # aggregate the results of all the queries
             self.warn_if_mixed_germline_somatic_vars(eligible_sources)
             by_attributes_as_columns = [column(att.name) for att in by_attributes]
@@ -166,21 +233,28 @@ class Coordinator:
                 .group_by(func.cube(*by_attributes_as_columns))
 
             result = self.get_as_dictionary(stmt, 'DONOR DISTRIBUTION')
+            # the grand total of the cube is the largest count
+            population_size = max((row[-1] for row in result['rows']), default=0)
+            self.record_execution('donor_distribution', start_time, meta_attrs, region_attrs, eligible_sources,
+                                  population_size)
             return result
 
     def variant_distribution(self, by_attributes: List[Vocabulary], meta_attrs: MetadataAttrs, region_attrs: RegionAttrs, variant: Mutation) -> dict:
+        start_time = time.perf_counter()
         region_attrs = self.replace_gene_with_interval(region_attrs, meta_attrs.assembly)
         eligible_sources = [source for source in self.use_sources if source.can_express_constraint(meta_attrs, region_attrs, source.variant_occurrence)]
         self.logger.warning(f"eligible sources are {eligible_sources}")
         answer_204_if_no_source_can_answer(eligible_sources)
     
-        # sorted copy of ( by_attributes + donor_id ) 'cos we need the same table schema from each source
+        # sorted copy of ( by_attributes + gender ) 'cos we need the same table schema from each source
         by_attributes_copy = set(by_attributes)
-        by_attributes_copy.update([Vocabulary.DONOR_ID, Vocabulary.GENDER])
+        by_attributes_copy.add(Vocabulary.GENDER)
         by_attributes_copy = list(by_attributes_copy)
         by_attributes_copy.sort(key=lambda x: x.name)
+        group_measures = [Vocabulary.POPULATION_SIZE, Vocabulary.POSITIVE_DONORS, Vocabulary.OCCURRENCE]
     
-        # collect results from individual sources as DONOR_ID | OCCURRENCE | <by_attributes>
+        # collect results from individual sources as groups of individuals:
+        # <by_attributes> | POPULATION_SIZE | POSITIVE_DONORS | OCCURRENCE
         def ask_to_source(source: Type[Source]):
             def do():
                 obj: Source = source(self.logger)
@@ -194,16 +268,31 @@ class Coordinator:
                         select_from_source_output.append(column(elem.name))
                     else:
                         select_from_source_output.append(cast(literal(Vocabulary.unknown.name), types.String).label(elem.name))
-                select_from_source_output.append(column(Vocabulary.OCCURRENCE.name))
+                select_from_source_output.extend([column(measure.name) for measure in group_measures])
     
                 def variant_occurrence(a_connection):
-                    source_stmt = obj.variant_occurrence(a_connection, selectable_attributes, meta_attrs, region_attrs, variant)\
-                        .alias(source.__name__)
+                    source_stmt = obj.variant_occurrence_by_strata(a_connection, selectable_attributes, meta_attrs,
+                                                                   region_attrs, variant)
+                    if source_stmt is None:
+                        # a group for each combination of by_attributes, counting the distinct individuals
+                        donors_stmt = obj.variant_occurrence(a_connection, selectable_attributes + [Vocabulary.DONOR_ID],
+                                                             meta_attrs, region_attrs, variant)\
+                            .alias('donors')
+                        distinct_donors = select([donors_stmt]).distinct().alias('distinct_donors')
+                        attributes_as_columns = [distinct_donors.c[att.name] for att in selectable_attributes]
+                        source_stmt = \
+                            select(attributes_as_columns + [
+                                func.count().label(Vocabulary.POPULATION_SIZE.name),
+                                func.count().filter(distinct_donors.c[Vocabulary.OCCURRENCE.name] > 0)
+                                    .label(Vocabulary.POSITIVE_DONORS.name),
+                                func.sum(distinct_donors.c[Vocabulary.OCCURRENCE.name]).label(Vocabulary.OCCURRENCE.name)
+                            ])\
+                            .group_by(*attributes_as_columns)
                     return \
                         select(select_from_source_output)\
-                        .select_from(source_stmt)
+                        .select_from(source_stmt.alias(source.__name__))
     
-                return database.try_py_function(variant_occurrence)
+                return self.run_in_source(obj, 'variant_occurrence', variant_occurrence)
             return self.try_catch_source_errors(do, None)
     
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources) + 1) as executor:
@@ -218,25 +307,24 @@ class Coordinator:
         if len(from_sources) == 0:
             raise NoDataFromSources(self.notices)
         else:
+            if self.dry_run:
+                return self.plans_as_dictionary(from_sources)
             self.warn_if_mixed_germline_somatic_vars(eligible_sources)
-            all_sources = union(*from_sources).alias('all_sources')
+            all_sources = union_all(*from_sources).alias('all_sources')
             chrom = region_of_variant[0]
             start = region_of_variant[1]
 
-            # functions
-            func_count_donors = func.count(column(Vocabulary.DONOR_ID.name)).label('POPULATION_SIZE')
-            # in the following statements 1 is an abbreviation for the column DONOR_ID
-            func_count_positive_donors = func.count(1).filter(column(Vocabulary.OCCURRENCE.name) > 0).label('POSITIVE_DONORS')
-            func_count_males_and_na = cast(func.count(1).filter(func.coalesce(column(Vocabulary.GENDER.name), '') != 'female'), types.Integer)
-            func_count_females = cast(func.count(1).filter(column(Vocabulary.GENDER.name) == 'female'), types.Integer)
-            func_count_occurrence = func.sum(column(Vocabulary.OCCURRENCE.name)).label('OCCURRENCE_OF_TARGET_VARIANT')
-            if meta_attrs.assembly == 'hg19':
-                func_frequency_new = func.rr.mut_frequency_new_hg19(func_count_occurrence, func_count_males_and_na,
-                                                                    func_count_females, chrom, start)
-            else:
-                func_frequency_new = func.rr.mut_frequency_new_grch38(func_count_occurrence, func_count_males_and_na,
-                                                                      func_count_females, chrom, start)
-            func_frequency_new = func_frequency_new.label(Vocabulary.FREQUENCY.name)
+            # functions (sum the sizes and the counts of the groups of individuals)
+            group_size = column(Vocabulary.POPULATION_SIZE.name)
+            func_count_donors = cast(func.sum(group_size), types.Integer).label('POPULATION_SIZE')
+            func_count_positive_donors = cast(func.sum(column(Vocabulary.POSITIVE_DONORS.name)), types.Integer).label('POSITIVE_DONORS')
+            func_count_males_and_na = cast(func.coalesce(func.sum(group_size).filter(func.coalesce(column(Vocabulary.GENDER.name), '') != 'female'), 0), types.Integer)
+            func_count_females = cast(func.coalesce(func.sum(group_size).filter(column(Vocabulary.GENDER.name) == 'female'), 0), types.Integer)
+            func_count_occurrence = cast(func.sum(column(Vocabulary.OCCURRENCE.name)), types.Integer).label('OCCURRENCE_OF_TARGET_VARIANT')
+            func_frequency_new = allele_frequency.frequency_expression(func_count_occurrence, func_count_males_and_na,
+                                                                       func_count_females, chrom, start,
+                                                                       meta_attrs.assembly)\
+                .label(Vocabulary.FREQUENCY.name)
     
             # merge results by union (which removes duplicates) and count
             by_attributes_as_columns = [column(att.name) for att in by_attributes]
@@ -250,11 +338,88 @@ class Coordinator:
                 stmt = stmt.where(column(Vocabulary.GENDER.name).in_(['male', 'female']))
             stmt = stmt.group_by(func.cube(*by_attributes_as_columns))
     
-            return self.get_as_dictionary(stmt, 'VARIANT DISTRIBUTION')
+            result = self.get_as_dictionary(stmt, 'VARIANT DISTRIBUTION')
+            population_size = max((row[len(by_attributes)] for row in result['rows']), default=0)
+            self.record_execution('variant_distribution', start_time, meta_attrs, region_attrs, eligible_sources,
+                                  population_size)
+            return result
+
+    def variant_frequency_matrix(self, by_attributes: List[Vocabulary], meta_attrs: MetadataAttrs,
+                                 region_attrs: Optional[RegionAttrs], variants: List[Mutation],
+                                 output_format: str = frequency_matrix.ROWS) -> dict:
+        """
+        Returns the frequency of each of the given variants in each group of individuals identified by by_attributes
+        (see module frequency_matrix).
+        """
+        start_time = time.perf_counter()
+        region_attrs = self.replace_gene_with_interval(region_attrs, meta_attrs.assembly)
+        eligible_sources = [source for source in self.use_sources if
+                            source.can_express_constraint(meta_attrs, region_attrs, source.variant_occurrence_matrix)]
+        answer_204_if_no_source_can_answer(eligible_sources)
+
+        # the gender is needed to compute the frequencies
+        by_attributes_copy = set(by_attributes)
+        by_attributes_copy.add(Vocabulary.GENDER)
+        by_attributes_copy = list(by_attributes_copy)
+        by_attributes_copy.sort(key=lambda x: x.name)
+
+        def ask_to_source(source: Type[Source]):
+            def do():
+                obj: Source = source(self.logger)
+                obj.dry_run = self.dry_run
+                available_attributes_in_source = obj.get_available_attributes()
+                selectable_attributes = [attr for attr in by_attributes_copy if attr in available_attributes_in_source]
+
+                def same_schema(source_stmt, measures: List[str]):
+                    # the attributes not available in this source are reported as unknown
+                    return select([column(attr.name) if attr in available_attributes_in_source
+                                   else cast(literal(Vocabulary.unknown.name), types.String).label(attr.name)
+                                   for attr in by_attributes_copy] + [column(measure) for measure in measures]) \
+                        .select_from(source_stmt.alias(source.__name__))
+
+                def occurrence_matrix(connection: Connection):
+                    strata_stmt, counts_stmt = obj.variant_occurrence_matrix(connection, selectable_attributes,
+                                                                             meta_attrs, region_attrs, variants)
+                    if self.dry_run:
+                        return source.pretty_name(), db_utils.explain(counts_stmt, connection, self.log_sql_statements,
+                                                                      self.sql_logger)
+                    strata = connection.execute(same_schema(strata_stmt, [Vocabulary.POPULATION_SIZE.name])).fetchall()
+                    counts = connection.execute(same_schema(counts_stmt, frequency_matrix.VARIANT_COLUMNS +
+                                                            [Vocabulary.OCCURRENCE.name])).fetchall()
+                    return strata, counts
+
+                return self.run_in_source(obj, 'variant_occurrence_matrix', occurrence_matrix, explainable=False)
+            return self.try_catch_source_errors(do, None)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
+            from_sources = executor.map(ask_to_source, eligible_sources)
+
+        # remove failures
+        from_sources = [result for result in from_sources if result is not None]
+        if len(from_sources) == 0:
+            raise NoDataFromSources(self.notices)
+        if self.dry_run:
+            return self.plans_as_dictionary(from_sources)
+        self.warn_if_mixed_germline_somatic_vars(eligible_sources)
+        matrix = frequency_matrix.MatrixBuilder(by_attributes, variants)
+        for strata, counts in from_sources:
+            matrix.add_strata(strata)
+            matrix.add_occurrences(counts)
+        result = matrix.result(meta_attrs.assembly, output_format)
+        if any(variant.chrom is None for variant in variants):
+            self.notices.append(Notice('The variants given by id are included only if they occur in the selected '
+                                       'population.'))
+        metrics.ROWS_RETURNED.observe(matrix.number_of_variants(), operation='VARIANT FREQUENCY MATRIX')
+        if self.notices:
+            result['notice'] = [notice.args[0] for notice in self.notices]
+        self.record_execution('variant_frequency_matrix', start_time, meta_attrs, region_attrs, eligible_sources,
+                              matrix.population_size())
+        return result
 
     def rank_variants_by_freq(self, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs, ascending: bool,
                               out_min_freq: Optional[float], limit_result: Optional[int] = 10,
                               time_estimate_only: Optional[bool] = False) -> dict:
+        start_time = time.perf_counter()
         region_attrs = self.replace_gene_with_interval(region_attrs, meta_attrs.assembly)
         limit_result = limit_result or 10
         eligible_sources = [source for source in self.use_sources if
@@ -282,7 +447,7 @@ class Coordinator:
                         ]) \
                         .select_from(source_stmt)
     
-                return database.try_py_function(rank_var)
+                return self.run_in_source(obj, 'rank_variants_by_frequency', rank_var)
             return self.try_catch_source_errors(do, None)
     
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
@@ -292,11 +457,19 @@ class Coordinator:
         from_sources = [result for result in from_sources if result is not None]
         if len(from_sources) == 0:
             if time_estimate_only and hasattr(self, "time_estimate"):
+                # prefer the estimate learned from the past executions over the rough guess of the sources
+                learned_estimate = time_estimator.estimator.estimate(ExecutionFeatures.of_request(
+                    'rank_variants_by_freq', meta_attrs, region_attrs, [s.pretty_name() for s in eligible_sources],
+                    self.notified_population_size()))
+                if learned_estimate is not None:
+                    self.time_estimate = int(learned_estimate)
                 self.notices.append(Notice("To see the ranked variants, run again this request with the option 'time_estimate_only' set to false."))
                 raise TimeEstimate(self.time_estimate, self.notices)
             else:
                 raise NoDataFromSources(self.notices)
         else:
+            if self.dry_run:
+                return self.plans_as_dictionary(from_sources)
             self.warn_if_mixed_germline_somatic_vars(eligible_sources)
             stmt = \
                 select([
@@ -314,8 +487,161 @@ class Coordinator:
                 stmt = stmt.order_by(asc(column(Vocabulary.FREQUENCY.name)), asc(column(Vocabulary.OCCURRENCE.name)))
             else:
                 stmt = stmt.order_by(desc(column(Vocabulary.FREQUENCY.name)), desc(column(Vocabulary.OCCURRENCE.name)))
-            return self.get_as_dictionary(stmt, 'RANKED VARIANTS {}'.format('ASC' if ascending else 'DESC'))
+            result = self.get_as_dictionary(stmt, 'RANKED VARIANTS {}'.format('ASC' if ascending else 'DESC'))
+            self.record_execution('rank_variants_by_freq', start_time, meta_attrs, region_attrs, eligible_sources,
+                                  self.notified_population_size())
+            return result
     
+    def differential_variants(self, case_meta_attrs: MetadataAttrs, case_region_attrs: Optional[RegionAttrs],
+                              control_meta_attrs: MetadataAttrs, control_region_attrs: Optional[RegionAttrs],
+                              order_by: str, limit_result: Optional[int] = 10) -> dict:
+        """
+        Compares the frequency of the variants in a group of cases and in a group of controls (see module
+        case_control) and returns the variants with the smallest p-value or the largest odds ratio.
+        """
+        start_time = time.perf_counter()
+        # the total alleles and the coordinates of the variants depend on the assembly, shared by the two groups
+        if case_meta_attrs.assembly != control_meta_attrs.assembly:
+            raise AskUserIntervention('Cases and controls must refer to the same assembly.', 400)
+        case_region_attrs = self.replace_gene_with_interval(case_region_attrs, case_meta_attrs.assembly)
+        control_region_attrs = self.replace_gene_with_interval(control_region_attrs, control_meta_attrs.assembly)
+        limit_result = limit_result or 10
+        eligible_sources = [source for source in self.use_sources if
+                            source.can_express_constraint(case_meta_attrs, case_region_attrs, source.case_control_counts)
+                            and source.can_express_constraint(control_meta_attrs, control_region_attrs,
+                                                              source.case_control_counts)]
+        answer_204_if_no_source_can_answer(eligible_sources)
+
+        def ask_to_source(source: Type[Source]):
+            def do():
+                obj: Source = source(self.logger)
+                obj.dry_run = self.dry_run
+
+                def compare(connection: Connection):
+                    counts = obj.case_control_counts(connection, case_meta_attrs, case_region_attrs,
+                                                     control_meta_attrs, control_region_attrs)
+                    if counts is None:
+                        return None
+                    stmt, composition = counts
+                    if self.dry_run:
+                        return source.pretty_name(), db_utils.explain(stmt, connection, self.log_sql_statements,
+                                                                      self.sql_logger)
+                    result_proxy = connection.execution_options(stream_results=True).execute(stmt)
+                    return source.pretty_name(), case_control.top_variants(result_proxy, composition,
+                                                                           case_meta_attrs.assembly, order_by,
+                                                                           limit_result)
+
+                return self.run_in_source(obj, 'case_control_counts', compare, explainable=False)
+            return self.try_catch_source_errors(do, None)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
+            from_sources = executor.map(ask_to_source, eligible_sources)
+
+        # remove failures and sources not supporting the analysis
+        from_sources = [result for result in from_sources if result is not None]
+        if len(from_sources) == 0:
+            raise NoDataFromSources(self.notices)
+        if self.dry_run:
+            return self.plans_as_dictionary(from_sources)
+        self.warn_if_mixed_germline_somatic_vars(eligible_sources)
+        p_value_idx = case_control.OUTPUT_COLUMNS.index('P_VALUE')
+        odds_ratio_idx = case_control.OUTPUT_COLUMNS.index('ODDS_RATIO')
+        rows = [[source_name] + row for source_name, top_variants in from_sources for row in top_variants]
+        if order_by == case_control.BY_P_VALUE:
+            rows.sort(key=lambda row: row[1 + p_value_idx])
+        else:
+            rows.sort(key=lambda row: float(case_control.effect_key(row[1 + odds_ratio_idx])))
+        result = {
+            'columns': ['SOURCE'] + case_control.OUTPUT_COLUMNS,
+            'rows': rows[:limit_result]
+        }
+        metrics.ROWS_RETURNED.observe(len(result['rows']), operation='DIFFERENTIAL VARIANTS')
+        if self.notices:
+            result['notice'] = [notice.args[0] for notice in self.notices]
+        self.logger.debug(f'differential variants computed in {round(time.perf_counter() - start_time, 2)} s')
+        self.record_execution('differential_variants', start_time, case_meta_attrs, case_region_attrs,
+                              eligible_sources, self.notified_population_size())
+        return result
+
+    def gene_burden(self, meta_attrs: MetadataAttrs, region_attrs: Optional[RegionAttrs],
+                    gene_type: Optional[str]) -> dict:
+        """
+        Counts the variants of the population falling in each gene (see module gene_burden).
+        """
+        start_time = time.perf_counter()
+        region_attrs = self.replace_gene_with_interval(region_attrs, meta_attrs.assembly)
+        eligible_sources = [source for source in self.use_sources if
+                            source.can_express_constraint(meta_attrs, region_attrs, source.genotypes_by_position)]
+        answer_204_if_no_source_can_answer(eligible_sources)
+        genes = self.genes(gene_type, meta_attrs.assembly)
+        if len(genes) == 0:
+            raise AskUserIntervention('No gene in our database corresponds to the given gene_type.', 404)
+
+        def ask_to_source(source: Type[Source]):
+            def do():
+                obj: Source = source(self.logger)
+
+                def burden(connection: Connection):
+                    stmt = obj.genotypes_by_position(connection, meta_attrs, region_attrs)
+                    if self.dry_run:
+                        return source.pretty_name(), db_utils.explain(stmt, connection, self.log_sql_statements,
+                                                                      self.sql_logger)
+                    result_proxy = connection.execution_options(stream_results=True).execute(stmt)
+                    return source.pretty_name(), gene_burden.burden(genes, result_proxy)
+
+                return self.run_in_source(obj, 'genotypes_by_position', burden, explainable=False)
+            return self.try_catch_source_errors(do, None)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
+            from_sources = executor.map(ask_to_source, eligible_sources)
+
+        # remove failures
+        from_sources = [result for result in from_sources if result is not None]
+        if len(from_sources) == 0:
+            raise NoDataFromSources(self.notices)
+        if self.dry_run:
+            return self.plans_as_dictionary(from_sources)
+        self.warn_if_mixed_germline_somatic_vars(eligible_sources)
+        result = {
+            'columns': ['SOURCE'] + gene_burden.OUTPUT_COLUMNS,
+            'rows': [[source_name] + row for source_name, rows in from_sources for row in rows]
+        }
+        metrics.ROWS_RETURNED.observe(len(result['rows']), operation='GENE BURDEN')
+        if self.notices:
+            result['notice'] = [notice.args[0] for notice in self.notices]
+        self.record_execution('gene_burden', start_time, meta_attrs, region_attrs, eligible_sources,
+                              self.notified_population_size())
+        return result
+
+    def genes(self, gene_type: Optional[str], assembly) -> List[list]:
+        """
+        :return: the genes of the given type (any type if None) found in the annotation sources, as rows of
+        gene_burden.GENE_COLUMNS
+        """
+        eligible_sources = [_source for _source in _annotation_sources
+                            if {Vocabulary.GENE_NAME, Vocabulary.GENE_ID, Vocabulary.GENE_TYPE, Vocabulary.CHROM,
+                                Vocabulary.START, Vocabulary.STOP}.issubset(_source.get_available_annotation_types())]
+        answer_204_if_no_source_can_answer(eligible_sources)
+
+        def ask_to_source(source):
+            def do():
+                obj: AnnotInterface = source(self.logger)
+
+                def genes_of_type(connection: Connection) -> list:
+                    return [list(row) for row in connection.execute(obj.genes(connection, gene_type, assembly))]
+
+                return self.run_in_source(obj, 'genes', genes_of_type, explainable=False)
+            return self.try_catch_source_errors(do, None)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
+            from_sources = executor.map(ask_to_source, eligible_sources)
+
+        # remove failures
+        from_sources = [result for result in from_sources if result is not None]
+        if len(from_sources) == 0:
+            raise NoDataFromSources(self.notices)
+        return [gene for genes_of_source in from_sources for gene in genes_of_source]
+
     def values_of_attribute(self, attribute: Vocabulary) -> dict:
         eligible_sources = [source for source in self.use_sources if attribute in source.get_available_attributes()]
         eligible_sources.extend([annot_source for annot_source in _annotation_sources if attribute in annot_source.get_available_annotation_types()])
@@ -328,7 +654,7 @@ class Coordinator:
                 def values_from_source(connection: Connection):
                     return obj.values_of_attribute(connection, attribute)
     
-                return database.try_py_function(values_from_source)
+                return self.run_in_source(obj, 'values_of_attribute', values_from_source, explainable=False)
             return self.try_catch_source_errors(do, None)
     
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
@@ -393,7 +719,7 @@ class Coordinator:
                         select(select_from_source_output)\
                         .select_from(source_stmt)
     
-                return database.try_py_function(annotate_region)
+                return self.run_in_source(obj, 'annotate', annotate_region)
             return self.try_catch_source_errors(do, None)
     
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
@@ -404,6 +730,8 @@ class Coordinator:
         if len(from_sources) == 0:
             raise NoDataFromSources(self.notices)
         else:
+            if self.dry_run:
+                return self.plans_as_dictionary(from_sources)
             # aggregate the results of all the queries
             stmt = \
                 select(['*']) \
@@ -417,6 +745,7 @@ class Coordinator:
         return self.variants_in_genomic_interval(genomic_interval, meta_attrs, region_attrs)
 
     def variants_in_genomic_interval(self, interval: GenomicInterval, meta_attrs: MetadataAttrs, region_attrs: Optional[RegionAttrs]) -> dict:
+        start_time = time.perf_counter()
         eligible_sources = [source for source in self.use_sources if source.can_express_constraint(meta_attrs, region_attrs, source.variants_in_region)]
         answer_204_if_no_source_can_answer(eligible_sources)
         select_attrs = [Vocabulary.CHROM, Vocabulary.START, Vocabulary.REF, Vocabulary.ALT]
@@ -428,7 +757,7 @@ class Coordinator:
                 def variant_in_region(connection: Connection):
                     return obj.variants_in_region(connection, interval, select_attrs, meta_attrs, region_attrs)
     
-                return database.try_py_function(variant_in_region)
+                return self.run_in_source(obj, 'variants_in_region', variant_in_region)
             return self.try_catch_source_errors(do, None)
     
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
@@ -439,6 +768,8 @@ class Coordinator:
         if len(from_sources) == 0:
             raise NoDataFromSources(self.notices)
         else:
+            if self.dry_run:
+                return self.plans_as_dictionary(from_sources)
             self.warn_if_mixed_germline_somatic_vars(eligible_sources)
             # no need for select distinct as the union does that already
             stmt = \
@@ -446,7 +777,73 @@ class Coordinator:
                 .select_from(union(*from_sources).alias("all_sources")) \
                 .order_by(literal(2, types.Integer))
     
-            return self.get_as_dictionary(stmt, 'VARIANTS IN GENOMIC INTERVAL')
+            result = self.get_as_dictionary(stmt, 'VARIANTS IN GENOMIC INTERVAL')
+            self.record_execution('variants_in_genomic_interval', start_time, meta_attrs, region_attrs,
+                                  eligible_sources, genomic_interval=interval)
+            return result
+
+    def linkage_in_gene(self, gene: Gene, meta_attrs: MetadataAttrs, region_attrs: Optional[RegionAttrs]) -> dict:
+        genomic_interval = self.resolve_gene_interval(gene, meta_attrs.assembly)
+        return self.linkage_in_genomic_interval(genomic_interval, meta_attrs, region_attrs)
+
+    def linkage_in_genomic_interval(self, interval: GenomicInterval, meta_attrs: MetadataAttrs,
+                                    region_attrs: Optional[RegionAttrs]) -> dict:
+        """
+        Computes the pairwise co-occurrence and linkage of the variants in the interval (see module linkage), for each
+        source knowing the chromosome copy of the variants.
+        """
+        start_time = time.perf_counter()
+        region_attrs = self.replace_gene_with_interval(region_attrs, meta_attrs.assembly)
+        eligible_sources = [source for source in self.use_sources if
+                            source.can_express_constraint(meta_attrs, region_attrs, source.phased_genotypes_in_interval)]
+        answer_204_if_no_source_can_answer(eligible_sources)
+
+        def ask_to_source(source: Type[Source]):
+            def do():
+                obj: Source = source(self.logger)
+                obj.dry_run = self.dry_run
+
+                def linkage_matrices(connection: Connection):
+                    statements = obj.phased_genotypes_in_interval(connection, interval, meta_attrs, region_attrs)
+                    if statements is None:
+                        return None
+                    individuals_stmt, genotypes_stmt = statements
+                    if self.dry_run:
+                        return source.pretty_name(), db_utils.explain(genotypes_stmt, connection, self.log_sql_statements,
+                                                                      self.sql_logger)
+                    individuals = connection.execute(individuals_stmt).fetchall()
+                    if len(individuals) == 0:
+                        raise EmptyResult(source.pretty_name())
+                    males = sum(1 for row in individuals if row[Vocabulary.GENDER.name] == 'male')
+                    females = sum(1 for row in individuals if row[Vocabulary.GENDER.name] == 'female')
+                    try:
+                        variants, first_copy, second_copy = linkage.bitsets(
+                            [row[linkage.ITEM_ID] for row in individuals], connection.execute(genotypes_stmt))
+                    except linkage.TooManyVariants as e:
+                        raise AskUserIntervention(e.args[0], 400)
+                    return source.pretty_name(), linkage.linkage(interval.chrom, variants, first_copy, second_copy,
+                                                                 males, females, meta_attrs.assembly)
+
+                return self.run_in_source(obj, 'phased_genotypes_in_interval', linkage_matrices, explainable=False)
+            return self.try_catch_source_errors(do, None)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
+            from_sources = executor.map(ask_to_source, eligible_sources)
+
+        # remove failures and sources not supporting the analysis
+        from_sources = [result for result in from_sources if result is not None]
+        if len(from_sources) == 0:
+            raise NoDataFromSources(self.notices)
+        if self.dry_run:
+            return self.plans_as_dictionary(from_sources)
+        result = dict(from_sources)
+        metrics.ROWS_RETURNED.observe(sum(len(matrices['variants']['rows']) for matrices in result.values()),
+                                      operation='LINKAGE IN GENOMIC INTERVAL')
+        if self.notices:
+            result['notice'] = [notice.args[0] for notice in self.notices]
+        self.record_execution('linkage_in_genomic_interval', start_time, meta_attrs, region_attrs, eligible_sources,
+                              genomic_interval=interval)
+        return result
 
     #   HELPER METHODS  #
     def get_region_of_variant(self, variant: Mutation, assembly: str):
@@ -461,7 +858,7 @@ class Coordinator:
                     return obj.get_variant_details(connection, variant,
                                                    [Vocabulary.CHROM, Vocabulary.START, Vocabulary.STOP], assembly)
 
-                return database.try_py_function(get_region)
+                return self.run_in_source(obj, 'get_variant_details', get_region, explainable=False)
 
             return self.try_catch_source_errors(do, None)
 
@@ -506,7 +903,7 @@ class Coordinator:
                 def var_in_gene(connection: Connection) -> FromClause:
                     return obj.find_gene_region(connection, gene, select_from_sources, assembly)
 
-                return database.try_py_function(var_in_gene)
+                return self.run_in_source(obj, 'find_gene_region', var_in_gene, explainable=False)
             return self.try_catch_source_errors(do, None)
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=len(eligible_sources)) as executor:
@@ -521,7 +918,7 @@ class Coordinator:
                 select(['*']) \
                 .select_from(union(*from_sources).alias('all_annot_sources'))
 
-            result = self.get_as_dictionary(merge_regions, 'FIND GENE')
+            result = self.get_as_dictionary(merge_regions, 'FIND GENE', prepared_as='find_gene')
             if len(result['rows']) > 1:
                 result['error'] = 'Different genes match the entry data. Please provide more details about the gene of interest'
                 raise AskUserIntervention(result, 300)
@@ -539,7 +936,9 @@ class Coordinator:
             .group_by(column(Vocabulary.GENDER.name))
 
         def do_with_connection(connection):
-            return [row.values() for row in connection.execute(females_and_males_stmt).fetchall()]
+            return [row.values() for row in db_utils.execute_prepared(connection, 'count_males_females',
+                                                                      females_and_males_stmt, self.log_sql_statements,
+                                                                      self.sql_logger).fetchall()]
 
         females_and_males = database.try_py_function(do_with_connection)
         females = next((el[1] for el in females_and_males if el[0] == 'female'), 0)
@@ -558,6 +957,7 @@ class Coordinator:
             self.logger.exception('Connection from pool is stale. This error should be already handled in module '
                                   'database.py. New attempt is being made by disposing the pool')
             # try again
+            metrics.DB_RECONNECTS.inc(origin='coordinator')
             database.db_engine.dispose()
             # if it fails, there's nothing I can do, the connection won't be available for other modules neither, so
             # let the exception pass through
@@ -568,6 +968,9 @@ class Coordinator:
         except sqlalchemy.exc.DBAPIError:
             self.logger.exception('Wrong usage of the underlying database')
             return alternative_return_value
+        except AskUserIntervention as e:
+            # this is not an error of the source, but a decision affecting the whole request
+            raise e
         except EmptyResult as empty_res:
             try:
                 self.logger.debug(f'A source returned prematurely with empty result: '
@@ -587,17 +990,71 @@ class Coordinator:
             self.logger.exception('unknown exception caught from a source')
             return alternative_return_value
 
-    def get_as_dictionary(self, stmt_to_execute, log_with_intro: Optional[str]):
-        log_fun = self.logger.debug if LOG_SQL_STATEMENTS else None
-        result_proxy: ResultProxy = database.try_stmt(stmt_to_execute, log_fun, log_with_intro)
+    def run_in_source(self, source_obj: Union[Source, AnnotInterface], operation: str, function, explainable: bool = True):
+        """
+        Executes function (a callable accepting a Connection, typically wrapping a method of source_obj) and records the
+        time spent by the source.
+        In dry-run mode, if function returns a statement ("explainable"), the statement is not executed by the caller;
+        this method returns instead the tuple (name of the source, execution plan of the statement).
+        """
+        if self.population_items is not None and isinstance(source_obj, Source):
+            source_obj.population_items = self.population_items.get(source_obj.pretty_name())
+        if isinstance(source_obj, Source):
+            source_obj.log_sql_commands = self.log_sql_statements
+        else:
+            source_obj.log_sql_statements = self.log_sql_statements
+        with metrics.SOURCE_QUERY_DURATION.time(source=source_obj.pretty_name(), operation=operation):
+            if self.dry_run and explainable:
+                source_obj.dry_run = True
+
+                def explain(connection):
+                    stmt = function(connection)
+                    return source_obj.pretty_name(), db_utils.explain(stmt, connection, self.log_sql_statements, self.sql_logger)
+
+                return database.try_py_function(explain)
+            else:
+                return database.try_py_function(function)
+
+    def plans_as_dictionary(self, from_sources: List[tuple]) -> dict:
+        """
+        Formats the output of the sources in dry-run mode as a table with one row for each source.
+        """
         result = {
-            'columns': result_proxy.keys(),
-            'rows': [row.values() for row in result_proxy.fetchall()]
+            'columns': ['SOURCE', 'ESTIMATED_ROWS', 'ESTIMATED_COST', 'PLAN'],
+            'rows': [[source_name, plan['Plan']['Plan Rows'], plan['Plan']['Total Cost'], plan]
+                     for source_name, plan in from_sources]
         }
         if self.notices:
             result['notice'] = [notice.args[0] for notice in self.notices]
         return result
 
+    def get_as_dictionary(self, stmt_to_execute, log_with_intro: Optional[str], prepared_as: Optional[str] = None):
+        """
+        :param prepared_as: if not None, stmt_to_execute is executed as a prepared statement with this name (see
+        db_utils.execute_prepared). Meant for the frequent statements whose text does not depend on the request.
+        """
+        log_fun = self.sql_logger if self.log_sql_statements else None
+        with metrics.AGGREGATE_QUERY_DURATION.time(operation=log_with_intro):
+            if prepared_as is None:
+                result_proxy: ResultProxy = database.try_stmt(stmt_to_execute, log_fun, log_with_intro)
+                result = {
+                    'columns': result_proxy.keys(),
+                    'rows': [row.values() for row in result_proxy.fetchall()]
+                }
+            else:
+                def execute_prepared(connection):
+                    result_proxy: ResultProxy = db_utils.execute_prepared(connection, prepared_as, stmt_to_execute,
+                                                                          self.log_sql_statements, self.sql_logger)
+                    return {
+                        'columns': result_proxy.keys(),
+                        'rows': [row.values() for row in result_proxy.fetchall()]
+                    }
+                result = database.try_py_function(execute_prepared)
+        metrics.ROWS_RETURNED.observe(len(result['rows']), operation=log_with_intro)
+        if self.notices:
+            result['notice'] = [notice.args[0] for notice in self.notices]
+        return result
+
     def source_message_handler(self, msg_type: SourceMessage.Type, msg: str):
         self.logger.info(f'SourceMessage: TYPE: {msg_type.name}. CONTENT: {msg}')
         if msg_type == SourceMessage.Type.TIME_TO_FINISH:
@@ -605,9 +1062,27 @@ class Coordinator:
                 self.time_estimate = max(int(msg), self.time_estimate)
             else:
                 self.time_estimate = int(msg)
+        elif msg_type == SourceMessage.Type.POPULATION_SIZE:
+            self.population_sizes.append(int(msg))
+            self.population_observer(self.notified_population_size())
         else:
             self.notices.append(Notice(msg))
 
+    def notified_population_size(self) -> Optional[int]:
+        return sum(self.population_sizes) if self.population_sizes else None
+
+    def record_execution(self, operation: str, start_time: float, meta_attrs: MetadataAttrs,
+                         region_attrs: Optional[RegionAttrs], eligible_sources: Iterable[Type[Source]],
+                         population_size: Optional[int] = None, genomic_interval: Optional[GenomicInterval] = None):
+        """
+        Adds the execution time of a completed request to the history used to estimate the execution time of the
+        next requests.
+        """
+        features = ExecutionFeatures.of_request(operation, meta_attrs, region_attrs,
+                                                [source.pretty_name() for source in eligible_sources],
+                                                population_size, genomic_interval)
+        time_estimator.estimator.record(features, time.perf_counter() - start_time)
+
     def warn_if_mixed_germline_somatic_vars(self, eligible_sources: Iterable[Type[Source]]):
         cell_types = set()
         for s in eligible_sources:
@@ -0,0 +1,101 @@
+"""
+Dense matrix of the frequencies of a list of variants (rows) in the groups of individuals (strata) of a population
+(columns). The sources return the size of each stratum and the occurrences of the variants in the strata where they
+occur (see Source.variant_occurrence_matrix); this module merges the output of the sources, fills the missing cells
+with zeros and computes all the frequencies at once.
+The matrix is formatted as a table with a row for each variant (ROWS) or, to be loaded directly into data frames, with
+the list of values of each column (COLUMNAR).
+"""
+from data_sources.io_parameters import Vocabulary, Mutation
+from data_sources import allele_frequency
+from typing import Dict, List, Tuple
+import numpy
+
+ROWS = 'rows'
+COLUMNAR = 'columnar'
+VARIANT_COLUMNS = [Vocabulary.CHROM.name, Vocabulary.START.name, Vocabulary.REF.name, Vocabulary.ALT.name]
+
+
+class MatrixBuilder:
+
+    def __init__(self, by_attributes: List[Vocabulary], variants: List[Mutation]):
+        """
+        :param by_attributes: the attributes identifying a stratum
+        :param variants: the requested variants. The ones given with their coordinates are rows of the matrix even if
+        they don't occur in the population; the ones given by id are added as they are found by the sources.
+        """
+        self.by_attributes = by_attributes
+        # stratum -> [population size, males (and individuals of unknown gender), females]
+        self._strata: Dict[tuple, List[int]] = {}
+        # (chrom, start, ref, alt) -> row of the matrix
+        self._variants: Dict[tuple, int] = {}
+        for variant in variants:
+            if variant.chrom is not None:
+                self._variants.setdefault((variant.chrom, variant.start, variant.ref, variant.alt), len(self._variants))
+        self._occurrences: List[Tuple[int, tuple, int]] = []
+
+    def _stratum_of(self, row) -> tuple:
+        return tuple(row[attr.name] for attr in self.by_attributes)
+
+    def add_strata(self, rows):
+        """
+        :param rows: rows having the attributes in by_attributes, the gender and Vocabulary.POPULATION_SIZE
+        """
+        for row in rows:
+            sizes = self._strata.setdefault(self._stratum_of(row), [0, 0, 0])
+            size = row[Vocabulary.POPULATION_SIZE.name]
+            sizes[0] += size
+            if row[Vocabulary.GENDER.name] == 'female':
+                sizes[2] += size
+            else:
+                sizes[1] += size
+
+    def add_occurrences(self, rows):
+        """
+        :param rows: rows having the attributes in by_attributes, CHROM, START, REF, ALT and Vocabulary.OCCURRENCE
+        """
+        for row in rows:
+            variant = tuple(row[name] for name in VARIANT_COLUMNS)
+            variant_idx = self._variants.setdefault(variant, len(self._variants))
+            self._occurrences.append((variant_idx, self._stratum_of(row), row[Vocabulary.OCCURRENCE.name]))
+
+    def number_of_variants(self) -> int:
+        return len(self._variants)
+
+    def population_size(self) -> int:
+        return sum(sizes[0] for sizes in self._strata.values())
+
+    def result(self, assembly: str, output_format: str) -> dict:
+        strata = sorted(self._strata.keys(), key=lambda stratum: tuple(str(value) for value in stratum))
+        stratum_idx = {stratum: idx for idx, stratum in enumerate(strata)}
+        variants = list(self._variants.keys())
+
+        occurrence = numpy.zeros((len(variants), len(strata)), dtype=numpy.int64)
+        for variant_idx, stratum, count in self._occurrences:
+            occurrence[variant_idx, stratum_idx[stratum]] += count
+        sizes = numpy.array([self._strata[stratum] for stratum in strata], dtype=numpy.int64).reshape(-1, 3)
+        chrom = numpy.array([variant[0] for variant in variants], dtype=numpy.int64).reshape(-1, 1)
+        start = numpy.array([variant[1] for variant in variants], dtype=numpy.int64).reshape(-1, 1)
+        frequency = allele_frequency.frequency(occurrence, sizes[:, 1], sizes[:, 2], chrom, start, assembly)
+
+        strata_columns = [attr.name for attr in self.by_attributes] + [Vocabulary.POPULATION_SIZE.name]
+        strata_rows = [list(stratum) + [self._strata[stratum][0]] for stratum in strata]
+        matrix_columns = VARIANT_COLUMNS + ['|'.join(str(value) for value in stratum) for stratum in strata]
+        if output_format == COLUMNAR:
+            return {
+                'strata': {
+                    'columns': strata_columns,
+                    'values': [list(values) for values in zip(*strata_rows)] or [[] for _ in strata_columns]
+                },
+                'columns': matrix_columns,
+                'values': [[variant[i] for variant in variants] for i in range(len(VARIANT_COLUMNS))]
+                + frequency.T.tolist()
+            }
+        return {
+            'strata': {
+                'columns': strata_columns,
+                'rows': strata_rows
+            },
+            'columns': matrix_columns,
+            'rows': [list(variant) + frequencies for variant, frequencies in zip(variants, frequency.tolist())]
+        }
@@ -1,9 +1,10 @@
-from sqlalchemy import MetaData, Table, select, text
+from sqlalchemy import MetaData, Table, select, text, case, func
 from sqlalchemy.engine import Connection
 from sqlalchemy.sql.expression import Selectable
 from typing import List
 from data_sources.io_parameters import *
 from data_sources.annot_interface import AnnotInterface, do_not_notify
+from data_sources import value_catalog
 import database.database as database
 import database.db_utils as utils
 from threading import RLock
@@ -22,7 +23,7 @@ db_meta: MetaData
 
 class Gencode(AnnotInterface):
 
-    log_sql_statements: bool = True
+    log_sql_statements: bool = False
     # MAP ATTRIBUTE NAMES TO TABLE COLUMN NAMES
     col_map = {
         Vocabulary.CHROM: 'chrom',
@@ -63,7 +64,7 @@ class Gencode(AnnotInterface):
         item_id_for_assembly = item_id_assembly_hg19 if assembly == 'hg19' else item_id_assembly_grch38
         stmt = stmt.where(ann_table.c.item_id == item_id_for_assembly)
         if self.log_sql_statements:
-            utils.show_stmt(connection, stmt, self.logger.debug, 'GENCODE_V19_HG19: ANNOTATE REGION/VARIANT')
+            utils.show_stmt(connection, stmt, self.sql_logger, 'GENCODE_V19_HG19: ANNOTATE REGION/VARIANT')
         return stmt
 
     def find_gene_region(self, connection: Connection, gene: Gene, output_attrs: List[Vocabulary], assembly):
@@ -78,45 +79,37 @@ class Gencode(AnnotInterface):
         item_id_for_assembly = item_id_assembly_hg19 if assembly == 'hg19' else item_id_assembly_grch38
         stmt = stmt.where(ann_table.c.item_id == item_id_for_assembly)
         if self.log_sql_statements:
-            utils.show_stmt(connection, stmt, self.logger.debug, 'GENCODE_V19_HG19: FIND GENE')
+            utils.show_stmt(connection, stmt, self.sql_logger, 'GENCODE_V19_HG19: FIND GENE')
+        return stmt
+
+    def genes(self, connection: Connection, gene_type: Optional[str], assembly) -> Selectable:
+        self.connection = connection
+        output_attrs = [Vocabulary.GENE_NAME, Vocabulary.GENE_ID, Vocabulary.GENE_TYPE, Vocabulary.CHROM,
+                        Vocabulary.START, Vocabulary.STOP]
+        item_id_for_assembly = item_id_assembly_hg19 if assembly == 'hg19' else item_id_assembly_grch38
+        stmt = select([ann_table.c[self.col_map[att]].label(att.name) for att in output_attrs]) \
+            .where(ann_table.c.item_id == item_id_for_assembly)
+        if gene_type is not None:
+            stmt = stmt.where(ann_table.c.gene_type == gene_type)
+        stmt = stmt.order_by(ann_table.c.chrom, ann_table.c.start)
+        if self.log_sql_statements:
+            utils.show_stmt(connection, stmt, self.sql_logger, 'GENCODE_V19_HG19: GENES')
         return stmt
 
-    # noinspection SpellCheckingInspection
     def values_of_attribute(self, connection, attribute: Vocabulary) -> (str, List):
-        distinct_values = {
-            self.col_map[Vocabulary.GENE_TYPE]: [
-                'sense_overlapping',
-                'Mt_tRNA',
-                'processed_transcript',
-                'TR_V_pseudogene',
-                'misc_RNA',
-                'snoRNA',
-                'protein_coding',
-                'TR_J_gene',
-                'IG_J_gene',
-                'rRNA',
-                'polymorphic_pseudogene',
-                'antisense',
-                'miRNA',
-                'IG_D_gene',
-                'snRNA',
-                'IG_V_gene',
-                'TR_J_pseudogene',
-                'Mt_rRNA',
-                '3prime_overlapping_ncrna',
-                'lincRNA',
-                'IG_J_pseudogene',
-                'TR_V_gene',
-                'sense_intronic',
-                'IG_C_pseudogene',
-                'IG_C_gene',
-                'TR_C_gene',
-                'pseudogene',
-                'IG_V_pseudogene',
-                'TR_D_gene'
-                ]
-        }
-        return 'GENCODE', distinct_values.get(self.col_map.get(attribute))
+        return 'GENCODE', value_catalog.of(self, connection).values(attribute)
+
+    def value_catalog_stmt(self, connection) -> Selectable:
+        self.connection = connection
+        assembly = case([(ann_table.c.item_id == item_id_assembly_hg19, 'hg19')], else_='grch38')
+        stmt = select([assembly.label(Vocabulary.ASSEMBLY.name),
+                       ann_table.c[self.col_map[Vocabulary.GENE_TYPE]].label(Vocabulary.GENE_TYPE.name),
+                       func.count().label(Vocabulary.COUNT.name)]) \
+            .where(ann_table.c.item_id.in_([item_id_assembly_hg19, item_id_assembly_grch38])) \
+            .group_by(ann_table.c.item_id, ann_table.c[self.col_map[Vocabulary.GENE_TYPE]])
+        if self.log_sql_statements:
+            utils.show_stmt(connection, stmt, self.sql_logger, 'GENCODE_V19_HG19: CATALOG OF VALUES')
+        return stmt
 
     @staticmethod
     def init_singleton_table():
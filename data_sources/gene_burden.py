@@ -0,0 +1,84 @@
+"""
+Burden of variants of a population in each gene. The genotypes of the population, sorted by position (see
+Source.genotypes_by_position), are matched with the gene intervals (see AnnotInterface.genes) by a sweep line over
+each chromosome: genes enter the set of active genes when the sweep reaches their start and leave it after their
+stop, so every genotype is compared only with the genes containing it. For each gene it is counted:
+- VARIANTS: the number of distinct variants falling in the gene;
+- CARRIERS: the number of individuals owning at least one of those variants;
+- ALLELES: the total number of alleles equal to those variants.
+"""
+from data_sources.io_parameters import Vocabulary
+from typing import Iterable, List
+import heapq
+
+# name of the column identifying the individual in the statements of Source.genotypes_by_position
+ITEM_ID = 'ITEM_ID'
+GENE_COLUMNS = [Vocabulary.GENE_NAME.name, Vocabulary.GENE_ID.name, Vocabulary.GENE_TYPE.name, Vocabulary.CHROM.name,
+                Vocabulary.START.name, Vocabulary.STOP.name]
+OUTPUT_COLUMNS = GENE_COLUMNS + ['VARIANTS', 'CARRIERS', 'ALLELES']
+
+
+class _GeneCounter:
+    __slots__ = ('gene', 'variants', 'carriers', 'alleles', 'last_variant')
+
+    def __init__(self, gene: list):
+        self.gene = gene
+        self.variants = 0
+        self.carriers = set()
+        self.alleles = 0
+        self.last_variant = None
+
+    def add(self, variant: tuple, item_id, occurrence: int):
+        # genotypes are sorted by variant, so a new variant differs from the last one
+        if variant != self.last_variant:
+            self.variants += 1
+            self.last_variant = variant
+        self.carriers.add(item_id)
+        self.alleles += occurrence
+
+    def as_row(self) -> list:
+        return self.gene + [self.variants, len(self.carriers), self.alleles]
+
+
+def burden(genes: Iterable, genotypes: Iterable) -> List[list]:
+    """
+    :param genes: rows with the columns GENE_COLUMNS
+    :param genotypes: rows with the columns CHROM, START, REF, ALT, ITEM_ID, OCCURRENCE sorted by CHROM, START, REF,
+    ALT
+    :return: a row of OUTPUT_COLUMNS for each gene containing at least one variant, in order of position
+    """
+    chrom_idx, start_idx, stop_idx = GENE_COLUMNS.index(Vocabulary.CHROM.name), \
+        GENE_COLUMNS.index(Vocabulary.START.name), GENE_COLUMNS.index(Vocabulary.STOP.name)
+    genes = sorted([list(gene) for gene in genes], key=lambda gene: (gene[chrom_idx], gene[start_idx]))
+    result: List[_GeneCounter] = []
+    active = []         # heap of (stop, index in genes, counter)
+    next_gene = 0
+    current_chrom = None
+
+    def close(counter: _GeneCounter):
+        if counter.variants > 0:
+            result.append(counter)
+
+    for chrom, start, ref, alt, item_id, occurrence in genotypes:
+        if chrom != current_chrom:
+            # the sweep restarts on a new chromosome
+            for _, _, counter in active:
+                close(counter)
+            active = []
+            current_chrom = chrom
+        # genes starting before the current position enter the sweep (if they're on this chromosome)
+        while next_gene < len(genes) and (genes[next_gene][chrom_idx], genes[next_gene][start_idx]) <= (chrom, start):
+            gene = genes[next_gene]
+            if gene[chrom_idx] == chrom:
+                heapq.heappush(active, (gene[stop_idx], next_gene, _GeneCounter(gene)))
+            next_gene += 1
+        # genes ending before the current position leave the sweep
+        while active and active[0][0] < start:
+            close(heapq.heappop(active)[2])
+        for _, _, counter in active:
+            counter.add((start, ref, alt), item_id, occurrence)
+    for _, _, counter in active:
+        close(counter)
+
+    result.sort(key=lambda counter: (counter.gene[chrom_idx], counter.gene[start_idx]))
+    return [counter.as_row() for counter in result]
@@ -297,6 +297,7 @@ class SourceMessage:
     class Type(Enum):
         TIME_TO_FINISH = 1
         GENERAL_WARNING = 2
+        POPULATION_SIZE = 3     # number of individuals selected in the source; msg is the integer as string
 
     def __init__(self, msg_type: Type, msg: str):
         self.type = msg_type
@@ -0,0 +1,243 @@
+"""
+Precomputed allele counts of the 1000 Genomes variants by stratum of individuals. A stratum is a combination of the
+metadata values (assembly, super population, population, ...) shared by some individuals: since there are only a few
+hundred strata, populations defined by metadata only can be analysed by summing the counts of their strata instead of
+reading every genotype of every individual.
+
+The tables are built by
+    python main.py aggregates <db_user> <db_password> <db_port> <log level>
+and kept up to date, after the load or the removal of samples, by
+    python main.py refresh <db_user> <db_password> <db_port> <log level>
+which applies only the contribution of the individuals added, removed or moved to another stratum since the last
+build/refresh.
+"""
+from data_sources.io_parameters import MetadataAttrs, Vocabulary
+from sqlalchemy import MetaData, Table, text, and_
+from sqlalchemy.engine import Connection
+from database import data_version
+from typing import Optional
+from threading import RLock
+import database.database as database
+from loguru import logger
+import time
+
+# TABLE PARAMETERS
+default_schema_name = 'rr'
+strata_table_name = 'kgenomes_strata'
+strata_items_table_name = 'kgenomes_strata_items'
+counts_table_name = 'kgenomes_strata_counts'
+# columns of the metadata table defining a stratum (all the metadata attributes of 1000 Genomes except the donor id)
+STRATUM_COLUMNS = ['assembly', 'super_population', 'population', 'ethnicity', 'gender', 'dna_source', 'health_status',
+                   'disease']
+# the attributes of KGenomes.meta_col_map available in the table of strata
+STRATUM_ATTRIBUTES = {Vocabulary.ASSEMBLY, Vocabulary.SUPER_POPULATION, Vocabulary.POPULATION, Vocabulary.ETHNICITY,
+                      Vocabulary.GENDER, Vocabulary.DNA_SOURCE, Vocabulary.HEALTH_STATUS, Vocabulary.DISEASE}
+# seconds before checking again the existence of the tables, if they were missing
+RECHECK_PERIOD = 600
+
+# TABLES
+initializing_lock = RLock()
+strata: Optional[Table] = None
+counts: Optional[Table] = None
+_last_check: Optional[float] = None
+
+_KGENOMES_ITEMS = "SELECT item_id FROM public.item WHERE dataset_id IN ( " \
+                  "SELECT dataset_id FROM public.dataset WHERE dataset_name ILIKE '%1000GENOMES%')"
+_STRATUM_COLUMNS_LIST = ', '.join(STRATUM_COLUMNS)
+_SAME_STRATUM = ' AND '.join(f'm.{col} IS NOT DISTINCT FROM s.{col}' for col in STRATUM_COLUMNS)
+BUILD_STMTS = [
+    f'DROP TABLE IF EXISTS {default_schema_name}.{counts_table_name}',
+    f'DROP TABLE IF EXISTS {default_schema_name}.{strata_items_table_name}',
+    f'DROP TABLE IF EXISTS {default_schema_name}.{strata_table_name}',
+    # strata and their size
+    f'CREATE TABLE {default_schema_name}.{strata_table_name} AS '
+    f'SELECT (row_number() OVER ())::integer AS stratum_id, {_STRATUM_COLUMNS_LIST}, count(*)::integer AS donors '
+    f'FROM dw.genomes_metadata_3 '
+    f'WHERE item_id IN ({_KGENOMES_ITEMS}) '
+    f'GROUP BY {_STRATUM_COLUMNS_LIST}',
+    # stratum of each individual
+    f'CREATE TABLE {default_schema_name}.{strata_items_table_name} AS '
+    f'SELECT m.item_id, s.stratum_id '
+    f'FROM dw.genomes_metadata_3 AS m JOIN {default_schema_name}.{strata_table_name} AS s ON {_SAME_STRATUM} '
+    f'WHERE m.item_id IN ({_KGENOMES_ITEMS})',
+    # allele counts of each variant in each stratum
+    f'CREATE TABLE {default_schema_name}.{counts_table_name} AS '
+    f'SELECT i.stratum_id, g.chrom, g.start, g.ref, g.alt, '
+    f'(sum(g.al1) + sum(coalesce(g.al2, 0)))::integer AS occurrence, count(*)::integer AS positive_donors '
+    f'FROM rr.kgenomes_red AS g JOIN {default_schema_name}.{strata_items_table_name} AS i ON g.item_id = i.item_id '
+    f'GROUP BY i.stratum_id, g.chrom, g.start, g.ref, g.alt',
+    f'CREATE INDEX ON {default_schema_name}.{strata_items_table_name} (item_id)',
+    f'CREATE INDEX ON {default_schema_name}.{counts_table_name} (stratum_id)',
+    f'CREATE INDEX ON {default_schema_name}.{counts_table_name} (chrom, start, ref, alt)',
+    f'ANALYZE {default_schema_name}.{strata_table_name}',
+    f'ANALYZE {default_schema_name}.{strata_items_table_name}',
+    f'ANALYZE {default_schema_name}.{counts_table_name}'
+]
+_STRATA = f'{default_schema_name}.{strata_table_name}'
+_STRATA_ITEMS = f'{default_schema_name}.{strata_items_table_name}'
+_COUNTS = f'{default_schema_name}.{counts_table_name}'
+_SAME_VARIANT = 'c.stratum_id = d.stratum_id AND c.chrom = d.chrom AND c.start = d.start AND c.ref = d.ref AND c.alt = d.alt'
+_COUNTS_OF_ITEMS_IN = \
+    'SELECT a.stratum_id, g.chrom, g.start, g.ref, g.alt, ' \
+    '(sum(g.al1) + sum(coalesce(g.al2, 0)))::integer AS occurrence, count(*)::integer AS positive_donors ' \
+    'FROM rr.kgenomes_red AS g JOIN {items} AS a ON g.item_id = a.item_id ' \
+    '{where}' \
+    'GROUP BY a.stratum_id, g.chrom, g.start, g.ref, g.alt'
+# The delta of individuals is the difference between the current stratum of each individual and the one recorded in
+# the table of items of the strata. The added individuals contribute their genotypes to the counts of their stratum;
+# the strata losing individuals are instead recomputed from the genotypes of their current individuals, as the
+# genotypes of removed samples may no longer be available.
+REFRESH_STMTS = [
+    # current stratum of each individual (creating the missing strata)
+    f'CREATE TEMPORARY TABLE current_items ON COMMIT DROP AS '
+    f'SELECT item_id, {_STRATUM_COLUMNS_LIST} FROM dw.genomes_metadata_3 WHERE item_id IN ({_KGENOMES_ITEMS})',
+    f'INSERT INTO {_STRATA} (stratum_id, {_STRATUM_COLUMNS_LIST}, donors) '
+    f'SELECT (SELECT coalesce(max(stratum_id), 0) FROM {_STRATA}) + (row_number() OVER ())::integer, '
+    f'{_STRATUM_COLUMNS_LIST}, 0 '
+    f'FROM (SELECT DISTINCT {_STRATUM_COLUMNS_LIST} FROM current_items AS m '
+    f'      WHERE NOT EXISTS (SELECT 1 FROM {_STRATA} AS s WHERE {_SAME_STRATUM})) AS new_strata',
+    f'CREATE TEMPORARY TABLE current_assignment ON COMMIT DROP AS '
+    f'SELECT m.item_id, s.stratum_id FROM current_items AS m JOIN {_STRATA} AS s ON {_SAME_STRATUM}',
+    # delta of individuals
+    f'CREATE TEMPORARY TABLE added_items ON COMMIT DROP AS '
+    f'SELECT item_id, stratum_id FROM current_assignment EXCEPT SELECT item_id, stratum_id FROM {_STRATA_ITEMS}',
+    f'CREATE TEMPORARY TABLE removed_items ON COMMIT DROP AS '
+    f'SELECT item_id, stratum_id FROM {_STRATA_ITEMS} EXCEPT SELECT item_id, stratum_id FROM current_assignment',
+    'CREATE TEMPORARY TABLE recomputed_strata ON COMMIT DROP AS SELECT DISTINCT stratum_id FROM removed_items',
+    # strata only gaining individuals: add the counts of the new individuals
+    'CREATE TEMPORARY TABLE counts_delta ON COMMIT DROP AS ' +
+    _COUNTS_OF_ITEMS_IN.format(items='added_items',
+                               where='WHERE a.stratum_id NOT IN (SELECT stratum_id FROM recomputed_strata) '),
+    f'UPDATE {_COUNTS} AS c SET occurrence = c.occurrence + d.occurrence, '
+    f'positive_donors = c.positive_donors + d.positive_donors '
+    f'FROM counts_delta AS d WHERE {_SAME_VARIANT}',
+    f'INSERT INTO {_COUNTS} (stratum_id, chrom, start, ref, alt, occurrence, positive_donors) '
+    f'SELECT d.* FROM counts_delta AS d WHERE NOT EXISTS (SELECT 1 FROM {_COUNTS} AS c WHERE {_SAME_VARIANT})',
+    # strata losing individuals: recompute
+    f'DELETE FROM {_COUNTS} WHERE stratum_id IN (SELECT stratum_id FROM recomputed_strata)',
+    f'INSERT INTO {_COUNTS} (stratum_id, chrom, start, ref, alt, occurrence, positive_donors) ' +
+    _COUNTS_OF_ITEMS_IN.format(items='current_assignment',
+                               where='WHERE a.stratum_id IN (SELECT stratum_id FROM recomputed_strata) '),
+    # individuals and size of the strata
+    f'DELETE FROM {_STRATA_ITEMS} AS i USING removed_items AS r '
+    f'WHERE i.item_id = r.item_id AND i.stratum_id = r.stratum_id',
+    f'INSERT INTO {_STRATA_ITEMS} (item_id, stratum_id) SELECT item_id, stratum_id FROM added_items',
+    f'UPDATE {_STRATA} AS s SET donors = (SELECT count(*) FROM {_STRATA_ITEMS} AS i WHERE i.stratum_id = s.stratum_id) '
+    f'WHERE s.stratum_id IN (SELECT stratum_id FROM added_items UNION SELECT stratum_id FROM removed_items)',
+    f'DELETE FROM {_STRATA} WHERE donors = 0',
+    f'ANALYZE {_STRATA}',
+    f'ANALYZE {_STRATA_ITEMS}',
+    f'ANALYZE {_COUNTS}'
+]
+
+
+def available() -> bool:
+    """
+    :return: True if the precomputed tables exist. Their absence is checked again at most every RECHECK_PERIOD seconds.
+    """
+    global strata, counts, _last_check
+    if strata is not None and counts is not None:
+        return True
+    with initializing_lock:
+        if strata is None and (_last_check is None or time.time() - _last_check > RECHECK_PERIOD):
+            _last_check = time.time()
+
+            def reflect(connection: Connection):
+                if not connection.dialect.has_table(connection, counts_table_name, schema=default_schema_name):
+                    return None, None
+                db_meta = MetaData()
+                return \
+                    Table(strata_table_name, db_meta, autoload=True, autoload_with=connection,
+                          schema=default_schema_name), \
+                    Table(counts_table_name, db_meta, autoload=True, autoload_with=connection,
+                          schema=default_schema_name)
+
+            try:
+                strata_t, counts_t = database.try_py_function(reflect)
+            except Exception:
+                logger.exception('unable to check the existence of the precomputed 1000 Genomes allele counts')
+                return False
+            if strata_t is None:
+                logger.info('precomputed 1000 Genomes allele counts not available')
+            else:
+                counts = counts_t
+                strata = strata_t
+        return strata is not None and counts is not None
+
+
+def strata_having(meta_attrs: MetadataAttrs):
+    """
+    :return: the condition on the table of strata selecting the individuals having meta_attrs. It must select the same
+    individuals of KGenomes.create_table_of_meta.
+    """
+    conditions = []
+    if meta_attrs.gender:
+        conditions.append(strata.c.gender == meta_attrs.gender)
+    if meta_attrs.health_status is not None:
+        conditions.append(strata.c.health_status == meta_attrs.health_status)
+    if meta_attrs.disease:
+        conditions.append(strata.c.disease == meta_attrs.disease)
+    if meta_attrs.dna_source:
+        conditions.append(strata.c.dna_source.in_(meta_attrs.dna_source))
+    if meta_attrs.assembly:
+        conditions.append(strata.c.assembly == meta_attrs.assembly)
+    if meta_attrs.population:
+        conditions.append(strata.c.population.in_(meta_attrs.population))
+    elif meta_attrs.super_population:
+        conditions.append(strata.c.super_population.in_(meta_attrs.super_population))
+    elif meta_attrs.ethnicity:
+        conditions.append(strata.c.ethnicity.in_(meta_attrs.ethnicity))
+    return and_(*conditions)
+
+
+def build():
+    """
+    (Re)creates the tables of precomputed counts in a single transaction, so that the requests never read partially
+    built tables (they wait for the transaction to commit).
+    """
+    global strata, counts, _last_check
+    start_time = time.time()
+    with database.db_engine.begin() as connection:
+        for stmt in BUILD_STMTS:
+            logger.info(stmt)
+            connection.execute(text(stmt))
+        version = data_version.bump(connection)
+    with initializing_lock:
+        strata, counts, _last_check = None, None, None
+    logger.info(f'precomputed 1000 Genomes allele counts built in {time.time() - start_time:.0f} seconds. '
+                f'Data version {version}')
+
+
+def refresh():
+    """
+    Refreshes the table of metadata (if it is a materialized view) and applies to the tables of precomputed counts the
+    changes of the individuals since the last build/refresh, in a single transaction. Then it bumps the data version.
+    If the tables of precomputed counts don't exist, they are built from scratch.
+    """
+    with database.db_engine.connect() as connection:
+        if not connection.dialect.has_table(connection, counts_table_name, schema=default_schema_name):
+            logger.info('precomputed 1000 Genomes allele counts not found')
+            build()
+            return
+    start_time = time.time()
+    with database.db_engine.begin() as connection:
+        is_materialized_view = connection.execute(text(
+            "SELECT 1 FROM pg_matviews WHERE schemaname = 'dw' AND matviewname = 'genomes_metadata_3'")).scalar()
+        if is_materialized_view:
+            logger.info('REFRESH MATERIALIZED VIEW dw.genomes_metadata_3')
+            connection.execute(text('REFRESH MATERIALIZED VIEW dw.genomes_metadata_3'))
+        for stmt in REFRESH_STMTS:
+            logger.info(stmt)
+            result = connection.execute(text(stmt))
+            if result.rowcount >= 0:
+                logger.info(f'{result.rowcount} rows')
+            if stmt.startswith('CREATE TEMPORARY TABLE recomputed_strata'):
+                num_added, num_removed = connection.execute(text(
+                    'SELECT (SELECT count(*) FROM added_items), (SELECT count(*) FROM removed_items)')).fetchone()
+                logger.info(f'{num_added} individuals added to a stratum, {num_removed} removed from a stratum')
+                if num_added == 0 and num_removed == 0:
+                    logger.info('precomputed 1000 Genomes allele counts already up to date')
+                    return
+        version = data_version.bump(connection)
+    logger.info(f'precomputed 1000 Genomes allele counts refreshed in {time.time() - start_time:.0f} seconds. '
+                f'Data version {version}')
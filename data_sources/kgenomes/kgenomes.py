@@ -2,12 +2,19 @@ import locale
 
 from ..source_interface import *
 from ..io_parameters import *
-from sqlalchemy import MetaData, Table, cast, select, union_all, union, tuple_, func, exists, asc, desc, intersect, literal, column, types, text
-from sqlalchemy.sql.expression import Selectable, except_
+from sqlalchemy import MetaData, Table, cast, select, union_all, tuple_, func, asc, desc, intersect, literal, column, types, text, true, false
+from sqlalchemy.sql.expression import Selectable, ClauseElement, except_
 from sqlalchemy.engine import Connection
-from functools import reduce
 import database.db_utils as utils
 import database.database as database
+from . import aggregates
+from .. import allele_frequency
+from .. import value_catalog
+from .. import selectivity
+from .. import gene_burden
+from monitoring import metrics
+from .. import linkage
+from .. import case_control
 from threading import RLock
 from loguru import logger
 
@@ -62,7 +69,7 @@ class KGenomes(Source):
         Vocabulary.FILTER: 'filter'
     }
 
-    log_sql_commands: bool = True
+    log_sql_commands: bool = False
     
     def __init__(self, logger_instance, notify_message=do_not_notify):
         super().__init__(logger_instance, notify_message)
@@ -90,7 +97,7 @@ class KGenomes(Source):
         self._set_meta_attributes(meta_attrs)
         self.create_table_of_meta(names_columns_of_interest)
         self._set_region_attributes(region_attrs)
-        self.create_table_of_regions(['item_id'])
+        self.create_table_of_regions()
 
         # compute statistics
         columns_of_interest = [self.my_meta_t.c[self.meta_col_map[attr]].label(attr.name) for attr in by_attributes]
@@ -104,7 +111,27 @@ class KGenomes(Source):
         if with_download_urls:
             stmt = stmt.where(self.my_meta_t.c.item_id == public_item.c.item_id)
         if self.log_sql_commands:
-            utils.show_stmt(self.connection, stmt, self.logger.debug, 'KGENOMES: STMT DONORS WITH REQUIRED ATTRIBUTES')
+            utils.show_stmt(self.connection, stmt, self.sql_logger, 'KGENOMES: STMT DONORS WITH REQUIRED ATTRIBUTES')
+        return stmt
+
+    def item_ids(self, connection: Connection, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs) -> Selectable:
+        """
+        Assembles a query statement that, when executed, returns the item_id of the individuals matching the
+        requirements in meta_attrs and region_attrs
+        """
+        self.connection = connection
+        self._set_meta_attributes(meta_attrs)
+        self.create_table_of_meta(['item_id'])
+        self._set_region_attributes(region_attrs)
+        self.create_table_of_regions()
+
+        stmt = select([self.my_meta_t.c.item_id])
+        if self.my_region_t is not None:
+            stmt = stmt.where(self.my_meta_t.c.item_id.in_(
+                select([self.my_region_t.c.item_id]).distinct()
+            ))
+        if self.log_sql_commands:
+            utils.show_stmt(self.connection, stmt, self.sql_logger, 'KGENOMES: STMT ITEM_IDS OF POPULATION')
         return stmt
 
     def variant_occurrence(self, connection: Connection, by_attributes: list, meta_attrs: MetadataAttrs,
@@ -120,7 +147,7 @@ class KGenomes(Source):
         self._set_meta_attributes(meta_attrs)
         self.create_table_of_meta(names_columns_of_interest + ['item_id'])
         self._set_region_attributes(region_attrs)
-        self.create_table_of_regions(['item_id'])
+        self.create_table_of_regions()
 
         # select target attributes from table of metadata with meta_attrs
         stmt_sample_set = select([self.my_meta_t.c[self.meta_col_map[attr]] for attr in by_attributes]
@@ -149,7 +176,108 @@ class KGenomes(Source):
                                                    stmt_sample_set.c.item_id == stmt_samples_w_var.c.item_id))
         # TODO test what happens if sample set is empty and it is anyway used in the left join statement
         if self.log_sql_commands:
-            utils.show_stmt(connection, stmt, self.logger.debug, 'KGENOMES: STMT VARIANT OCCURRENCE')
+            utils.show_stmt(connection, stmt, self.sql_logger, 'KGENOMES: STMT VARIANT OCCURRENCE')
+        return stmt
+
+    def variant_occurrence_by_strata(self, connection: Connection, by_attributes: List[Vocabulary],
+                                     meta_attrs: MetadataAttrs, region_attrs: RegionAttrs,
+                                     variant: Mutation) -> Optional[Selectable]:
+        """
+        Answers populations defined by metadata only from the precomputed counts of the strata of individuals.
+        """
+        if variant.chrom is None or self._constrains_regions(region_attrs) or self.population_items is not None \
+                or not aggregates.available() or not set(by_attributes).issubset(aggregates.STRATUM_ATTRIBUTES):
+            return None
+        # same as create_table_of_meta
+        if meta_attrs.health_status is False or (meta_attrs.disease and meta_attrs.disease != 'none'):
+            raise EmptyResult('1000Genomes')
+        strata = aggregates.strata
+        counts = aggregates.counts
+        variant_counts = select([counts.c.stratum_id, counts.c.occurrence, counts.c.positive_donors]) \
+            .where((counts.c.chrom == variant.chrom) &
+                   (counts.c.start == variant.start) &
+                   (counts.c.ref == variant.ref) &
+                   (counts.c.alt == variant.alt)) \
+            .alias('variant_counts')
+        stmt = \
+            select([strata.c[self.meta_col_map[attr]].label(attr.name) for attr in by_attributes] +
+                   [strata.c.donors.label(Vocabulary.POPULATION_SIZE.name),
+                    func.coalesce(variant_counts.c.positive_donors, 0).label(Vocabulary.POSITIVE_DONORS.name),
+                    func.coalesce(variant_counts.c.occurrence, 0).label(Vocabulary.OCCURRENCE.name)]) \
+            .select_from(strata.outerjoin(variant_counts, strata.c.stratum_id == variant_counts.c.stratum_id)) \
+            .where(aggregates.strata_having(meta_attrs))
+        if self.log_sql_commands:
+            utils.show_stmt(connection, stmt, self.sql_logger, 'KGENOMES: STMT VARIANT OCCURRENCE BY STRATA')
+        return stmt
+
+    def variant_occurrence_matrix(self, connection: Connection, by_attributes: List[Vocabulary],
+                                  meta_attrs: MetadataAttrs, region_attrs: RegionAttrs,
+                                  variants: List[Mutation]) -> Tuple[Selectable, Selectable]:
+        # init state
+        self.connection = connection
+        names_columns_of_interest = [self.meta_col_map[attr] for attr in by_attributes]
+        self._set_meta_attributes(meta_attrs)
+        self.create_table_of_meta(names_columns_of_interest + ['item_id'])
+        self._set_region_attributes(region_attrs)
+        self.create_table_of_regions()
+
+        sample_set = select([self.my_meta_t.c[name] for name in names_columns_of_interest] + [self.my_meta_t.c.item_id])
+        if self.my_region_t is not None:
+            sample_set = sample_set.where(self.my_meta_t.c.item_id.in_(
+                select([self.my_region_t.c.item_id]).distinct()
+            ))
+        sample_set = sample_set.alias('sample_set')
+        strata_columns = [sample_set.c[name] for name in names_columns_of_interest]
+        strata_labels = [sample_set.c[self.meta_col_map[attr]].label(attr.name) for attr in by_attributes]
+
+        strata_stmt = select(strata_labels + [func.count().label(Vocabulary.POPULATION_SIZE.name)]) \
+            .group_by(*strata_columns)
+
+        # one join of the regions of the variants with the individuals, and a single aggregation
+        variant_regions = self._stmt_where_region_is_any_of_mutations(
+            *variants,
+            from_table=genomes,
+            select_expression=select([genomes.c.item_id, genomes.c.chrom, genomes.c.start, genomes.c.ref,
+                                      genomes.c.alt, (genomes.c.al1 + func.coalesce(genomes.c.al2, 0)).label('occurrence')])) \
+            .alias('variant_regions')
+        counts_stmt = select(strata_labels +
+                             [variant_regions.c.chrom.label(Vocabulary.CHROM.name),
+                              variant_regions.c.start.label(Vocabulary.START.name),
+                              variant_regions.c.ref.label(Vocabulary.REF.name),
+                              variant_regions.c.alt.label(Vocabulary.ALT.name),
+                              func.sum(variant_regions.c.occurrence).label(Vocabulary.OCCURRENCE.name)]) \
+            .select_from(sample_set.join(variant_regions, sample_set.c.item_id == variant_regions.c.item_id)) \
+            .group_by(*strata_columns, variant_regions.c.chrom, variant_regions.c.start, variant_regions.c.ref,
+                      variant_regions.c.alt)
+        if self.log_sql_commands:
+            utils.show_stmt(connection, counts_stmt, self.sql_logger, 'KGENOMES: STMT VARIANT OCCURRENCE MATRIX')
+        return strata_stmt, counts_stmt
+
+    def genotypes_by_position(self, connection: Connection, meta_attrs: MetadataAttrs,
+                              region_attrs: Optional[RegionAttrs]) -> Selectable:
+        # init state
+        self.connection = connection
+        self._set_meta_attributes(meta_attrs)
+        self.create_table_of_meta(['item_id'])
+        self._set_region_attributes(region_attrs)
+        self.create_table_of_regions()
+
+        sample_set = select([self.my_meta_t.c.item_id])
+        if self.my_region_t is not None:
+            sample_set = sample_set.where(self.my_meta_t.c.item_id.in_(
+                select([self.my_region_t.c.item_id]).distinct()
+            ))
+        sample_set = sample_set.alias('sample_set')
+        stmt = select([genomes.c.chrom.label(Vocabulary.CHROM.name),
+                       genomes.c.start.label(Vocabulary.START.name),
+                       genomes.c.ref.label(Vocabulary.REF.name),
+                       genomes.c.alt.label(Vocabulary.ALT.name),
+                       genomes.c.item_id.label(gene_burden.ITEM_ID),
+                       (genomes.c.al1 + func.coalesce(genomes.c.al2, 0)).label(Vocabulary.OCCURRENCE.name)]) \
+            .select_from(genomes.join(sample_set, genomes.c.item_id == sample_set.c.item_id)) \
+            .order_by(genomes.c.chrom, genomes.c.start, genomes.c.ref, genomes.c.alt)
+        if self.log_sql_commands:
+            utils.show_stmt(connection, stmt, self.sql_logger, 'KGENOMES: STMT GENOTYPES BY POSITION')
         return stmt
 
     def rank_variants_by_frequency(self, connection, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs, ascending: bool,
@@ -157,9 +285,19 @@ class KGenomes(Source):
         # init state
         self.connection = connection
         self._set_meta_attributes(meta_attrs)
-        self.create_table_of_meta(['item_id', 'gender'])
         self._set_region_attributes(region_attrs)
-        self.create_table_of_regions(['item_id'])
+        if time_estimate_only:
+            # when the statistics are enough, the estimate doesn't need the tables of the population (an empty
+            # population is instead verified on the tables, as the statistics may predate the last loads)
+            population_size = self._estimated_population_size()
+            if population_size:
+                from_aggregates = not self._constrains_regions(region_attrs)
+                if not from_aggregates:
+                    self.notify_message(SourceMessage.Type.POPULATION_SIZE, str(population_size))
+                self._notify_time_estimate(population_size, from_aggregates)
+                raise EmptyResult('1000Genomes')
+        self.create_table_of_meta(['item_id', 'gender'])
+        self.create_table_of_regions()
 
         # if self.my_region_t is None:
         #     raise Notice("1000Genomes data set is too broad. Please restrict the population size by setting at least one "
@@ -173,69 +311,214 @@ class KGenomes(Source):
                 .where(self.my_meta_t.c.item_id.in_(select([self.my_region_t.c.item_id])))
         females_and_males_stmt = females_and_males_stmt.group_by(self.my_meta_t.c.gender)
 
-        gender_of_individuals = [row.values() for row in connection.execute(females_and_males_stmt).fetchall()]
+        if self.dry_run:
+            # the statement is only explained: instead of evaluating the region constraints to count the individuals,
+            # their number is estimated from the statistics in selectivity or by the query planner
+            population_size = self._estimated_population_size()
+            if not population_size:
+                members = select([self.my_meta_t.c.item_id])
+                if self.my_region_t is not None:
+                    members = members.where(self.my_meta_t.c.item_id.in_(select([self.my_region_t.c.item_id])))
+                population_size = int(utils.estimated_rows(members, connection))
+            gender_of_individuals = [['male', population_size // 2], ['female', population_size - population_size // 2]]
+        else:
+            gender_of_individuals = [row.values() for row in connection.execute(females_and_males_stmt).fetchall()]
         if len(gender_of_individuals) == 0:
             raise EmptyResult('1000Genomes')
         females = next((el[1] for el in gender_of_individuals if el[0] == 'female'), 0)
         males = next((el[1] for el in gender_of_individuals if el[0] == 'male'), 0)
         population_size = males + females
-
-        if population_size > 150:
-            raise Notice(
-                f"1000Genomes data set is too broad. Please restrict the population size by setting more constraints. "
-                f"This query is allowed for populations smaller than 150. Currently selected is {population_size}")
+        # populations defined by metadata only are ranked by summing the precomputed counts of their strata
+        from_aggregates = self.my_region_t is None and self.population_items is None and aggregates.available()
+        if not from_aggregates:     # otherwise the cost of the ranking doesn't depend on the population size
+            self.notify_message(SourceMessage.Type.POPULATION_SIZE, str(population_size))
 
         if time_estimate_only:
-            estimated_time = str(9*population_size) if population_size <= 149 else "2700"  # ~45 min if pop > 149
-            self.notify_message(SourceMessage.Type.TIME_TO_FINISH, estimated_time)
-            self.notify_message(SourceMessage.Type.GENERAL_WARNING, f'Genomes to analyze in 1000Genomes: {population_size}')
-            locale.setlocale(locale.LC_ALL, '')
-            estimated_n_variants = 4144924*population_size
-            self.notify_message(SourceMessage.Type.GENERAL_WARNING, f'Estimated number variants to rank in 1000Genomes: ~{estimated_n_variants:n}')
+            self._notify_time_estimate(population_size, from_aggregates)
             raise EmptyResult('1000Genomes')
 
-        # reduce size of the join with genomes table
+        if from_aggregates:
+            counts = aggregates.counts
+            selected_strata = select([aggregates.strata.c.stratum_id]) \
+                .where(aggregates.strata_having(meta_attrs)) \
+                .alias('selected_strata')
+            stmt = self._stmt_rank_variants(counts,
+                                            counts.join(selected_strata,
+                                                        counts.c.stratum_id == selected_strata.c.stratum_id),
+                                            func.sum(counts.c.occurrence), func.sum(counts.c.positive_donors),
+                                            meta_attrs.assembly, males, females, population_size, ascending,
+                                            freq_threshold, limit_result)
+            self.logger.debug(f'KGenomes: request /rank_variants_by_frequency for a population of {population_size} '
+                              f'individuals answered from the precomputed counts')
+            if self.log_sql_commands:
+                utils.show_stmt(connection, stmt, self.sql_logger, 'KGenomes: RANKING VARIANTS FROM PRECOMPUTED COUNTS')
+            return stmt
+
+        # Actually, self.my_region_t already contains only the individuals compatible with meta_attrs, but it can contain
+        # duplicated item_id. Since we want to join, it's better to remove them.
+        if self.my_region_t is not None:
+            sample_set = intersect(select([self.my_meta_t.c.item_id]), select([self.my_region_t.c.item_id])) \
+                .alias('sample_set')
+        else:
+            sample_set = select([self.my_meta_t.c.item_id]).alias('sample_set')
+
+        # two equivalent strategies: a join with the whole table genomes (read sequentially) or, for each individual,
+        # the scan of its variants through the index on item_id. OFFSET 0 prevents the planner from flattening the
+        # LATERAL subquery into a plain join, so the second statement is always executed one individual at a time.
+        variants_of_sample = select([genomes.c.item_id, genomes.c.chrom, genomes.c.start, genomes.c.ref, genomes.c.alt,
+                                     genomes.c.al1, genomes.c.al2]) \
+            .where(genomes.c.item_id == sample_set.c.item_id) \
+            .offset(0) \
+            .lateral('variants_of_sample')
         genomes_red = select(
             [genomes.c.item_id, genomes.c.chrom, genomes.c.start, genomes.c.ref, genomes.c.alt, genomes.c.al1,
              genomes.c.al2])\
             .alias('variants_few_columns')
-
-        # custom functions
-        func_occurrence = (func.sum(genomes_red.c.al1) + func.sum(func.coalesce(genomes_red.c.al2, 0))).label(
-            Vocabulary.OCCURRENCE.name)
-        func_positive_donors = func.count(genomes_red.c.item_id).label(Vocabulary.POSITIVE_DONORS.name)
-        if meta_attrs.assembly == 'hg19':
-            func_frequency_new = func.rr.mut_frequency_new_hg19(func_occurrence, males, females, genomes_red.c.chrom,
-                                                                genomes_red.c.start)
+        per_sample_stmt = self._stmt_rank_variants(variants_of_sample, sample_set.join(variants_of_sample, true()),
+                                                   *self._genotype_counts(variants_of_sample), meta_attrs.assembly,
+                                                   males, females, population_size, ascending, freq_threshold,
+                                                   limit_result)
+        sequential_stmt = self._stmt_rank_variants(genomes_red,
+                                                   genomes_red.join(sample_set,
+                                                                    genomes_red.c.item_id == sample_set.c.item_id),
+                                                   *self._genotype_counts(genomes_red), meta_attrs.assembly,
+                                                   males, females, population_size, ascending, freq_threshold,
+                                                   limit_result)
+        # choose the strategy by the cost estimated by the planner
+        per_sample_cost = utils.explain(per_sample_stmt, connection, False, self.logger.debug)['Plan']['Total Cost']
+        sequential_cost = utils.explain(sequential_stmt, connection, False, self.logger.debug)['Plan']['Total Cost']
+        if per_sample_cost <= sequential_cost:
+            stmt = per_sample_stmt
         else:
-            func_frequency_new = func.rr.mut_frequency_new_grch38(func_occurrence, males, females, genomes_red.c.chrom,
-                                                                  genomes_red.c.start)
-        func_frequency_new = func_frequency_new.label(Vocabulary.FREQUENCY.name)
+            stmt = sequential_stmt
+        self.logger.debug(f'KGenomes: request /rank_variants_by_frequency for a population of {population_size} '
+                          f'individuals. Estimated cost per-sample {per_sample_cost}, sequential {sequential_cost}')
+        if self.dry_run:
+            return stmt
 
-        # Actually, self.my_region_t already contains only the individuals compatible with meta_attrs, but it can contain
-        # duplicated item_id. Since we want to join, it's better to remove them.
-        # LIMIT is part of a trick used to speed up the job. See later
-        if self.my_region_t is not None:
-            sample_set_with_limit = intersect(select([self.my_meta_t.c.item_id]), select([self.my_region_t.c.item_id])) \
-                .limit(population_size) \
-                .alias('sample_set')
+        # create result table
+        if self.log_sql_commands:
+            self.sql_logger('KGenomes: RANKING VARIANTS IN SAMPLE SET')
+        t_name = utils.random_t_name_w_prefix('ranked_variants')
+        utils.create_table_as(t_name, stmt, default_schema_to_use_name, connection, self.log_sql_commands, self.sql_logger)
+        return Table(t_name, db_meta, autoload=True, autoload_with=connection, schema=default_schema_to_use_name)
+
+    def case_control_counts(self, connection: Connection, case_meta_attrs: MetadataAttrs,
+                            case_region_attrs: Optional[RegionAttrs], control_meta_attrs: MetadataAttrs,
+                            control_region_attrs: Optional[RegionAttrs]) -> Tuple[Selectable, Dict]:
+        self.connection = connection
+        members_of_groups = []
+        composition = {}
+        for group, meta_attrs, region_attrs in [(case_control.CASE, case_meta_attrs, case_region_attrs),
+                                                (case_control.CONTROL, control_meta_attrs, control_region_attrs)]:
+            self._set_meta_attributes(meta_attrs)
+            self.create_table_of_meta(['item_id', 'gender'])
+            self._set_region_attributes(region_attrs)
+            self.create_table_of_regions()
+            members = select([self.my_meta_t.c.item_id, self.my_meta_t.c.gender])
+            if self.my_region_t is not None:
+                members = members.where(self.my_meta_t.c.item_id.in_(select([self.my_region_t.c.item_id])))
+            members = members.alias(f'{group.lower()}_members')
+            members_of_groups.append(members)
+            if self.dry_run:
+                # the statement is only explained: the composition of the groups is not needed
+                composition[group] = (0, 0)
+                continue
+            gender_of_individuals = connection.execute(
+                select([members.c.gender, func.count(members.c.item_id)]).group_by(members.c.gender)).fetchall()
+            if len(gender_of_individuals) == 0:
+                raise EmptyResult('1000Genomes')
+            composition[group] = (next((row[1] for row in gender_of_individuals if row[0] == 'male'), 0),
+                                  next((row[1] for row in gender_of_individuals if row[0] == 'female'), 0))
+
+        # individuals of both groups, flagged with the groups they belong to (they can be in both)
+        case_members, control_members = members_of_groups
+        flagged = union_all(select([case_members.c.item_id, true().label('is_case'), false().label('is_control')]),
+                            select([control_members.c.item_id, false(), true()])) \
+            .alias('flagged')
+        sample_set = select([flagged.c.item_id,
+                             func.bool_or(flagged.c.is_case).label('is_case'),
+                             func.bool_or(flagged.c.is_control).label('is_control')]) \
+            .group_by(flagged.c.item_id) \
+            .alias('sample_set')
+
+        # a single pass over the genotypes of the two groups
+        func_occurrence = func.sum(genomes.c.al1 + func.coalesce(genomes.c.al2, 0))
+        case_occurrence = func.coalesce(func_occurrence.filter(sample_set.c.is_case), 0)
+        control_occurrence = func.coalesce(func_occurrence.filter(sample_set.c.is_control), 0)
+        stmt = select([genomes.c.chrom.label(Vocabulary.CHROM.name),
+                       genomes.c.start.label(Vocabulary.START.name),
+                       genomes.c.ref.label(Vocabulary.REF.name),
+                       genomes.c.alt.label(Vocabulary.ALT.name),
+                       case_occurrence.label(case_control.CASE_OCCURRENCE),
+                       control_occurrence.label(case_control.CONTROL_OCCURRENCE)]) \
+            .select_from(genomes.join(sample_set, genomes.c.item_id == sample_set.c.item_id)) \
+            .group_by(genomes.c.chrom, genomes.c.start, genomes.c.ref, genomes.c.alt)
+        if self.log_sql_commands:
+            utils.show_stmt(connection, stmt, self.sql_logger, 'KGENOMES: STMT CASE CONTROL COUNTS')
+        return stmt, composition
+
+    @staticmethod
+    def _genotype_counts(variants):
+        """
+        :param variants: a selectable with the columns item_id, al1, al2 of the table genomes
+        :return: the aggregate functions computing the occurrence and the number of positive donors of a variant
+        """
+        return (func.sum(variants.c.al1) + func.sum(func.coalesce(variants.c.al2, 0))), func.count(variants.c.item_id)
+
+    def _estimated_population_size(self) -> Optional[int]:
+        """
+        :return: an estimate of the individuals having self.meta_attrs and satisfying self.region_attrs, from the
+        statistics in selectivity, without creating any table. None if the statistics are not enough for an estimate.
+        """
+        if self.population_items is not None:
+            return None
+        population_size = selectivity.population_size(self, self.connection, self.meta_attrs)
+        if population_size is None or not self._constrains_regions(self.region_attrs):
+            return population_size
+        estimates = [estimate for _, _, estimate in self._region_constraints()]
+        if None in estimates:
+            return None
+        return min([population_size] + estimates)
+
+    def _notify_time_estimate(self, population_size: int, from_aggregates: bool):
+        if from_aggregates:
+            estimated_time = "5"
         else:
-            sample_set_with_limit = select([self.my_meta_t.c.item_id])\
-                .limit(population_size) \
-                .alias('sample_set')
+            estimated_time = str(9*population_size) if population_size <= 149 else "2700"  # ~45 min if pop > 149
+        self.notify_message(SourceMessage.Type.TIME_TO_FINISH, estimated_time)
+        self.notify_message(SourceMessage.Type.GENERAL_WARNING, f'Genomes to analyze in 1000Genomes: {population_size}')
+        locale.setlocale(locale.LC_ALL, '')
+        estimated_n_variants = 4144924*population_size
+        self.notify_message(SourceMessage.Type.GENERAL_WARNING, f'Estimated number variants to rank in 1000Genomes: ~{estimated_n_variants:n}')
 
-        stmt = select([genomes_red.c.chrom.label(Vocabulary.CHROM.name),
-                       genomes_red.c.start.label(Vocabulary.START.name),
-                       genomes_red.c.ref.label(Vocabulary.REF.name),
-                       genomes_red.c.alt.label(Vocabulary.ALT.name),
+    @staticmethod
+    def _stmt_rank_variants(variants, from_clause, func_occurrence, func_positive_donors, assembly: str, males: int,
+                            females: int, population_size: int, ascending: bool, freq_threshold: float,
+                            limit_result: int):
+        """
+        :param variants: a selectable with the columns chrom, start, ref, alt
+        :param from_clause: the join of variants with the set of individuals of the population
+        :param func_occurrence: the aggregate function computing the occurrence of a variant in the population
+        :param func_positive_donors: the aggregate function computing the number of individuals owning a variant
+        :return: the statement ranking the variants by frequency
+        """
+        func_occurrence = func_occurrence.label(Vocabulary.OCCURRENCE.name)
+        func_positive_donors = func_positive_donors.label(Vocabulary.POSITIVE_DONORS.name)
+        func_frequency_new = allele_frequency.frequency_expression(func_occurrence, males, females, variants.c.chrom,
+                                                                   variants.c.start, assembly)\
+            .label(Vocabulary.FREQUENCY.name)
+
+        stmt = select([variants.c.chrom.label(Vocabulary.CHROM.name),
+                       variants.c.start.label(Vocabulary.START.name),
+                       variants.c.ref.label(Vocabulary.REF.name),
+                       variants.c.alt.label(Vocabulary.ALT.name),
                        cast(literal(population_size), types.Integer).label(Vocabulary.POPULATION_SIZE.name),
                        func_occurrence,
                        func_positive_donors,
                        func_frequency_new]) \
-            .select_from(genomes_red.join(
-                sample_set_with_limit,
-                genomes_red.c.item_id == sample_set_with_limit.c.item_id)) \
-            .group_by(genomes_red.c.chrom, genomes_red.c.start, genomes_red.c.ref, genomes_red.c.alt)
+            .select_from(from_clause) \
+            .group_by(variants.c.chrom, variants.c.start, variants.c.ref, variants.c.alt)
         if ascending:
             if freq_threshold:
                 stmt = stmt.having(func_frequency_new >= freq_threshold)
@@ -244,107 +527,55 @@ class KGenomes(Source):
             if freq_threshold:
                 stmt = stmt.having(func_frequency_new <= freq_threshold)
             stmt = stmt.order_by(desc(func_frequency_new), desc(func_occurrence))
-        stmt = stmt.limit(limit_result)
-        self.logger.debug(f'KGenomes: request /rank_variants_by_frequency for a population of {population_size} individuals')
+        return stmt.limit(limit_result)
 
-        # this + LIMIT in sample_set_with_limit make the trick to force using the index, but only up to 149 individuals
-        if population_size <= 149:  # 333 is the population size at which the execution time w index matches that w/o index
-            connection.execute('SET SESSION enable_seqscan=false')
+    def values_of_attribute(self, connection, attribute: Vocabulary):
+        return '1000Genomes', value_catalog.of(self, connection).values(attribute)
 
-        # create result table
+    def value_catalog_stmt(self, connection) -> Selectable:
+        self.connection = connection
+        attributes = {attr: metadata.c[col_name] for attr, col_name in self.meta_col_map.items()
+                      if attr != Vocabulary.DONOR_ID}
+        # noinspection SpellCheckingInspection
+        stmt = select([col.label(attr.name) for attr, col in attributes.items()] +
+                      [func.count().label(Vocabulary.COUNT.name)]) \
+            .where(metadata.c.item_id.in_(
+                text("select item_id from public.item where dataset_id in ( "
+                     "select dataset_id from public.dataset "
+                     "where dataset_name ilike '%1000GENOMES%' "
+                     ")"))) \
+            .group_by(*attributes.values())
         if self.log_sql_commands:
-            self.logger.debug('KGenomes: RANKING VARIANTS IN SAMPLE SET')
-        t_name = utils.random_t_name_w_prefix('ranked_variants')
-        utils.create_table_as(t_name, stmt, default_schema_to_use_name, connection, self.log_sql_commands, self.logger.debug)
-        result = Table(t_name, db_meta, autoload=True, autoload_with=connection, schema=default_schema_to_use_name)
-        connection.invalidate()  # instead of setting seqscan=true discard this connection
-        return result
+            utils.show_stmt(connection, stmt, self.sql_logger, 'KGENOMES: CATALOG OF VALUES')
+        return stmt
 
-    def values_of_attribute(self, connection, attribute: Vocabulary):
-        # VIA DATABASE
-        # self.connection = connection
-        # region_attributes = genomes.columns.keys()
-        # meta_attributes = metadata.columns.keys()
-        # self.logger.debug('regions:', region_attributes)
-        # self.logger.debug('meta:', meta_attributes)
-        # if attribute in meta_attributes:
-        #     stmt = select([metadata.c[attribute]]).distinct()
-        # elif attribute in region_attributes:
-        #     stmt = select([genomes.c[attribute]]).distinct()
-        # else:
-        #     raise ValueError(
-        #         'the given attribute {} is not part of the metadata columns nor region columns'.format(attribute))
-        # if self.log_sql_commands:
-        #     utils.show_stmt(self.connection, stmt, 'DISTINCT VALUES OF {}'.format(attribute))
-        # return self.connection.execute(stmt)
-
-        # HARDCODED
-        # since an attribute can also be mut_type which is not indexed, answering takes forever. This is an easy solution
-        # considered that the underlying data is updated rarely, we don't need an index on mut_type.
-        distinct_values = {
-            self.meta_col_map[Vocabulary.ASSEMBLY]: [
-                'hg19',
-                'grch38'
-            ],
-            self.meta_col_map[Vocabulary.DNA_SOURCE]: [
-                'lcl',
-                # '',
-                'blood'
-            ],
-            self.meta_col_map[Vocabulary.GENDER]: [
-                'female',
-                'male'
-            ],
-            self.meta_col_map[Vocabulary.POPULATION]: [
-                'ITU',
-                'ASW',
-                'ACB',
-                'MXL',
-                'CHB',
-                'GWD',
-                'CLM',
-                'YRI',
-                'PUR',
-                'GIH',
-                'TSI',
-                'BEB',
-                'IBS',
-                'MSL',
-                'PEL',
-                'LWK',
-                'ESN',
-                'PJL',
-                'GBR',
-                'JPT',
-                'STU',
-                'CHS',
-                'KHV',
-                'CEU',
-                'FIN',
-                'CDX'
-            ],
-            self.meta_col_map[Vocabulary.SUPER_POPULATION]: [
-                'EAS',
-                'AFR',
-                'EUR',
-                'AMR',
-                'SAS'
-            ],
-            self.meta_col_map[Vocabulary.ETHNICITY]: [
-                'latin american',
-                'black or african american',
-                'white',
-                'asian'
-            ],
-            self.meta_col_map[Vocabulary.HEALTH_STATUS]: [
-                True
-            ],
-            self.meta_col_map[Vocabulary.DISEASE]: [
-                'none'
-            ],
-            'mut_type': ['SNP', 'DEL', 'INS', 'CNV', 'MNP', 'SVA', 'ALU', 'LINE1']
-        }
-        return '1000Genomes', distinct_values.get(self.meta_col_map.get(attribute))
+    def strata_stmt(self, meta_attrs: MetadataAttrs) -> Optional[Selectable]:
+        if not aggregates.available():
+            return None
+        return select([aggregates.strata.c.stratum_id, aggregates.strata.c.donors]) \
+            .where(aggregates.strata_having(meta_attrs))
+
+    def carriers_stmt(self, variants: List[Mutation]) -> Optional[Selectable]:
+        if not aggregates.available():
+            return None
+        counts = aggregates.counts
+        return self._stmt_where_region_is_any_of_mutations(
+            *variants,
+            from_table=counts,
+            select_expression=select([counts.c.chrom, counts.c.start, counts.c.ref, counts.c.alt, counts.c.stratum_id,
+                                      counts.c.positive_donors.label('carriers')]))
+
+    @staticmethod
+    def _constrains_regions(region_attrs: Optional[RegionAttrs]) -> bool:
+        """
+        :return: True if region_attrs restricts the population with a constraint on the table of regions (see
+        create_table_of_regions).
+        """
+        return region_attrs is not None and any([region_attrs.with_variants,
+                                                 region_attrs.with_variants_same_c_copy,
+                                                 region_attrs.with_variants_diff_c_copy,
+                                                 region_attrs.with_variants_in_reg,
+                                                 region_attrs.without_variants])
 
     # SETTERS
     def _set_region_attributes(self, region_attrs: RegionAttrs):
@@ -408,17 +639,34 @@ class KGenomes(Source):
         mutations_having_id = [mut for mut in mutations if mut.id is not None]
         mutations_without_id = [mut for mut in mutations if mut.id is None]
         first_select, second_select = None, None
-        if len(mutations_having_id) > 0:
+        if len(mutations_having_id) > MAX_LITERAL_VARIANTS:
+            # a join with the list of ids instead of a literal IN list that grows with the number of variants
+            requested_ids = utils.values_relation('requested_ids', [('id', from_table.c.id.type)],
+                                                  sorted({(mut.id,) for mut in mutations_having_id}))
+            first_select = select_expression.select_from(
+                from_table.join(requested_ids, from_table.c.id == requested_ids.c.id))
+        elif len(mutations_having_id) > 0:
             first_select = select_expression.where(from_table.c.id.in_([mut.id for mut in mutations_having_id]))
-            if only_item_id_in_table is not None:
-                first_select = first_select.where(from_table.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
-        if len(mutations_without_id) > 0:
+        if first_select is not None and only_item_id_in_table is not None:
+            first_select = first_select.where(from_table.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
+        if len(mutations_without_id) > MAX_LITERAL_VARIANTS:
+            # same as above, with the variants sorted like the index on (chrom, start, ref, alt) of the region table
+            requested_variants = utils.values_relation(
+                'requested_variants',
+                [(c_name, from_table.c[c_name].type) for c_name in ('chrom', 'start', 'ref', 'alt')],
+                sorted({(mut.chrom, mut.start, mut.ref, mut.alt) for mut in mutations_without_id}))
+            second_select = select_expression.select_from(
+                from_table.join(requested_variants, (from_table.c.chrom == requested_variants.c.chrom) &
+                                (from_table.c.start == requested_variants.c.start) &
+                                (from_table.c.ref == requested_variants.c.ref) &
+                                (from_table.c.alt == requested_variants.c.alt)))
+        elif len(mutations_without_id) > 0:
             second_select = select_expression.where(
                 tuple_(from_table.c.start, from_table.c.ref, from_table.c.alt, from_table.c.chrom).in_(
                     [(mut.start, mut.ref, mut.alt, mut.chrom) for mut in mutations_without_id]
                 ))
-            if only_item_id_in_table is not None:
-                second_select = second_select.where(from_table.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
+        if second_select is not None and only_item_id_in_table is not None:
+            second_select = second_select.where(from_table.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
         if first_select is not None and second_select is not None:
             return union_all(first_select, second_select)
         elif first_select is not None:
@@ -426,6 +674,43 @@ class KGenomes(Source):
         else:
             return second_select
 
+    def _create_table_as(self, name_prefix: str, stmt_as, log_title: str):
+        """
+        Creates a table in the temporary schema holding the result of stmt_as and returns it. In dry-run mode, no table
+        is created and stmt_as is returned as a CTE instead.
+        """
+        t_name = utils.random_t_name_w_prefix(name_prefix)
+        if self.dry_run:
+            return stmt_as.cte(t_name)
+        stmt_create_table = utils.stmt_create_table_as(t_name, stmt_as, default_schema_to_use_name)
+        if self.log_sql_commands:
+            utils.show_stmt(self.connection, stmt_create_table, self.sql_logger, log_title)
+        self.connection.execute(stmt_create_table)
+        metrics.TEMP_OBJECTS_CREATED.inc(kind='table')
+        return Table(t_name, db_meta, autoload=True, autoload_with=self.connection,
+                     schema=default_schema_to_use_name)
+
+    def _create_view_as(self, name_prefix: str, stmt_as, log_title: str):
+        """
+        Same as _create_table_as, but creates a view.
+        """
+        view_name = utils.random_t_name_w_prefix(name_prefix)
+        if self.dry_run:
+            return stmt_as.cte(view_name)
+        stmt = utils.stmt_create_view_as(view_name, stmt_as, default_schema_to_use_name)
+        if self.log_sql_commands:
+            utils.show_stmt(self.connection, stmt, self.sql_logger, log_title)
+        self.connection.execute(stmt)
+        metrics.TEMP_OBJECTS_CREATED.inc(kind='view')
+        return Table(view_name, db_meta, autoload=True, autoload_with=self.connection,
+                     schema=default_schema_to_use_name)
+
+    def _drop_table(self, table):
+        if isinstance(table, Table):    # CTEs used in dry-run mode have nothing to drop
+            if self.log_sql_commands:
+                self.sql_logger('DROP TABLE ' + table.name)
+            table.drop(self.connection)
+
     # GENERATE DB ENTITIES
     def create_table_of_meta(self, select_columns: Optional[list]):
         """Assigns my_meta_t as the table containing only the individuals with the required metadata characteristics"""
@@ -462,244 +747,166 @@ class KGenomes(Source):
             query = query.where(metadata.c.super_population.in_(self.meta_attrs.super_population))
         elif self.meta_attrs.ethnicity:
             query = query.where(metadata.c.ethnicity.in_(self.meta_attrs.ethnicity))
+        if self.population_items is not None:
+            query = query.where(metadata.c.item_id.in_(self.population_items))
         new_meta_table_name = utils.random_t_name_w_prefix('meta')
-        utils.create_table_as(new_meta_table_name, query, default_schema_to_use_name, self.connection, self.log_sql_commands, self.logger.debug)
+        if self.dry_run:
+            self.my_meta_t = query.cte(new_meta_table_name)
+            return
+        utils.create_table_as(new_meta_table_name, query, default_schema_to_use_name, self.connection, self.log_sql_commands, self.sql_logger)
         # t_stmt = utils.stmt_create_table_as(new_meta_table_name, query,  default_schema_to_use_name)
         # if self.log_sql_commands:
         #     utils.show_stmt(t_stmt, 'TABLE OF SAMPLES HAVING META')
         # self.connection.execute(t_stmt)
         self.my_meta_t = Table(new_meta_table_name, db_meta, autoload=True, autoload_with=self.connection, schema=default_schema_to_use_name)
 
-    def create_table_of_regions(self, select_columns: Optional[list]):
-        if self.region_attrs:
-            # compute each filter on regions separately
-            to_combine_t = list()
-            if self.region_attrs.with_variants:
-                t = self.table_with_all_of_mutations(select_columns)
-                to_combine_t.append(t)
-            if self.region_attrs.with_variants_same_c_copy:
-                t = self.table_with_variants_same_c_copy(select_columns)
-                to_combine_t.append(t)
-            if self.region_attrs.with_variants_diff_c_copy:
-                t = self.table_with_variants_on_diff_c_copies(select_columns)
-                to_combine_t.append(t)
-            if self.region_attrs.with_variants_in_reg:
-                t = self.view_of_variants_in_interval_or_type(select_columns)
-                to_combine_t.append(t)
-            if self.region_attrs.without_variants:
-                t = self._table_without_any_of_mutations()
-                to_combine_t.append(t)
-            if len(to_combine_t) == 0:
-                self.my_region_t = None
-            if len(to_combine_t) == 1:  # when only one filter kind
-                self.my_region_t = to_combine_t[0]
-            elif len(to_combine_t) > 1:
-                self.my_region_t = self.take_regions_of_common_individuals(to_combine_t)
-
-    def table_with_all_of_mutations(self, select_columns: Optional[list]):
+    def create_table_of_regions(self):
         """
-         Returns a table of variants of the same type of the ones contained in RegionAttrs.with_variants and only form the
-         individuals that own all of them.
-         :param select_columns: the list of column names to select from the result. If None, all the columns are taken.
+        Sets self.my_region_t to a table of the item_id of the individuals in self.my_meta_t satisfying all the region
+        constraints in self.region_attrs (None if there are no region constraints). The constraints are evaluated one
+        after the other, from the most selective one according to the statistics in selectivity (or, if missing, to the
+        estimates of the query planner), and each of them only considers the individuals selected by the previous ones.
+        If the source counts the carriers from the table of regions (see Source.carriers_from_regions), it raises
+        EmptyResult without executing any constraint when a required variant has no carriers in the population.
         """
-        if not self.region_attrs.with_variants:
-            raise ValueError('instance parameter self.with_variants not initialized')
-        elif len(self.region_attrs.with_variants) == 1:
-            return self._table_with_any_of_mutations(select_columns, self.my_meta_t, *self.region_attrs.with_variants)
-        else:
-            union_select_column_names = None  # means all columns
-            if select_columns is not None:  # otherwise use select_columns + minimum necessary
-                union_select_column_names = set(select_columns)
-                union_select_column_names.add('item_id')
-            union_table = self._table_with_any_of_mutations(union_select_column_names, self.my_meta_t,
-                                                            *self.region_attrs.with_variants)
-            # extracts only the samples having all the mutations
-            result_select_columns = [union_table]  # means all columns
-            if select_columns is not None:  # otherwise use selected_columns
-                result_select_columns = [union_table.c[col_name] for col_name in select_columns]
-            stmt_as = \
-                select(result_select_columns) \
-                .where(union_table.c.item_id.in_(
-                    select([union_table.c.item_id])
-                    .group_by(union_table.c.item_id)
-                    .having(func.count(union_table.c.item_id) == len(self.region_attrs.with_variants))
-                ))
-            target_t_name = utils.random_t_name_w_prefix('with')
-            stmt_create_table = utils.stmt_create_table_as(target_t_name, stmt_as, default_schema_to_use_name)
-            if self.log_sql_commands:
-                utils.show_stmt(self.connection, stmt_create_table, self.logger.debug,
-                                'INDIVIDUALS HAVING "ALL" THE {} MUTATIONS (WITH DUPLICATE ITEM_ID)'.format(
-                                    len(self.region_attrs.with_variants)))
-            self.connection.execute(stmt_create_table)
-            if self.log_sql_commands:
-                self.logger.debug('DROP TABLE ' + union_table.name)
-            union_table.drop(self.connection)
-            return Table(target_t_name, db_meta, autoload=True, autoload_with=self.connection, schema=default_schema_to_use_name)
-
-    def _table_with_any_of_mutations(self, select_columns, only_item_id_in_table: Optional[Table], *mutations: Mutation):
+        self.my_region_t = None
+        if not self._constrains_regions(self.region_attrs):
+            return
+        constraints = self._region_constraints()
+        if self.carriers_from_regions and any(estimate == 0 for _, _, estimate in constraints):
+            raise EmptyResult('1000Genomes')
+        if len(constraints) > 1:
+            constraints.sort(key=lambda constraint: constraint[2] if constraint[2] is not None
+                             else utils.estimated_rows(constraint[1](self.my_meta_t), self.connection))
+        item_ids = self.my_meta_t
+        for log_title, stmt_of_item_ids, _ in constraints:
+            result = self._create_table_as('item_ids', stmt_of_item_ids(item_ids), log_title)
+            if item_ids is not self.my_meta_t:
+                self._drop_table(item_ids)
+            item_ids = result
+        self.my_region_t = item_ids
+
+    def _region_constraints(self) -> List[Tuple[str, Callable[[FromClause], Selectable], Optional[int]]]:
         """
-        Returns a Table containing all the rows from the table genomes containing one of the variants in
-        the argument mutations.
-        :param select_columns selects only the column names in this collection. If None, selects all the columns from genomes.
-        :param only_item_id_in_table If None, the variants that are not owned by any of the individuals in this table
-        are discarded from the result.
+        :return: for each region constraint in self.region_attrs, a title for the logs, a function building the
+        statement that selects the distinct item_id satisfying the constraint among the ones in a given table and an
+        estimate of the individuals of the population satisfying it (None if unknown).
         """
-        if len(mutations) == 0:
-            raise ValueError('function argument *mutations cannot be empty')
-        else:
-            # create table for the result
-            t_name = utils.random_t_name_w_prefix('with_any_of_mut')
-            columns = [genomes.c[c_name] for c_name in select_columns] if select_columns is not None else [
-                genomes]
-            stmt_as = self._stmt_where_region_is_any_of_mutations(*mutations,
-                                                                  from_table=genomes,
-                                                                  select_expression=select(columns),
-                                                                  only_item_id_in_table=only_item_id_in_table)
-        stmt_create_table = utils.stmt_create_table_as(t_name, stmt_as, default_schema_to_use_name)
-        if self.log_sql_commands:
-            utils.show_stmt(self.connection, stmt_create_table, self.logger.debug,
-                            'CREATE TABLE HAVING ANY OF THE {} MUTATIONS'.format(len(mutations)))
-        self.connection.execute(stmt_create_table)
-        return Table(t_name, db_meta, autoload=True, autoload_with=self.connection,
-                     schema=default_schema_to_use_name)
-
-    def _table_without_any_of_mutations(self):
+        constraints = []
+        if self.region_attrs.with_variants:
+            constraints.append((
+                'INDIVIDUALS HAVING ALL THE {} VARIANTS'.format(len(self.region_attrs.with_variants)),
+                lambda item_ids: self._stmt_item_ids_owning_mutations(
+                    self.region_attrs.with_variants, item_ids,
+                    lambda owned: func.count() == len(self.region_attrs.with_variants)
+                    if len(self.region_attrs.with_variants) > 1 else None),
+                selectivity.carriers_of_all(self, self.connection, self.meta_attrs, self.region_attrs.with_variants)))
+        if self.region_attrs.with_variants_same_c_copy:
+            if len(self.region_attrs.with_variants_same_c_copy) < 2:
+                raise ValueError('You must provide at least two Mutation instances in order to use this method.')
+            number_same_c_copy = len(self.region_attrs.with_variants_same_c_copy)
+            # the sum of al1 or al2 equals the number of the given variants only if the individual owns all of them on
+            # the same chromosome copy
+            constraints.append((
+                'INDIVIDUALS HAVING ALL THE SPECIFIED VARIANTS ON THE SAME CHROMOSOME COPY',
+                lambda item_ids: self._stmt_item_ids_owning_mutations(
+                    self.region_attrs.with_variants_same_c_copy, item_ids,
+                    lambda owned: (func.sum(owned.c.al1) == number_same_c_copy) |  # the ( ) around each condition are mandatory
+                                  (func.sum(func.coalesce(owned.c.al2, 0)) == number_same_c_copy)),
+                selectivity.carriers_of_all(self, self.connection, self.meta_attrs,
+                                            self.region_attrs.with_variants_same_c_copy)))
+        if self.region_attrs.with_variants_diff_c_copy:
+            if len(self.region_attrs.with_variants_diff_c_copy) != 2:
+                raise ValueError('You must provide exactly two Mutation instances in order to use this method.')
+            constraints.append((
+                'INDIVIDUALS HAVING BOTH VARIANTS ON OPPOSITE CHROMOSOME COPIES',
+                lambda item_ids: self._stmt_item_ids_owning_mutations(
+                    self.region_attrs.with_variants_diff_c_copy, item_ids,
+                    lambda owned: (func.count() == 2) &  # the ( ) around each condition are mandatory
+                                  (func.sum(owned.c.al1) == 1) &
+                                  (func.sum(func.coalesce(owned.c.al2, 0)) == 1)),
+                selectivity.carriers_of_all(self, self.connection, self.meta_attrs,
+                                            self.region_attrs.with_variants_diff_c_copy)))
+        if self.region_attrs.with_variants_in_reg:
+            constraints.append((
+                'INDIVIDUALS HAVING VARIANTS IN INTERVAL {} of types {}'.format(
+                    self.region_attrs.with_variants_in_reg, self.region_attrs.with_variants_of_type),
+                self._stmt_item_ids_with_variants_in_interval_or_type,
+                None))
+        if self.region_attrs.without_variants:
+            constraints.append((
+                'INDIVIDUALS WITHOUT ANY OF THE {} VARIANTS'.format(len(self.region_attrs.without_variants)),
+                lambda item_ids: except_(
+                    select([item_ids.c.item_id]),
+                    self._stmt_where_region_is_any_of_mutations(*self.region_attrs.without_variants,
+                                                                from_table=genomes,
+                                                                select_expression=select([genomes.c.item_id]),
+                                                                only_item_id_in_table=item_ids)),
+                selectivity.population_size(self, self.connection, self.meta_attrs)))
+        return constraints
+
+    def _stmt_item_ids_owning_mutations(self, mutations: List[Mutation], only_item_id_in_table: FromClause,
+                                        having: Callable[[FromClause], Optional[ClauseElement]]) -> Selectable:
         """
-        Returns a Table containing the item_id from the table genomes that do not match the given mutations.
-        :param select_columns selects only the column names in this collection. If None, selects all the columns from genomes.
+        :param having: given the relation of the variants owned by the individuals (columns item_id, al1, al2), returns
+        the condition that the variants of an individual must satisfy (None if owning any of them is enough).
+        :return: the statement selecting the distinct item_id of the individuals in only_item_id_in_table owning any of
+        the given mutations and satisfying the having condition.
         """
-        mutations = self.region_attrs.without_variants
-        if len(mutations) == 0:
-            raise ValueError('function argument *mutations cannot be empty')
-        else:
-            # create table for the result
-            t_name = utils.random_t_name_w_prefix('without_any_of_mut')
-            query_mutations = self._stmt_where_region_is_any_of_mutations(*mutations,
-                                                                          from_table=genomes,
-                                                                          select_expression=select([genomes.c.item_id]),
-                                                                          only_item_id_in_table=self.my_meta_t)
-            stmt_as = except_(
-                select([self.my_meta_t.c.item_id]),
-                query_mutations
-            )
-            stmt_create_table = utils.stmt_create_table_as(t_name, stmt_as, default_schema_to_use_name)
-            if self.log_sql_commands:
-                utils.show_stmt(self.connection, stmt_create_table, self.logger.debug,
-                                'CREATE TABLE WITHOUT ANY OF THE {} MUTATIONS'.format(len(mutations)))
-            self.connection.execute(stmt_create_table)
-            return Table(t_name, db_meta, autoload=True, autoload_with=self.connection,
-                         schema=default_schema_to_use_name)
+        owned = self._stmt_where_region_is_any_of_mutations(
+            *mutations,
+            from_table=genomes,
+            select_expression=select([genomes.c.item_id, genomes.c.al1, genomes.c.al2]),
+            only_item_id_in_table=only_item_id_in_table).alias('owned_variants')
+        stmt = select([owned.c.item_id]).group_by(owned.c.item_id)
+        condition = having(owned)
+        if condition is not None:
+            stmt = stmt.having(condition)
+        return stmt
 
-    def table_with_variants_same_c_copy(self, select_columns: Optional[list]):
-        """
-         Returns a table of variants of the same type of the ones contained in RegionAttrs.with_variants_same_c_copy and only
-         form the individuals that own all of them on the same chromosome copy.
-         :param select_columns: the list of column names to select from the result. If None, all the columns are taken.
-        """
-        if len(self.region_attrs.with_variants_same_c_copy) < 2:
-            raise ValueError('You must provide at least two Mutation instances in order to use this method.')
-        # selects only the mutations to be on the same chromosome copies (this set will be used two times) from all individuals
-        # we will enforce the presence of all the given mutations in all the individuals later...
-        interm_select_column_names = None  # means all columns
-        if select_columns is not None:  # otherwise pick select_columns + minimum required
-            interm_select_column_names = set(select_columns)
-            interm_select_column_names.update(['item_id', 'al1', 'al2'])
-        intermediate_table = self._table_with_any_of_mutations(interm_select_column_names, self.my_meta_t,
-                                                               *self.region_attrs.with_variants_same_c_copy)
-        # groups mutations by owner in the intermediate table, and take only the owners for which sum(al1) or sum(al2)
-        # equals to the number of the given mutations. That condition automatically implies the presence of all the
-        # given mutations in the same individual.
-        # for those owner, take all the given mutations
-        result_columns = [intermediate_table]  # means all columns
-        if select_columns is not None:  # otherwise pick the columns from select_columns
-            result_columns = [intermediate_table.c[col_name] for col_name in select_columns]
-        stmt_as = \
-            select(result_columns) \
-            .where(intermediate_table.c.item_id.in_(
-                select([intermediate_table.c.item_id])
-                .group_by(intermediate_table.c.item_id)
-                .having(
-                    (func.sum(intermediate_table.c.al1) == len(
-                        self.region_attrs.with_variants_same_c_copy)) |  # the ( ) around each condition are mandatory
-                    (func.sum(func.coalesce(intermediate_table.c.al2, 0)) == len(
-                        self.region_attrs.with_variants_same_c_copy)))
-            ))
-        target_t_name = utils.random_t_name_w_prefix('with_var_same_c_copy')
-        stmt = utils.stmt_create_table_as(target_t_name, stmt_as, default_schema_to_use_name)
-        if self.log_sql_commands:
-            utils.show_stmt(self.connection, stmt, self.logger.debug,
-                            'INDIVIDUALS (+ THE GIVEN MUTATIONS) HAVING ALL THE SPECIFIED MUTATIONS ON THE SAME CHROMOSOME COPY')
-        self.connection.execute(stmt)
-        if self.log_sql_commands:
-            self.logger.debug('DROP TABLE ' + intermediate_table.name)
-        intermediate_table.drop(self.connection)
-        return Table(target_t_name, db_meta, autoload=True, autoload_with=self.connection,
-                     schema=default_schema_to_use_name)
+    def _stmt_item_ids_with_variants_in_interval_or_type(self, only_item_id_in_table: FromClause) -> Selectable:
+        stmt = select([genomes.c.item_id]).distinct() \
+            .where((genomes.c.chrom == self.region_attrs.with_variants_in_reg.chrom) &
+                   (genomes.c.start >= self.region_attrs.with_variants_in_reg.start) &
+                   (genomes.c.start <= self.region_attrs.with_variants_in_reg.stop)) \
+            .where(genomes.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
+        if self.region_attrs.with_variants_of_type is not None:
+            stmt = stmt.where(genomes.c.mut_type.in_(self.region_attrs.with_variants_of_type))
+        return stmt
 
-    def table_with_variants_on_diff_c_copies(self, select_columns: Optional[list]):
-        """
-         Returns a table of variants of the same type of the ones contained in RegionAttrs.with_variants_diff_c_copy and only
-         form the individuals that own both of them on opposite chromosome copies.
-         :param select_columns: the list of column names to select from the result. If None, all the columns are taken.
-        """
-        if len(self.region_attrs.with_variants_diff_c_copy) != 2:
-            raise ValueError('You must provide exactly two Mutation instances in order to use this method.')
-        # selects only the mutations to be on the different chromosome copies (this set will be used two times) from all individuals
-        # we will enforce the presence of the mutations in all the individuals later...
-        interm_select_column_names = None  # means all columns
-        if select_columns is not None:  # otherwise pick select_columns + minimum required
-            interm_select_column_names = set(select_columns)
-            interm_select_column_names.update(['item_id', 'al1', 'al2'])
-        intermediate_table = self._table_with_any_of_mutations(interm_select_column_names, self.my_meta_t,
-                                                               *self.region_attrs.with_variants_diff_c_copy)
-        # groups mutations by owner in the intermediate table, and take only the owners for which sum(al1) = 1 and sum(al2) = 1
-        # that condition automatically implies the presence of both mutations for the same owner
-        # for those owner, take both mutations
-        result_columns = [intermediate_table]  # means all columns
-        if select_columns is not None:  # otherwise pick the columns from select_columns
-            result_columns = [intermediate_table.c[col_name] for col_name in select_columns]
-        stmt_as = \
-            select(result_columns) \
-            .where(intermediate_table.c.item_id.in_(
-                select([intermediate_table.c.item_id])
-                .group_by(intermediate_table.c.item_id)
-                .having(
-                    (func.count(intermediate_table.c.item_id) == 2) &
-                    (func.sum(intermediate_table.c.al1) == 1) &  # the ( ) around each condition are mandatory
-                    (func.sum(func.coalesce(intermediate_table.c.al2, 0)) == 1)
-                )))
-        target_t_name = utils.random_t_name_w_prefix('with_var_diff_c_copies')
-        stmt = utils.stmt_create_table_as(target_t_name, stmt_as, default_schema_to_use_name)
-        if self.log_sql_commands:
-            utils.show_stmt(self.connection, stmt, self.logger.debug,
-                            'INDIVIDUALS (+ THE GIVEN MUTATIONS) HAVING BOTH MUTATIONS ON OPPOSITE CHROMOSOME COPIES')
-        self.connection.execute(stmt)
-        if self.log_sql_commands:
-            self.logger.debug('DROP TABLE ' + intermediate_table.name)
-        intermediate_table.drop(self.connection)
-        return Table(target_t_name, db_meta, autoload=True, autoload_with=self.connection,
-                     schema=default_schema_to_use_name)
+    def phased_genotypes_in_interval(self, connection: Connection, genomic_interval: GenomicInterval,
+                                     meta_attrs: MetadataAttrs,
+                                     region_attrs: Optional[RegionAttrs]) -> Tuple[Selectable, Selectable]:
+        # init state
+        self.connection = connection
+        self._set_meta_attributes(meta_attrs)
+        self.create_table_of_meta(['item_id', 'gender'])
+        self._set_region_attributes(region_attrs)
+        self.create_table_of_regions()
 
-    def view_of_variants_in_interval_or_type(self, select_columns: Optional[list]):
-        if self.region_attrs.with_variants_in_reg is None and self.region_attrs.with_variants_of_type is None:
-            raise ValueError('you called this method without giving any selection criteria')
-        columns = [genomes.c[c_name] for c_name in select_columns] if select_columns is not None else [genomes]
-        stmt_as = select(columns)
-        if self.region_attrs.with_variants_in_reg is not None:
-            stmt_as = stmt_as.where((genomes.c.chrom == self.region_attrs.with_variants_in_reg.chrom) &
-                                    (genomes.c.start >= self.region_attrs.with_variants_in_reg.start) &
-                                    (genomes.c.start <= self.region_attrs.with_variants_in_reg.stop))
-        if self.region_attrs.with_variants_of_type is not None:
-            stmt_as = stmt_as.where(genomes.c.mut_type.in_(self.region_attrs.with_variants_of_type))
-        generated_view_name = utils.random_t_name_w_prefix('mut_of_type_interval')
-        stmt = utils.stmt_create_view_as(generated_view_name, stmt_as, default_schema_to_use_name)
+        individuals = select([self.my_meta_t.c.item_id.label(linkage.ITEM_ID),
+                              self.my_meta_t.c.gender.label(Vocabulary.GENDER.name)])
+        if self.my_region_t is not None:
+            individuals = individuals.where(self.my_meta_t.c.item_id.in_(
+                select([self.my_region_t.c.item_id]).distinct()
+            ))
+        sample_set = individuals.alias('sample_set')
+        genotypes = select([genomes.c.start.label(Vocabulary.START.name),
+                            genomes.c.ref.label(Vocabulary.REF.name),
+                            genomes.c.alt.label(Vocabulary.ALT.name),
+                            genomes.c.item_id.label(linkage.ITEM_ID),
+                            genomes.c.al1.label('AL1'),
+                            genomes.c.al2.label('AL2')]) \
+            .select_from(genomes.join(sample_set, genomes.c.item_id == sample_set.c[linkage.ITEM_ID])) \
+            .where((genomes.c.start >= genomic_interval.start) &
+                   (genomes.c.start <= genomic_interval.stop) &
+                   (genomes.c.chrom == genomic_interval.chrom)) \
+            .order_by(genomes.c.start, genomes.c.ref, genomes.c.alt)
         if self.log_sql_commands:
-            utils.show_stmt(self.connection, stmt, self.logger.debug,
-                            'VIEW OF REGIONS IN INTERVAL {} of types {}'.format(self.region_attrs.with_variants_in_reg,
-                                                                                self.region_attrs.with_variants_of_type))
-        self.connection.execute(stmt)
-        return Table(generated_view_name, db_meta, autoload=True, autoload_with=self.connection,
-                     schema=default_schema_to_use_name)
+            utils.show_stmt(connection, genotypes, self.sql_logger, f'KGENOMES: PHASED GENOTYPES IN REGION '
+                                                                      f'{genomic_interval.chrom}'
+                                                                      f'-{genomic_interval.start}-{genomic_interval.stop}')
+        return individuals, genotypes
 
     def variants_in_region(self, connection: Connection, genomic_interval: GenomicInterval,
                            output_region_attrs: List[Vocabulary], meta_attrs: MetadataAttrs,
@@ -709,7 +916,7 @@ class KGenomes(Source):
         self._set_meta_attributes(meta_attrs)
         self.create_table_of_meta(['item_id'])
         self._set_region_attributes(region_attrs)
-        self.create_table_of_regions(['item_id'])
+        self.create_table_of_regions()
 
         if self.my_region_t is not None:
             only_from_samples = intersect(select([self.my_meta_t.c.item_id]), select([self.my_region_t.c.item_id]))
@@ -726,49 +933,11 @@ class KGenomes(Source):
                    (genomes.c.chrom == genomic_interval.chrom))
 
         if self.log_sql_commands:
-            utils.show_stmt(connection, stmt, self.logger.debug, f'KGenomes: VARIANTS IN REGION '
+            utils.show_stmt(connection, stmt, self.sql_logger, f'KGenomes: VARIANTS IN REGION '
                                                                  f'{genomic_interval.chrom}'
                                                                  f'-{genomic_interval.start}-{genomic_interval.stop}')
         return stmt
 
-    def take_regions_of_common_individuals(self, tables: list):
-        """
-        Generates a table containing all the mutations from all the origin tables but only for those individuals that
-        appear in all the origin tables.
-        Supposing that each origin table reflects a characteristic that the final sample set must have, this method
-        basically puts those characteristics in AND relationship by taking only the regions from the individuals that
-        have all the characteristics.
-        :param tables: The source tables which must have the same columns in the same order.
-        """
-        if len(tables) == 1:
-            return tables[0]
-        else:
-            # join 1st with 2nd with 3rd ... with nth on item_id
-            # TODO consider creating temporary tables selecting only the item_id before joining
-            stmt_join = reduce(
-                lambda table_1, table_2: table_1.join(table_2, tables[0].c.item_id == table_2.c.item_id),
-                tables)
-            # union of tables
-            select_all_from_each_table = map(lambda table_: select([table_]), tables)
-            # TODO consider selecting from union table only what is needed by the users of this method (parametric choice)
-            stmt_union = union(*select_all_from_each_table).alias()
-            # select from the union table only the item_id that exists in the join
-            stmt_as = \
-                select([stmt_union]) \
-                .where(exists(select()
-                              .select_from(stmt_join)
-                              .where(stmt_union.c.item_id == tables[0].c.item_id)
-                              ))
-            target_t_name = utils.random_t_name_w_prefix('intersect')
-            stmt_create_table = utils.stmt_create_table_as(target_t_name, stmt_as, default_schema_to_use_name)
-            if self.log_sql_commands:
-                utils.show_stmt(self.connection, stmt_create_table, self.logger.debug,
-                                'SELECT ALL FROM SOURCE TABLES WHERE item_id IS IN ALL SOURCE TABLES')
-            self.connection.execute(stmt_create_table)
-            # TODO drop partial tables ?
-            return Table(target_t_name, db_meta, autoload=True, autoload_with=self.connection,
-                         schema=default_schema_to_use_name)
-
     def get_chrom_of_variant(self, connection: Connection, variant: Mutation):
         if variant.chrom is not None:
             return variant.chrom
@@ -780,10 +949,25 @@ class KGenomes(Source):
     def get_variant_details(self, connection: Connection, variant: Mutation, which_details: List[Vocabulary],
                             assembly) -> list:
         self.connection = connection
+        stmt = self._stmt_variant_details(variant, which_details, assembly)
+        result = utils.execute_prepared(connection, 'variant_details', stmt, self.log_sql_commands, self.sql_logger)
+        if result.rowcount == 0:
+            return list()
+        else:
+            if result.rowcount > 1:
+                self.logger.error(f'user searched for variant: chrom {str(variant.chrom)}, start {str(variant)}, '
+                                  f'ref {str(variant.ref)}, alt {str(variant.alt)}, id {str(variant.id)}'
+                                  f'but two results were found')
+            final_result = result.fetchone().values()
+            result.close()
+            return final_result
+
+    @classmethod
+    def _stmt_variant_details(cls, variant: Mutation, which_details: List[Vocabulary], assembly) -> Selectable:
         global genomes
         select_columns = []
         for att in which_details:
-            mapping = self.region_col_map.get(att)
+            mapping = cls.region_col_map.get(att)
             if mapping is not None:
                 select_columns.append(genomes.c[mapping].label(att.name))
             else:
@@ -801,16 +985,4 @@ class KGenomes(Source):
                 select([metadata.c.item_id])
                 .where(metadata.c.assembly == assembly)
         ))
-        if self.log_sql_commands:
-            utils.show_stmt(connection, stmt, self.logger.debug, 'GET VARIANT DETAILS')
-        result = connection.execute(stmt)
-        if result.rowcount == 0:
-            return list()
-        else:
-            if result.rowcount > 1:
-                self.logger.error(f'user searched for variant: chrom {str(variant.chrom)}, start {str(variant)}, '
-                                  f'ref {str(variant.ref)}, alt {str(variant.alt)}, id {str(variant.id)}'
-                                  f'but two results were found')
-            final_result = result.fetchone().values()
-            result.close()
-            return final_result
+        return stmt
@@ -0,0 +1,112 @@
+"""
+Pairwise co-occurrence and linkage disequilibrium of the variants in a genomic interval, from phased genotypes. Each
+variant is represented by two bitsets, one per chromosome copy, with a bit for each individual of the population
+set if the individual owns the variant on that copy (al1 for the first copy, al2 for the second one). The bitsets are
+packed in bytes, so the co-occurrence of two variants is the popcount of the AND of their bitsets:
+- SAME_COPY: number of chromosome copies (haplotypes) carrying both variants;
+- DIFF_COPY: number of individuals carrying the two variants on different copies.
+On the diagonal, SAME_COPY is the number of alleles equal to the variant and DIFF_COPY the number of homozygous
+individuals. The haplotype frequencies give the linkage measures R2 and D_PRIME (0 when undefined, e.g. for
+monomorphic variants).
+"""
+from data_sources.io_parameters import Vocabulary
+from data_sources import allele_frequency
+from typing import Dict, Iterable, List, Tuple
+import numpy
+
+# name of the column identifying the individual in the statements of Source.phased_genotypes_in_interval
+ITEM_ID = 'ITEM_ID'
+VARIANT_COLUMNS = [Vocabulary.CHROM.name, Vocabulary.START.name, Vocabulary.REF.name, Vocabulary.ALT.name]
+MAX_VARIANTS = 2000
+# bytes of the intermediate arrays of the pairwise popcount
+CHUNK_BYTES = 1 << 25
+
+if hasattr(numpy, 'bitwise_count'):
+    _popcount = numpy.bitwise_count
+else:
+    _POPCOUNT_TABLE = numpy.array([bin(byte).count('1') for byte in range(256)], dtype=numpy.uint8)
+
+    def _popcount(packed: numpy.ndarray) -> numpy.ndarray:
+        return _POPCOUNT_TABLE[packed]
+
+
+class TooManyVariants(Exception):
+    def __init__(self, number_of_variants: int):
+        super().__init__(f'The genomic interval contains {number_of_variants} variants in the selected population, '
+                         f'but at most {MAX_VARIANTS} can be compared. Please restrict the interval.')
+
+
+def pairwise_popcount(a: numpy.ndarray, b: numpy.ndarray) -> numpy.ndarray:
+    """
+    :param a, b: packed bitsets as arrays of shape (number of variants, number of bytes)
+    :return: the matrix of the popcount of the AND of each bitset in a with each bitset in b
+    """
+    result = numpy.empty((a.shape[0], b.shape[0]), dtype=numpy.int64)
+    rows_per_chunk = max(1, CHUNK_BYTES // max(1, b.shape[0] * b.shape[1]))
+    for first in range(0, a.shape[0], rows_per_chunk):
+        last = first + rows_per_chunk
+        result[first:last] = _popcount(a[first:last, None, :] & b[None, :, :]).sum(axis=2, dtype=numpy.int64)
+    return result
+
+
+def bitsets(individuals: List, genotypes: Iterable) -> Tuple[List[tuple], numpy.ndarray, numpy.ndarray]:
+    """
+    :param individuals: the item_id of the individuals of the population
+    :param genotypes: rows with the columns START, REF, ALT, ITEM_ID, AL1, AL2 sorted by START, REF, ALT
+    :return: the variants as (start, ref, alt) and the packed bitsets of the first and of the second chromosome copy
+    """
+    position_of_individual = {item_id: idx for idx, item_id in enumerate(individuals)}
+    variants: Dict[tuple, int] = {}
+    variant_idx, individual_idx, al1, al2 = [], [], [], []
+    for start, ref, alt, item_id, allele_1, allele_2 in genotypes:
+        variant_idx.append(variants.setdefault((start, ref, alt), len(variants)))
+        individual_idx.append(position_of_individual[item_id])
+        al1.append(allele_1 or 0)
+        al2.append(allele_2 or 0)
+        if len(variants) > MAX_VARIANTS:
+            raise TooManyVariants(len(variants))
+    variant_idx, individual_idx = numpy.array(variant_idx, dtype=numpy.int64), numpy.array(individual_idx, dtype=numpy.int64)
+    al1, al2 = numpy.array(al1, dtype=bool), numpy.array(al2, dtype=bool)
+    copies = []
+    for on_copy in (al1, al2):
+        copy = numpy.zeros((len(variants), len(individuals)), dtype=bool)
+        copy[variant_idx[on_copy], individual_idx[on_copy]] = True
+        copies.append(numpy.packbits(copy, axis=1))
+    return list(variants.keys()), copies[0], copies[1]
+
+
+def linkage(chrom: int, variants: List[tuple], first_copy: numpy.ndarray, second_copy: numpy.ndarray, males: int,
+            females: int, assembly: str) -> dict:
+    """
+    :param variants: the variants as (start, ref, alt), in the order of the rows of the bitsets
+    :return: the table of the variants and the matrices SAME_COPY, DIFF_COPY, R2, D_PRIME
+    """
+    same_copy = pairwise_popcount(first_copy, first_copy) + pairwise_popcount(second_copy, second_copy)
+    diff_copy = pairwise_popcount(first_copy, second_copy) + pairwise_popcount(second_copy, first_copy)
+
+    start = numpy.array([variant[0] for variant in variants], dtype=numpy.int64)
+    haplotypes = allele_frequency.total_alleles(males, females, chrom, start, assembly).astype(float)
+    allele_count = numpy.diagonal(same_copy).astype(float)
+    p = numpy.divide(allele_count, haplotypes, out=numpy.zeros(len(variants), dtype=float), where=haplotypes > 0)
+    pair_haplotypes = numpy.minimum.outer(haplotypes, haplotypes)
+    p_ij = numpy.divide(same_copy, pair_haplotypes, out=numpy.zeros(same_copy.shape, dtype=float),
+                        where=pair_haplotypes > 0)
+    p_i, p_j = p[:, None], p[None, :]
+    d = p_ij - p_i * p_j
+    variances = p_i * (1 - p_i) * p_j * (1 - p_j)
+    r2 = numpy.divide(d ** 2, variances, out=numpy.zeros(d.shape, dtype=float), where=variances > 0)
+    d_max = numpy.where(d > 0, numpy.minimum(p_i * (1 - p_j), (1 - p_i) * p_j),
+                        numpy.minimum(p_i * p_j, (1 - p_i) * (1 - p_j)))
+    d_prime = numpy.divide(d, d_max, out=numpy.zeros(d.shape, dtype=float), where=d_max > 0)
+
+    return {
+        'variants': {
+            'columns': VARIANT_COLUMNS + [Vocabulary.OCCURRENCE.name, Vocabulary.FREQUENCY.name],
+            'rows': [[chrom, *variant, int(count), float(frequency)]
+                     for variant, count, frequency in zip(variants, allele_count, p)]
+        },
+        'SAME_COPY': same_copy.tolist(),
+        'DIFF_COPY': diff_copy.tolist(),
+        'R2': r2.tolist(),
+        'D_PRIME': d_prime.tolist()
+    }
@@ -0,0 +1,136 @@
+"""
+Statistics on the selectivity of the constraints of the requests: the number of donors of the strata of individuals
+(groups of individuals sharing the same metadata values) and the number of carriers of each variant in each stratum.
+Sources use them before creating any table, to estimate the size of a population, to evaluate the region constraints
+from the most selective one and to answer immediately when a required variant has no carrier in the selected strata.
+The statistics come from the statements Source.strata_stmt and Source.carriers_stmt: they are fetched only when first
+needed and kept in memory until the data version (database.data_version) changes or for at most MAX_AGE seconds, as the
+loads of some sources don't change the data version. Carriers are kept for at most MAX_CACHED_VARIANTS variants of each
+source, discarding the least recently used ones.
+Statistics can be older than the table of regions (e.g. the precomputed counts of 1000Genomes before a refresh, or the
+counts of TCGA kept in memory across a load), so a variant without carriers is only known to be rare: only sources
+counting the carriers from a table of regions whose loads change the data version (see Source.carriers_from_regions)
+can answer with an empty result because of it.
+"""
+from data_sources.io_parameters import MetadataAttrs, Mutation
+from sqlalchemy.engine import Connection
+from database import data_version
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+import time
+
+MAX_CACHED_VARIANTS = 100000
+MAX_AGE = 600   # seconds
+
+_lock = Lock()
+_statistics: Dict[str, 'SelectivityStatistics'] = {}
+
+
+class SelectivityStatistics:
+
+    def __init__(self, source_name: str, version: int):
+        self.source_name = source_name
+        self.version = version
+        self.created_at = time.time()
+        # metadata attributes -> stratum_id -> donors (None if the source has no strata)
+        self.strata: Dict[str, Optional[Dict[int, int]]] = {}
+        # (chrom, start, ref, alt) -> stratum_id -> carriers
+        self.carriers: 'OrderedDict[Tuple[int, int, str, str], Dict[int, int]]' = OrderedDict()
+        # False if the source has no statistics on the carriers of the variants
+        self.has_carriers = True
+
+
+def _of(source_obj) -> SelectivityStatistics:
+    source_name = source_obj.pretty_name()
+    version = data_version.current()
+    with _lock:
+        statistics = _statistics.get(source_name)
+        if statistics is None or statistics.version != version or time.time() - statistics.created_at > MAX_AGE:
+            statistics = SelectivityStatistics(source_name, version)
+            _statistics[source_name] = statistics
+        return statistics
+
+
+def _key_of_meta(meta_attrs: MetadataAttrs) -> str:
+    return repr(sorted(vars(meta_attrs).items()))
+
+
+def _key_of_variant(variant: Mutation) -> Optional[Tuple[int, int, str, str]]:
+    if variant.chrom is None or variant.start is None or variant.ref is None or variant.alt is None:
+        return None
+    return variant.chrom, variant.start, variant.ref, variant.alt
+
+
+def strata(source_obj, connection: Connection, meta_attrs: MetadataAttrs) -> Optional[Dict[int, int]]:
+    """
+    :return: the number of donors of each stratum of source_obj having meta_attrs, or None if the source has no strata.
+    """
+    statistics = _of(source_obj)
+    key = _key_of_meta(meta_attrs)
+    with _lock:
+        if key in statistics.strata:
+            return statistics.strata[key]
+    stmt = source_obj.strata_stmt(meta_attrs)
+    of_meta = {row.stratum_id: row.donors for row in connection.execute(stmt)} if stmt is not None else None
+    with _lock:
+        statistics.strata[key] = of_meta
+    return of_meta
+
+
+def population_size(source_obj, connection: Connection, meta_attrs: MetadataAttrs) -> Optional[int]:
+    """
+    :return: the number of individuals of source_obj having meta_attrs, or None if the source has no strata.
+    """
+    of_meta = strata(source_obj, connection, meta_attrs)
+    return sum(of_meta.values()) if of_meta is not None else None
+
+
+def carriers(source_obj, connection: Connection, meta_attrs: MetadataAttrs, variants: List[Mutation]) \
+        -> List[Optional[int]]:
+    """
+    :return: for each variant, the number of individuals owning it in the strata having meta_attrs (in the whole source,
+    if it has no strata). None if it is unknown, i.e. if the variant is identified only by its id or if the source has
+    no statistics on the carriers of the variants.
+    """
+    statistics = _of(source_obj)
+    keys = [_key_of_variant(variant) for variant in variants]
+    with _lock:
+        missing = sorted({key for key in keys if key is not None and key not in statistics.carriers}) \
+            if statistics.has_carriers else []
+    if missing:
+        stmt = source_obj.carriers_stmt([Mutation(*key) for key in missing])
+        if stmt is None:
+            with _lock:
+                statistics.has_carriers = False
+        else:
+            fetched = {key: {} for key in missing}
+            for row in connection.execute(stmt):
+                of_variant = fetched.setdefault((row.chrom, row.start, row.ref, row.alt), {})
+                of_variant[row.stratum_id] = of_variant.get(row.stratum_id, 0) + row.carriers
+            with _lock:
+                statistics.carriers.update(fetched)
+                while len(statistics.carriers) > MAX_CACHED_VARIANTS:
+                    statistics.carriers.popitem(last=False)
+    selected_strata = strata(source_obj, connection, meta_attrs)
+    result = []
+    with _lock:
+        for key in keys:
+            of_variant = statistics.carriers.get(key) if key is not None else None
+            if of_variant is None:
+                result.append(None)
+            else:
+                statistics.carriers.move_to_end(key)
+                result.append(sum(count for stratum_id, count in of_variant.items()
+                                  if selected_strata is None or stratum_id in selected_strata))
+    return result
+
+
+def carriers_of_all(source_obj, connection: Connection, meta_attrs: MetadataAttrs, variants: List[Mutation]) \
+        -> Optional[int]:
+    """
+    :return: an estimate of the number of individuals having meta_attrs and owning all the given variants, i.e. the
+    carriers of the rarest one, or None if the carriers of none of them are known.
+    """
+    known = [count for count in carriers(source_obj, connection, meta_attrs, variants) if count is not None]
+    return min(known) if known else None
@@ -2,6 +2,7 @@ from typing import Tuple
 from sqlalchemy import func, column
 from data_sources.source_interface import *
 from database.database import *
+from monitoring import metrics
 
 
 # noinspection PyAbstractClass
@@ -50,28 +51,32 @@ class SourceBlockingSmallPopulations(Source):
     # PLUS THE OTHER METHODS FROM SOURCE
 
     # PRIVACY POLICY
-    def block_if_below_threshold(self, table_or_stmt: FromClause):
+    def block_if_below_threshold(self, table_or_stmt: FromClause, operation: str):
         new_stmt = select([func.count()]).select_from(table_or_stmt.alias())
         population_size = try_stmt(new_stmt, None, None).scalar()
         print('SELECTED POPULATION_SIZE ', population_size)
+        self.block_if_size_below_threshold(population_size, operation)
+
+    def block_if_size_below_threshold(self, population_size: int, operation: str):
         if population_size < self.POPULATION_LOWER_THRESHOLD:
+            metrics.PRIVACY_BLOCKS.inc(source=self.__class__.__name__, operation=operation)
             raise Notice(f'{self.__class__.__name__}: The selected query does not comply with the privacy constraints imposed by the '
                          f'source and the result was removed from the output. Please relax some filters to reach a '
                          f'population of at least {self.POPULATION_LOWER_THRESHOLD} individuals.')
 
     def donors(self, *args, **kwargs):
         table_or_stmt: FromClause = self._donors(*args, **kwargs)
-        self.block_if_below_threshold(table_or_stmt)
+        self.block_if_below_threshold(table_or_stmt, 'donors')
         return table_or_stmt
 
     def variants_in_region(self, *args, **kwargs):
         variants_in_region, donors = self._variants_in_region(*args, **kwargs)
-        self.block_if_below_threshold(donors)
+        self.block_if_below_threshold(donors, 'variants_in_region')
         return variants_in_region
 
     def variant_occurrence(self, *args, **kwargs):
         table_or_stmt = self._variant_occurrence(*args, **kwargs)
-        self.block_if_below_threshold(table_or_stmt)
+        self.block_if_below_threshold(table_or_stmt, 'variant_occurrence')
         return table_or_stmt
 
     def rank_variants_by_frequency(self, *args, **kwargs):
@@ -82,6 +87,7 @@ class SourceBlockingSmallPopulations(Source):
             .where(column(Vocabulary.POPULATION_SIZE.name) < self.POPULATION_LOWER_THRESHOLD)
         count_not_allowed_populations = try_stmt(count_not_allowed_populations_query, None, None).scalar()
         if count_not_allowed_populations > 0:
+            metrics.PRIVACY_BLOCKS.inc(source=self.__class__.__name__, operation='rank_variants_by_frequency')
             self.notify_message(SourceMessage.Type.GENERAL_WARNING,
                                 f'{self.__class__.__name__}: The selected query does not comply with the privacy constraints imposed by the '
                                 f'source and the result was removed from the output. Please relax some filters to reach a '
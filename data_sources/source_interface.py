@@ -1,7 +1,12 @@
 from data_sources.io_parameters import *
+from database import sql_logging
 from sqlalchemy.engine import Connection
-from sqlalchemy.sql.expression import FromClause
-from typing import List, Callable
+from sqlalchemy.sql.expression import FromClause, Selectable
+from typing import Callable, Dict, List, Tuple
+
+# above this number of variants, the sources filter the regions through a join with the list of variants passed as a
+# parameter, instead of a literal IN list whose SQL text grows with the number of variants
+MAX_LITERAL_VARIANTS = 16
 
 
 def do_not_notify(type: SourceMessage.Type, msg: str) -> None:
@@ -17,6 +22,11 @@ class Source:
         enforce on region data in order to filter the variants.
         These fields support the coordinator and some methods of Source (those annotated with @classmethod). A
         subclass of Source can override them if necessary. Instead the other methods must be overridden.
+        When the instance field "dry_run" is True, the source is expected to build the same statements as usual without
+        creating any table or view in the database (e.g. by using CTEs in place of intermediate tables), as the
+        statements are only going to be explained.
+        When the instance field "population_items" is not None, the population is further restricted to the individuals
+        having one of the listed item_id (as previously returned by the method item_ids for a population handle).
         """
 
     meta_col_map: dict = {}
@@ -28,9 +38,18 @@ class Source:
 
     avail_region_constraints: set = set()
 
+    # True if carriers_stmt counts the carriers from the table of regions and every load of the table changes the data
+    # version (database.data_version), so that a variant without carriers can't be owned by any individual (instead,
+    # the statistics kept in memory may miss the individuals loaded after their computation)
+    carriers_from_regions: bool = False
+
     def __init__(self, logger_instance, notify_message: Callable[[SourceMessage.Type, str], None] = do_not_notify):
         self.logger = logger_instance
+        # logs the SQL statements when the instance field "log_sql_commands" is True (see database.sql_logging)
+        self.sql_logger = sql_logging.log_function(logger_instance)
         self.notify_message = notify_message
+        self.dry_run = False
+        self.population_items: Optional[List[int]] = None
 
     def donors(self, connection, by_attributes: List[Vocabulary], meta_attrs: MetadataAttrs,
                region_attrs: RegionAttrs, with_download_urls: bool) -> FromClause:
@@ -50,6 +69,14 @@ class Source:
         """
         raise NotImplementedError('Any subclass of Source must implement the abstract method "donors"')
 
+    def item_ids(self, connection: Connection, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs) -> FromClause:
+        """
+        Requests a source to return the individuals having the characteristics in meta_attrs and region_attrs, as a
+        statement with the single column item_id. The identifiers are stored by the server as a population handle
+        (see server/populations.py) and used later through the field population_items.
+        """
+        raise NotImplementedError('Any subclass of Source must implement the abstract method "item_ids"')
+
     def variant_occurrence(self, connection: Connection, by_attributes: List[Vocabulary], meta_attrs: MetadataAttrs,
                            region_attrs: RegionAttrs, variant: Mutation) -> FromClause:
         """
@@ -61,6 +88,71 @@ class Source:
         """
         raise NotImplementedError('Any subclass of Source must implement the abstract method "variant_occurrence".')
 
+    def variant_occurrence_by_strata(self, connection: Connection, by_attributes: List[Vocabulary],
+                                     meta_attrs: MetadataAttrs, region_attrs: RegionAttrs,
+                                     variant: Mutation) -> Optional[FromClause]:
+        """
+        Optional shortcut of variant_occurrence for sources keeping precomputed counts of groups of individuals. If the
+        source can answer from such counts, it returns a statement having a row for each group of individuals, with
+        the attributes given in by_attributes and the columns named as Vocabulary.POPULATION_SIZE (the size of the
+        group), Vocabulary.POSITIVE_DONORS and Vocabulary.OCCURRENCE (of the target variant in the group).
+        The default implementation returns None, meaning that variant_occurrence must be used instead.
+        """
+        return None
+
+    def variant_occurrence_matrix(self, connection: Connection, by_attributes: List[Vocabulary],
+                                  meta_attrs: MetadataAttrs, region_attrs: RegionAttrs,
+                                  variants: List[Mutation]) -> Tuple[FromClause, FromClause]:
+        """
+        Requests a source to count the occurrences of many variants in the groups of individuals (strata) having the
+        characteristics in meta_attrs and region_attrs, grouped by the attributes in by_attributes (which always
+        include the gender). The source returns two statements:
+        - the strata, with the attributes in by_attributes and the column Vocabulary.POPULATION_SIZE;
+        - the occurrences, with the attributes in by_attributes and the columns CHROM, START, REF, ALT, OCCURRENCE (named
+        as in Vocabulary), having a row for each variant in "variants" and each stratum where the variant occurs.
+        The occurrences must be computed by a single aggregation over the regions of the variants.
+        """
+        raise NotImplementedError('Any subclass of Source must implement the abstract method '
+                                  '"variant_occurrence_matrix".')
+
+    def genotypes_by_position(self, connection: Connection, meta_attrs: MetadataAttrs,
+                              region_attrs: Optional[RegionAttrs]) -> FromClause:
+        """
+        Requests a source to return the variants of the individuals having the characteristics in meta_attrs and
+        region_attrs, as a statement with a row for each variant of each individual and the columns CHROM, START, REF,
+        ALT (named as in Vocabulary), data_sources.gene_burden.ITEM_ID (the identifier of the individual) and
+        Vocabulary.OCCURRENCE (1 or 2), sorted by CHROM, START, REF, ALT.
+        """
+        raise NotImplementedError('Any subclass of Source must implement the abstract method "genotypes_by_position".')
+
+    def phased_genotypes_in_interval(self, connection: Connection, genomic_interval: GenomicInterval,
+                                     meta_attrs: MetadataAttrs,
+                                     region_attrs: Optional[RegionAttrs]) -> Optional[Tuple[FromClause, FromClause]]:
+        """
+        Optional method for sources knowing on which chromosome copy each variant lies. If supported, the source returns
+        - a statement selecting the individuals having the characteristics in meta_attrs and region_attrs, with the
+        columns data_sources.linkage.ITEM_ID and Vocabulary.GENDER;
+        - a statement selecting the variants of those individuals falling in genomic_interval, with the columns START,
+        REF, ALT (named as in Vocabulary), linkage.ITEM_ID, AL1 and AL2 (1 if the variant is on the first/second copy),
+        sorted by START, REF, ALT.
+        The default implementation returns None, meaning that the source does not support the analysis.
+        """
+        return None
+
+    def case_control_counts(self, connection: Connection, case_meta_attrs: MetadataAttrs,
+                            case_region_attrs: Optional[RegionAttrs], control_meta_attrs: MetadataAttrs,
+                            control_region_attrs: Optional[RegionAttrs]) -> Optional[Tuple[FromClause, Dict]]:
+        """
+        Optional method for sources able to compare two populations, a group of cases and a group of controls, with a
+        single read of their variants. If supported, the source returns
+        - a statement with a row for each variant owned by any individual of the two groups, with the columns CHROM,
+        START, REF, ALT (named as in Vocabulary) and the occurrence of the variant in each group, in the columns named
+        as data_sources.case_control.CASE_OCCURRENCE and CONTROL_OCCURRENCE, in this order;
+        - a dictionary with the number of (males, females) of each group, with keys case_control.CASE and CONTROL.
+        The default implementation returns None, meaning that the source does not support the analysis.
+        """
+        return None
+
     def rank_variants_by_frequency(self, connection, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs, ascending: bool,
                                    freq_threshold: float, limit_result: int, time_estimate_only: bool) -> FromClause:
         """
@@ -92,6 +184,34 @@ class Source:
         """
         raise NotImplementedError('Any subclass of Source must implement the abstract method "values_of_attribute".')
 
+    def value_catalog_stmt(self, connection) -> Selectable:
+        """
+        Requests a source to return a statement grouping its individuals by all the attributes in
+        get_available_attributes() except the donor identifier. The statement must have a column for each of those
+        attributes, named as in Vocabulary, and a column Vocabulary.COUNT with the number of individuals in the group.
+        The result is kept in memory by value_catalog (typically, values_of_attribute answers from there).
+        """
+        raise NotImplementedError('Any subclass of Source must implement the abstract method "value_catalog_stmt".')
+
+    def strata_stmt(self, meta_attrs: MetadataAttrs) -> Optional[Selectable]:
+        """
+        Optionally, a source can return a statement selecting its strata of individuals (groups of individuals sharing
+        the same metadata values) having the characteristics in meta_attrs. The statement must have the columns
+        stratum_id and donors (the number of individuals in the stratum). The result is kept in memory by selectivity.
+        The default implementation returns None, meaning that the source has no strata.
+        """
+        return None
+
+    def carriers_stmt(self, variants: List[Mutation]) -> Optional[Selectable]:
+        """
+        Optionally, a source can return a statement counting the individuals owning each of the given variants (all
+        identified by their coordinates) in each stratum. The statement must have the columns chrom, start, ref, alt,
+        stratum_id and carriers; the strata are the ones of strata_stmt or, if the source has no strata, any constant.
+        The result is kept in memory by selectivity (see also the field carriers_from_regions). The default
+        implementation returns None, meaning that the source has no statistics on the carriers of the variants.
+        """
+        return None
+
     def get_variant_details(self, connection, variant: Mutation, which_details: List[Vocabulary], assembly) -> List:
         """
         Given the "variant", the source must return a list of the values of the properties in "which_details" in the
@@ -2,12 +2,17 @@ import locale
 
 from ..source_interface import *
 from ..io_parameters import *
-from sqlalchemy import MetaData, Table, cast, select, union_all, union, tuple_, func, exists, asc, desc, text, literal, column, types, case, intersect
-from sqlalchemy.sql.expression import Selectable, except_
+from sqlalchemy import MetaData, Table, cast, select, union_all, tuple_, func, asc, desc, text, literal, column, types, case, intersect
+from sqlalchemy.sql.expression import Selectable, ClauseElement, except_
 from sqlalchemy.engine import Connection
 from functools import reduce
 import database.db_utils as utils
 import database.database as database
+from .. import allele_frequency
+from .. import value_catalog
+from .. import selectivity
+from .. import gene_burden
+from monitoring import metrics
 from threading import RLock
 from loguru import logger
 
@@ -43,6 +48,9 @@ class TCGA(Source):
         Vocabulary.WITH_VARIANTS_IN_SOMATIC_CELLS,
         Vocabulary.WITHOUT_VARIANT
     }
+    # carriers_stmt reads the table of regions, but its loads don't change the data version: the carriers kept in
+    # memory by selectivity may miss the individuals loaded since they were counted
+    carriers_from_regions = False
     region_col_map = {
         Vocabulary.CHROM: 'chrom',
         Vocabulary.START: 'start',
@@ -54,7 +62,7 @@ class TCGA(Source):
         Vocabulary.ID: 'id'
     }
 
-    log_sql_commands: bool = True
+    log_sql_commands: bool = False
     
     def __init__(self, logger_instance, notify_message=do_not_notify):
         super().__init__(logger_instance, notify_message)
@@ -82,7 +90,7 @@ class TCGA(Source):
         self._set_meta_attributes(meta_attrs)
         self.create_table_of_meta(names_columns_of_interest)
         self._set_region_attributes(region_attrs)
-        self.create_table_of_regions(['item_id'])
+        self.create_table_of_regions()
 
         # TCGA has 4 gender classes: males/females/not reported/<no gender at all>. This trick merges null gender with
         # not reported. Otherwise, when coordinator does group by cube(gender) we would get 2 times a null gender.
@@ -104,7 +112,27 @@ class TCGA(Source):
         if with_download_urls:
             stmt = stmt.where(self.my_meta_t.c.item_id == public_item.c.item_id)
         if self.log_sql_commands:
-            utils.show_stmt(self.connection, stmt, self.logger.debug, 'TCGA: STMT DONORS WITH REQUIRED ATTRIBUTES')
+            utils.show_stmt(self.connection, stmt, self.sql_logger, 'TCGA: STMT DONORS WITH REQUIRED ATTRIBUTES')
+        return stmt
+
+    def item_ids(self, connection: Connection, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs) -> Selectable:
+        """
+        Assembles a query statement that, when executed, returns the item_id of the individuals matching the
+        requirements in meta_attrs and region_attrs
+        """
+        self.connection = connection
+        self._set_meta_attributes(meta_attrs)
+        self.create_table_of_meta(['item_id'])
+        self._set_region_attributes(region_attrs)
+        self.create_table_of_regions()
+
+        stmt = select([self.my_meta_t.c.item_id])
+        if self.my_region_t is not None:
+            stmt = stmt.where(self.my_meta_t.c.item_id.in_(
+                select([self.my_region_t.c.item_id]).distinct()
+            ))
+        if self.log_sql_commands:
+            utils.show_stmt(self.connection, stmt, self.sql_logger, 'TCGA: STMT ITEM_IDS OF POPULATION')
         return stmt
 
     def variant_occurrence(self, connection: Connection, by_attributes: list, meta_attrs: MetadataAttrs,
@@ -120,7 +148,7 @@ class TCGA(Source):
         self._set_meta_attributes(meta_attrs)
         self.create_table_of_meta(names_columns_of_interest + ['item_id'])
         self._set_region_attributes(region_attrs)
-        self.create_table_of_regions(['item_id'])
+        self.create_table_of_regions()
 
         # select target attributes from table of metadata with meta_attrs
         stmt_sample_set = select([self.my_meta_t.c[self.meta_col_map[attr]] for attr in by_attributes]
@@ -158,7 +186,80 @@ class TCGA(Source):
                                                    stmt_sample_set.c.item_id == stmt_samples_w_var.c.item_id))
         # TODO test what happens if sample set is empty and it is anyway used in the left join statement
         if self.log_sql_commands:
-            utils.show_stmt(connection, stmt, self.logger.debug, 'TCGA: STMT VARIANT OCCURRENCE')
+            utils.show_stmt(connection, stmt, self.sql_logger, 'TCGA: STMT VARIANT OCCURRENCE')
+        return stmt
+
+    def variant_occurrence_matrix(self, connection: Connection, by_attributes: List[Vocabulary],
+                                  meta_attrs: MetadataAttrs, region_attrs: RegionAttrs,
+                                  variants: List[Mutation]) -> Tuple[Selectable, Selectable]:
+        # init state
+        self.connection = connection
+        names_columns_of_interest = [self.meta_col_map[attr] for attr in by_attributes]
+        self._set_meta_attributes(meta_attrs)
+        self.create_table_of_meta(names_columns_of_interest + ['item_id'])
+        self._set_region_attributes(region_attrs)
+        self.create_table_of_regions()
+
+        sample_set = select([self.my_meta_t.c[name] for name in names_columns_of_interest] + [self.my_meta_t.c.item_id])
+        if self.my_region_t is not None:
+            sample_set = sample_set.where(self.my_meta_t.c.item_id.in_(
+                select([self.my_region_t.c.item_id]).distinct()
+            ))
+        sample_set = sample_set.alias('sample_set')
+        strata_columns = [sample_set.c[name] for name in names_columns_of_interest]
+        # merges null gender with not reported, as in variant_occurrence
+        strata_labels = [func.coalesce(sample_set.c[self.meta_col_map[attr]], 'not reported').label(attr.name)
+                         if attr is Vocabulary.GENDER else sample_set.c[self.meta_col_map[attr]].label(attr.name)
+                         for attr in by_attributes]
+
+        strata_stmt = select(strata_labels + [func.count().label(Vocabulary.POPULATION_SIZE.name)]) \
+            .group_by(*strata_columns)
+
+        # one join of the regions of the variants with the individuals, and a single aggregation
+        variant_regions = self._stmt_where_region_is_any_of_mutations(
+            *variants,
+            from_table=regions,
+            select_expression=select([regions.c.item_id, regions.c.chrom, regions.c.start, regions.c.ref,
+                                      regions.c.alt, (regions.c.al1 + func.coalesce(regions.c.al2, 0)).label('occurrence')])) \
+            .alias('variant_regions')
+        counts_stmt = select(strata_labels +
+                             [variant_regions.c.chrom.label(Vocabulary.CHROM.name),
+                              variant_regions.c.start.label(Vocabulary.START.name),
+                              variant_regions.c.ref.label(Vocabulary.REF.name),
+                              variant_regions.c.alt.label(Vocabulary.ALT.name),
+                              func.sum(variant_regions.c.occurrence).label(Vocabulary.OCCURRENCE.name)]) \
+            .select_from(sample_set.join(variant_regions, sample_set.c.item_id == variant_regions.c.item_id)) \
+            .group_by(*strata_columns, variant_regions.c.chrom, variant_regions.c.start, variant_regions.c.ref,
+                      variant_regions.c.alt)
+        if self.log_sql_commands:
+            utils.show_stmt(connection, counts_stmt, self.sql_logger, 'TCGA: STMT VARIANT OCCURRENCE MATRIX')
+        return strata_stmt, counts_stmt
+
+    def genotypes_by_position(self, connection: Connection, meta_attrs: MetadataAttrs,
+                              region_attrs: Optional[RegionAttrs]) -> Selectable:
+        # init state
+        self.connection = connection
+        self._set_meta_attributes(meta_attrs)
+        self.create_table_of_meta(['item_id'])
+        self._set_region_attributes(region_attrs)
+        self.create_table_of_regions()
+
+        sample_set = select([self.my_meta_t.c.item_id])
+        if self.my_region_t is not None:
+            sample_set = sample_set.where(self.my_meta_t.c.item_id.in_(
+                select([self.my_region_t.c.item_id]).distinct()
+            ))
+        sample_set = sample_set.alias('sample_set')
+        stmt = select([regions.c.chrom.label(Vocabulary.CHROM.name),
+                       regions.c.start.label(Vocabulary.START.name),
+                       regions.c.ref.label(Vocabulary.REF.name),
+                       regions.c.alt.label(Vocabulary.ALT.name),
+                       regions.c.item_id.label(gene_burden.ITEM_ID),
+                       (regions.c.al1 + func.coalesce(regions.c.al2, 0)).label(Vocabulary.OCCURRENCE.name)]) \
+            .select_from(regions.join(sample_set, regions.c.item_id == sample_set.c.item_id)) \
+            .order_by(regions.c.chrom, regions.c.start, regions.c.ref, regions.c.alt)
+        if self.log_sql_commands:
+            utils.show_stmt(connection, stmt, self.sql_logger, 'TCGA: STMT GENOTYPES BY POSITION')
         return stmt
 
     def rank_variants_by_frequency(self, connection, meta_attrs: MetadataAttrs, region_attrs: RegionAttrs, ascending: bool,
@@ -168,7 +269,7 @@ class TCGA(Source):
         self._set_meta_attributes(meta_attrs)
         self.create_table_of_meta(['item_id', 'gender'])
         self._set_region_attributes(region_attrs)
-        self.create_table_of_regions(['item_id'])
+        self.create_table_of_regions()
 
         females_and_males_stmt = select([self.my_meta_t.c.gender, func.count()])
         if self.my_region_t is not None:
@@ -176,13 +277,23 @@ class TCGA(Source):
                 .where(self.my_meta_t.c.item_id.in_(select([self.my_region_t.c.item_id])))
         females_and_males_stmt = females_and_males_stmt \
             .group_by(self.my_meta_t.c.gender)
-        gender_of_individuals = [row.values() for row in connection.execute(females_and_males_stmt).fetchall()]
+        if self.dry_run:
+            # the statement is only explained: instead of evaluating the region constraints to count the individuals,
+            # their number is estimated by the query planner
+            members = select([self.my_meta_t.c.item_id])
+            if self.my_region_t is not None:
+                members = members.where(self.my_meta_t.c.item_id.in_(select([self.my_region_t.c.item_id])))
+            population_size = int(utils.estimated_rows(members, connection))
+            gender_of_individuals = [['male', population_size // 2], ['female', population_size - population_size // 2]]
+        else:
+            gender_of_individuals = [row.values() for row in connection.execute(females_and_males_stmt).fetchall()]
         if len(gender_of_individuals) == 0:
             raise EmptyResult('TCGA ')
         females = next((el[1] for el in gender_of_individuals if el[0] == 'female'), 0)
         males = next((el[1] for el in gender_of_individuals if el[0] == 'male'), 0)
         other_genders = reduce(lambda x1, x2: x1+x2, [el[1] for el in gender_of_individuals]) - males - females
         self.logger.debug(f'TCGA: request /rank_variants_by_frequency for a population of {males+females+other_genders} individuals')
+        self.notify_message(SourceMessage.Type.POPULATION_SIZE, str(males+females+other_genders))
 
         if time_estimate_only:
             approx_pop_size = males+females+other_genders
@@ -248,15 +359,10 @@ class TCGA(Source):
             .alias('stmt_2')
 
         # other custom function
-        if meta_attrs.assembly == 'hg19':
-            func_frequency_new = func.rr.mut_frequency_new_hg19(column('occurrence'), column('males'), females,
-                                                                outer_stmt.c.chrom,
-                                                                outer_stmt.c.start)
-        else:
-            func_frequency_new = func.rr.mut_frequency_new_grch38(column('occurrence'), column('males'), females,
-                                                                  outer_stmt.c.chrom,
-                                                                  outer_stmt.c.start)
-        func_frequency_new = func_frequency_new.label(Vocabulary.FREQUENCY.name)
+        func_frequency_new = allele_frequency.frequency_expression(column('occurrence'), column('males'), females,
+                                                                   outer_stmt.c.chrom, outer_stmt.c.start,
+                                                                   meta_attrs.assembly)\
+            .label(Vocabulary.FREQUENCY.name)
 
         outer_outer_stmt = \
             select([
@@ -281,73 +387,45 @@ class TCGA(Source):
             .alias('TCGA_ranked')
 
         if self.log_sql_commands:
-            utils.show_stmt(connection, outer_outer_stmt, self.logger.debug, 'TCGA: RANKING VARIANTS IN SAMPLE SET')
+            utils.show_stmt(connection, outer_outer_stmt, self.sql_logger, 'TCGA: RANKING VARIANTS IN SAMPLE SET')
         return outer_outer_stmt
 
     def values_of_attribute(self, connection, attribute: Vocabulary):
-        # VIA DATABASE
-        # self.connection = connection
-        # region_attributes = regions.columns.keys()
-        # meta_attributes = metadata.columns.keys()
-        # self.logger.debug('regions:', region_attributes)
-        # self.logger.debug('meta:', meta_attributes)
-        # if attribute in meta_attributes:
-        #     stmt = select([metadata.c[attribute]]).distinct()
-        # elif attribute in region_attributes:
-        #     stmt = select([regions.c[attribute]]).distinct()
-        # else:
-        #     raise ValueError(
-        #         'the given attribute {} is not part of the metadata columns nor region columns'.format(attribute))
-        # if self.log_sql_commands:
-        #     utils.show_stmt(self.connection, stmt, 'DISTINCT VALUES OF {}'.format(attribute))
-        # return self.connection.execute(stmt)
-
-        if attribute == Vocabulary.DISEASE:
-            stmt = select([metadata.c.disease]).distinct() \
-                .where(metadata.c.item_id.in_(
-                    # select item_ids of TCGA
-                    text("  select item_id from public.item where dataset_id in ( "
-                         "      select dataset_id from public.dataset "
-                         "      where dataset_name ilike '%TCGA_dnaseq%' "
-                         "      or dataset_name ilike '%TCGA_somatic_mutation_masked%' "
-                         "      )")
-                ))
-            result_proxy = database.try_stmt(stmt, None, None).fetchall()
-            return 'TCGA', [row.values()[0] for row in result_proxy]
-
-        # HARDCODED
-        # since an attribute can also be mut_type which is not indexed, answering takes forever. This is an easy solution
-        # considered that the underlying data is updated rarely, we don't need an index on mut_type.
         if attribute == Vocabulary.DNA_SOURCE:
             raise Notice('Unfortunately it is not known the DNA source of the samples coming from TCGA.')
         elif attribute == Vocabulary.SUPER_POPULATION:
             raise Notice('Unfortunately it is not known the super_population of the samples coming from TCGA.')
         elif attribute == Vocabulary.POPULATION:
             raise Notice('Unfortunately it is not known the population of the samples coming from TCGA.')
-        distinct_values = {
-            self.meta_col_map[Vocabulary.ASSEMBLY]: [
-                'hg19',
-                'grch38'
-            ],
-            self.meta_col_map[Vocabulary.GENDER]: [
-                'female',
-                'male',
-                'not reported'
-            ],
-            self.meta_col_map[Vocabulary.ETHNICITY]: [
-                'american indian or alaska native',
-                'black or african american',
-                'white',
-                'native hawaiian or other pacific islander',
-                'not reported',
-                'asian'
-            ],
-            self.meta_col_map[Vocabulary.HEALTH_STATUS]: [
-                False
-            ],
-            'mut_type': ['SNP', 'DEL', 'INS', 'DNP', 'TNP'],
-        }
-        return 'TCGA', distinct_values.get(self.meta_col_map.get(attribute))
+        return 'TCGA', value_catalog.of(self, connection).values(attribute)
+
+    def value_catalog_stmt(self, connection) -> Selectable:
+        self.connection = connection
+        attributes = {attr: metadata.c[col_name] for attr, col_name in self.meta_col_map.items()
+                      if attr != Vocabulary.DONOR_ID}
+        stmt = select([col.label(attr.name) for attr, col in attributes.items()] +
+                      [func.count().label(Vocabulary.COUNT.name)]) \
+            .where(metadata.c.item_id.in_(
+                # select item_ids of TCGA
+                text("select item_id from public.item where dataset_id in ( "
+                     "select dataset_id from public.dataset "
+                     "where dataset_name ilike '%TCGA_dnaseq%' "
+                     "or dataset_name ilike '%TCGA_somatic_mutation_masked%' "
+                     ")"))) \
+            .group_by(*attributes.values())
+        if self.log_sql_commands:
+            utils.show_stmt(connection, stmt, self.sql_logger, 'TCGA: CATALOG OF VALUES')
+        return stmt
+
+    def carriers_stmt(self, variants: List[Mutation]) -> Optional[Selectable]:
+        # without strata, the carriers are counted in the whole source: an upper bound of the carriers in any population
+        stmt = self._stmt_where_region_is_any_of_mutations(
+            *variants,
+            from_table=regions,
+            select_expression=select([regions.c.chrom, regions.c.start, regions.c.ref, regions.c.alt,
+                                      literal(0).label('stratum_id'),
+                                      func.count(regions.c.item_id.distinct()).label('carriers')]))
+        return stmt.group_by(regions.c.chrom, regions.c.start, regions.c.ref, regions.c.alt)
 
     # SETTERS
     def _set_region_attributes(self, region_attrs: RegionAttrs):
@@ -411,17 +489,34 @@ class TCGA(Source):
         mutations_having_id = [mut for mut in mutations if mut.id is not None]
         mutations_without_id = [mut for mut in mutations if mut.id is None]
         first_select, second_select = None, None
-        if len(mutations_having_id) > 0:
+        if len(mutations_having_id) > MAX_LITERAL_VARIANTS:
+            # a join with the list of ids instead of a literal IN list that grows with the number of variants
+            requested_ids = utils.values_relation('requested_ids', [('id', from_table.c.id.type)],
+                                                  sorted({(mut.id,) for mut in mutations_having_id}))
+            first_select = select_expression.select_from(
+                from_table.join(requested_ids, from_table.c.id == requested_ids.c.id))
+        elif len(mutations_having_id) > 0:
             first_select = select_expression.where(from_table.c.id.in_([mut.id for mut in mutations_having_id]))
-            if only_item_id_in_table is not None:
-                first_select = first_select.where(from_table.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
-        if len(mutations_without_id) > 0:
+        if first_select is not None and only_item_id_in_table is not None:
+            first_select = first_select.where(from_table.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
+        if len(mutations_without_id) > MAX_LITERAL_VARIANTS:
+            # same as above, with the variants sorted like the index on (chrom, start, ref, alt) of the region table
+            requested_variants = utils.values_relation(
+                'requested_variants',
+                [(c_name, from_table.c[c_name].type) for c_name in ('chrom', 'start', 'ref', 'alt')],
+                sorted({(mut.chrom, mut.start, mut.ref, mut.alt) for mut in mutations_without_id}))
+            second_select = select_expression.select_from(
+                from_table.join(requested_variants, (from_table.c.chrom == requested_variants.c.chrom) &
+                                (from_table.c.start == requested_variants.c.start) &
+                                (from_table.c.ref == requested_variants.c.ref) &
+                                (from_table.c.alt == requested_variants.c.alt)))
+        elif len(mutations_without_id) > 0:
             second_select = select_expression.where(
                 tuple_(from_table.c.start, from_table.c.ref, from_table.c.alt, from_table.c.chrom).in_(
                     [(mut.start, mut.ref, mut.alt, mut.chrom) for mut in mutations_without_id]
                 ))
-            if only_item_id_in_table is not None:
-                second_select = second_select.where(from_table.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
+        if second_select is not None and only_item_id_in_table is not None:
+            second_select = second_select.where(from_table.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
         if first_select is not None and second_select is not None:
             return union_all(first_select, second_select)
         elif first_select is not None:
@@ -429,6 +524,43 @@ class TCGA(Source):
         else:
             return second_select
 
+    def _create_table_as(self, name_prefix: str, stmt_as, log_title: str):
+        """
+        Creates a table in the temporary schema holding the result of stmt_as and returns it. In dry-run mode, no table
+        is created and stmt_as is returned as a CTE instead.
+        """
+        t_name = utils.random_t_name_w_prefix(name_prefix)
+        if self.dry_run:
+            return stmt_as.cte(t_name)
+        stmt_create_table = utils.stmt_create_table_as(t_name, stmt_as, default_schema_to_use_name)
+        if self.log_sql_commands:
+            utils.show_stmt(self.connection, stmt_create_table, self.sql_logger, log_title)
+        self.connection.execute(stmt_create_table)
+        metrics.TEMP_OBJECTS_CREATED.inc(kind='table')
+        return Table(t_name, db_meta, autoload=True, autoload_with=self.connection,
+                     schema=default_schema_to_use_name)
+
+    def _create_view_as(self, name_prefix: str, stmt_as, log_title: str):
+        """
+        Same as _create_table_as, but creates a view.
+        """
+        view_name = utils.random_t_name_w_prefix(name_prefix)
+        if self.dry_run:
+            return stmt_as.cte(view_name)
+        stmt = utils.stmt_create_view_as(view_name, stmt_as, default_schema_to_use_name)
+        if self.log_sql_commands:
+            utils.show_stmt(self.connection, stmt, self.sql_logger, log_title)
+        self.connection.execute(stmt)
+        metrics.TEMP_OBJECTS_CREATED.inc(kind='view')
+        return Table(view_name, db_meta, autoload=True, autoload_with=self.connection,
+                     schema=default_schema_to_use_name)
+
+    def _drop_table(self, table):
+        if isinstance(table, Table):    # CTEs used in dry-run mode have nothing to drop
+            if self.log_sql_commands:
+                self.sql_logger('DROP TABLE ' + table.name)
+            table.drop(self.connection)
+
     # GENERATE DB ENTITIES
     def create_table_of_meta(self, select_columns: Optional[list]):
         """Assigns my_meta_t as the table containing only the individuals with the required metadata characteristics"""
@@ -458,147 +590,108 @@ class TCGA(Source):
             query = query.where(metadata.c.assembly == self.meta_attrs.assembly)
         if self.meta_attrs.ethnicity:
             query = query.where(metadata.c.ethnicity.in_(self.meta_attrs.ethnicity))
+        if self.population_items is not None:
+            query = query.where(metadata.c.item_id.in_(self.population_items))
         new_meta_table_name = utils.random_t_name_w_prefix('meta')
-        utils.create_table_as(new_meta_table_name, query, default_schema_to_use_name, self.connection, self.log_sql_commands, self.logger.debug)
+        if self.dry_run:
+            self.my_meta_t = query.cte(new_meta_table_name)
+            return
+        utils.create_table_as(new_meta_table_name, query, default_schema_to_use_name, self.connection, self.log_sql_commands, self.sql_logger)
         # t_stmt = utils.stmt_create_table_as(new_meta_table_name, query,  default_schema_to_use_name)
         # if self.log_sql_commands:
         #     utils.show_stmt(t_stmt, 'TABLE OF SAMPLES HAVING META')
         # self.connection.execute(t_stmt)
         self.my_meta_t = Table(new_meta_table_name, db_meta, autoload=True, autoload_with=self.connection, schema=default_schema_to_use_name)
 
-    def create_table_of_regions(self, select_columns: Optional[list]):
-        if self.region_attrs:
-            # compute each filter on regions separately
-            to_combine_t = list()
-            if self.region_attrs.with_variants:
-                t = self.table_with_all_of_mutations(select_columns)
-                to_combine_t.append(t)
-            if self.region_attrs.with_variants_in_reg:
-                t = self.view_of_variants_in_interval_or_type(select_columns)
-                to_combine_t.append(t)
-            if self.region_attrs.without_variants:
-                t = self._table_without_any_of_mutations()
-                to_combine_t.append(t)
-            if len(to_combine_t) == 0:
-                self.my_region_t = None
-            if len(to_combine_t) == 1:  # when only one filter kind
-                self.my_region_t = to_combine_t[0]
-            elif len(to_combine_t) > 1:
-                self.my_region_t = self.take_regions_of_common_individuals(to_combine_t)
-
-    def table_with_all_of_mutations(self, select_columns: Optional[list]):
+    def create_table_of_regions(self):
         """
-         Returns a table of variants of the same type of the ones contained in RegionAttrs.with_variants and only form the
-         individuals that own all of them.
-         :param select_columns: the list of column names to select from the result. If None, all the columns are taken.
+        Sets self.my_region_t to a table of the item_id of the individuals in self.my_meta_t satisfying all the region
+        constraints in self.region_attrs (None if there are no region constraints). The constraints are evaluated one
+        after the other, from the most selective one according to the statistics in selectivity (or, if missing, to the
+        estimates of the query planner), and each of them only considers the individuals selected by the previous ones.
+        If the source counts the carriers from the table of regions (see Source.carriers_from_regions), it raises
+        EmptyResult without executing any constraint when a required variant has no carriers in the population.
         """
-        if not self.region_attrs.with_variants:
-            raise ValueError('instance parameter self.with_variants not initialized')
-        elif len(self.region_attrs.with_variants) == 1:
-            return self._table_with_any_of_mutations(select_columns, self.my_meta_t, *self.region_attrs.with_variants)
-        else:
-            union_select_column_names = None  # means all columns
-            if select_columns is not None:  # otherwise use select_columns + minimum necessary
-                union_select_column_names = set(select_columns)
-                union_select_column_names.add('item_id')
-            union_table = self._table_with_any_of_mutations(union_select_column_names, self.my_meta_t,
-                                                            *self.region_attrs.with_variants)
-            # extracts only the samples having all the mutations
-            result_select_columns = [union_table]  # means all columns
-            if select_columns is not None:  # otherwise use selected_columns
-                result_select_columns = [union_table.c[col_name] for col_name in select_columns]
-            stmt_as = \
-                select(result_select_columns) \
-                .where(union_table.c.item_id.in_(
-                    select([union_table.c.item_id])
-                    .group_by(union_table.c.item_id)
-                    .having(func.count(union_table.c.item_id) == len(self.region_attrs.with_variants))
-                ))
-            target_t_name = utils.random_t_name_w_prefix('with')
-            stmt_create_table = utils.stmt_create_table_as(target_t_name, stmt_as, default_schema_to_use_name)
-            if self.log_sql_commands:
-                utils.show_stmt(self.connection, stmt_create_table, self.logger.debug,
-                                'INDIVIDUALS HAVING "ALL" THE {} MUTATIONS (WITH DUPLICATE ITEM_ID)'.format(
-                                    len(self.region_attrs.with_variants)))
-            self.connection.execute(stmt_create_table)
-            if self.log_sql_commands:
-                self.logger.debug('DROP TABLE ' + union_table.name)
-            union_table.drop(self.connection)
-            return Table(target_t_name, db_meta, autoload=True, autoload_with=self.connection, schema=default_schema_to_use_name)
-
-    def _table_with_any_of_mutations(self, select_columns, only_item_id_in_table: Optional[Table], *mutations: Mutation):
-        """Returns a Table containing all the rows from the table regions containing one of the variants in
-        the argument mutations.
-        :param select_columns selects only the column names in this collection. If None, selects all the columns from regions.
-        :param only_item_id_in_table If None, the variants that are not owned by any of the individuals in this table
-        are discarded from the result.
+        self.my_region_t = None
+        if not self.region_attrs or not any([self.region_attrs.with_variants,
+                                             self.region_attrs.with_variants_in_reg,
+                                             self.region_attrs.without_variants]):
+            return
+        constraints = self._region_constraints()
+        if self.carriers_from_regions and any(estimate == 0 for _, _, estimate in constraints):
+            raise EmptyResult('TCGA')
+        if len(constraints) > 1:
+            constraints.sort(key=lambda constraint: constraint[2] if constraint[2] is not None
+                             else utils.estimated_rows(constraint[1](self.my_meta_t), self.connection))
+        item_ids = self.my_meta_t
+        for log_title, stmt_of_item_ids, _ in constraints:
+            result = self._create_table_as('item_ids', stmt_of_item_ids(item_ids), log_title)
+            if item_ids is not self.my_meta_t:
+                self._drop_table(item_ids)
+            item_ids = result
+        self.my_region_t = item_ids
+
+    def _region_constraints(self) -> List[Tuple[str, Callable[[FromClause], Selectable], Optional[int]]]:
         """
-        if len(mutations) == 0:
-            raise ValueError('function argument *mutations cannot be empty')
-        else:
-            # create table for the result
-            t_name = utils.random_t_name_w_prefix('with_any_of_mut')
-            columns = [regions.c[c_name] for c_name in select_columns] if select_columns is not None else [
-                regions]
-            stmt_as = self._stmt_where_region_is_any_of_mutations(*mutations,
-                                                                  from_table=regions,
-                                                                  select_expression=select(columns),
-                                                                  only_item_id_in_table=only_item_id_in_table)
-        stmt_create_table = utils.stmt_create_table_as(t_name, stmt_as, default_schema_to_use_name)
-        if self.log_sql_commands:
-            utils.show_stmt(self.connection, stmt_create_table, self.logger.debug,
-                            'CREATE TABLE HAVING ANY OF THE {} MUTATIONS'.format(len(mutations)))
-        self.connection.execute(stmt_create_table)
-        return Table(t_name, db_meta, autoload=True, autoload_with=self.connection,
-                     schema=default_schema_to_use_name)
-
-    def _table_without_any_of_mutations(self):
+        :return: for each region constraint in self.region_attrs, a title for the logs, a function building the
+        statement that selects the distinct item_id satisfying the constraint among the ones in a given table and an
+        estimate of the individuals of the population satisfying it (None if unknown).
         """
-        Returns a Table containing the item_id from the table genomes that do not match the given mutations.
-        :param select_columns selects only the column names in this collection. If None, selects all the columns from genomes.
+        constraints = []
+        if self.region_attrs.with_variants:
+            constraints.append((
+                'INDIVIDUALS HAVING ALL THE {} VARIANTS'.format(len(self.region_attrs.with_variants)),
+                lambda item_ids: self._stmt_item_ids_owning_mutations(
+                    self.region_attrs.with_variants, item_ids,
+                    lambda owned: func.count() == len(self.region_attrs.with_variants)
+                    if len(self.region_attrs.with_variants) > 1 else None),
+                selectivity.carriers_of_all(self, self.connection, self.meta_attrs, self.region_attrs.with_variants)))
+        if self.region_attrs.with_variants_in_reg:
+            constraints.append((
+                'INDIVIDUALS HAVING VARIANTS IN INTERVAL {} of types {}'.format(
+                    self.region_attrs.with_variants_in_reg, self.region_attrs.with_variants_of_type),
+                self._stmt_item_ids_with_variants_in_interval_or_type,
+                None))
+        if self.region_attrs.without_variants:
+            constraints.append((
+                'INDIVIDUALS WITHOUT ANY OF THE {} VARIANTS'.format(len(self.region_attrs.without_variants)),
+                lambda item_ids: except_(
+                    select([item_ids.c.item_id]),
+                    self._stmt_where_region_is_any_of_mutations(*self.region_attrs.without_variants,
+                                                                from_table=regions,
+                                                                select_expression=select([regions.c.item_id]),
+                                                                only_item_id_in_table=item_ids)),
+                selectivity.population_size(self, self.connection, self.meta_attrs)))
+        return constraints
+
+    def _stmt_item_ids_owning_mutations(self, mutations: List[Mutation], only_item_id_in_table: FromClause,
+                                        having: Callable[[FromClause], Optional[ClauseElement]]) -> Selectable:
         """
-        mutations = self.region_attrs.without_variants
-        if len(mutations) == 0:
-            raise ValueError('function argument *mutations cannot be empty')
-        else:
-            # create table for the result
-            t_name = utils.random_t_name_w_prefix('without_any_of_mut')
-            query_mutations = self._stmt_where_region_is_any_of_mutations(*mutations,
-                                                                          from_table=regions,
-                                                                          select_expression=select([regions.c.item_id]),
-                                                                          only_item_id_in_table=self.my_meta_t)
-            stmt_as = except_(
-                select([self.my_meta_t.c.item_id]),
-                query_mutations
-            )
-            stmt_create_table = utils.stmt_create_table_as(t_name, stmt_as, default_schema_to_use_name)
-            if self.log_sql_commands:
-                utils.show_stmt(self.connection, stmt_create_table, self.logger.debug,
-                                'CREATE TABLE WITHOUT ANY OF THE {} MUTATIONS'.format(len(mutations)))
-            self.connection.execute(stmt_create_table)
-            return Table(t_name, db_meta, autoload=True, autoload_with=self.connection,
-                         schema=default_schema_to_use_name)
-
-    def view_of_variants_in_interval_or_type(self, select_columns: Optional[list]):
-        if self.region_attrs.with_variants_in_reg is None and self.region_attrs.with_variants_of_type is None:
-            raise ValueError('you called this method without giving any selection criteria')
-        columns = [regions.c[c_name] for c_name in select_columns] if select_columns is not None else [regions]
-        stmt_as = select(columns)
-        if self.region_attrs.with_variants_in_reg is not None:
-            stmt_as = stmt_as.where((regions.c.chrom == self.region_attrs.with_variants_in_reg.chrom) &
-                                    (regions.c.start >= self.region_attrs.with_variants_in_reg.start) &
-                                    (regions.c.start <= self.region_attrs.with_variants_in_reg.stop))
+        :param having: given the relation of the variants owned by the individuals (column item_id), returns
+        the condition that the variants of an individual must satisfy (None if owning any of them is enough).
+        :return: the statement selecting the distinct item_id of the individuals in only_item_id_in_table owning any of
+        the given mutations and satisfying the having condition.
+        """
+        owned = self._stmt_where_region_is_any_of_mutations(
+            *mutations,
+            from_table=regions,
+            select_expression=select([regions.c.item_id]),
+            only_item_id_in_table=only_item_id_in_table).alias('owned_variants')
+        stmt = select([owned.c.item_id]).group_by(owned.c.item_id)
+        condition = having(owned)
+        if condition is not None:
+            stmt = stmt.having(condition)
+        return stmt
+
+    def _stmt_item_ids_with_variants_in_interval_or_type(self, only_item_id_in_table: FromClause) -> Selectable:
+        stmt = select([regions.c.item_id]).distinct() \
+            .where((regions.c.chrom == self.region_attrs.with_variants_in_reg.chrom) &
+                   (regions.c.start >= self.region_attrs.with_variants_in_reg.start) &
+                   (regions.c.start <= self.region_attrs.with_variants_in_reg.stop)) \
+            .where(regions.c.item_id.in_(select([only_item_id_in_table.c.item_id])))
         if self.region_attrs.with_variants_of_type is not None:
-            stmt_as = stmt_as.where(regions.c.mut_type.in_(self.region_attrs.with_variants_of_type))
-        generated_view_name = utils.random_t_name_w_prefix('mut_of_type_interval')
-        stmt = utils.stmt_create_view_as(generated_view_name, stmt_as, default_schema_to_use_name)
-        if self.log_sql_commands:
-            utils.show_stmt(self.connection, stmt, self.logger.debug,
-                            'VIEW OF REGIONS IN INTERVAL {} of types {}'.format(self.region_attrs.with_variants_in_reg,
-                                                                                self.region_attrs.with_variants_of_type))
-        self.connection.execute(stmt)
-        return Table(generated_view_name, db_meta, autoload=True, autoload_with=self.connection,
-                     schema=default_schema_to_use_name)
+            stmt = stmt.where(regions.c.mut_type.in_(self.region_attrs.with_variants_of_type))
+        return stmt
 
     def variants_in_region(self, connection: Connection, genomic_interval: GenomicInterval,
                            output_region_attrs: List[Vocabulary], meta_attrs: MetadataAttrs,
@@ -608,7 +701,7 @@ class TCGA(Source):
         self._set_meta_attributes(meta_attrs)
         self.create_table_of_meta(['item_id'])
         self._set_region_attributes(region_attrs)
-        self.create_table_of_regions(['item_id'])
+        self.create_table_of_regions()
 
         if self.my_region_t is not None:
             only_from_samples = intersect(select([self.my_meta_t.c.item_id]), select([self.my_region_t.c.item_id]))
@@ -627,56 +720,31 @@ class TCGA(Source):
                    (regions.c.chrom == genomic_interval.chrom))
 
         if self.log_sql_commands:
-            utils.show_stmt(connection, stmt, self.logger.debug, f'TCGA: VARIANTS IN REGION '
+            utils.show_stmt(connection, stmt, self.sql_logger, f'TCGA: VARIANTS IN REGION '
                                                                  f'{genomic_interval.chrom}'
                                                                  f'-{genomic_interval.start}-{genomic_interval.stop}')
         return stmt
 
-    def take_regions_of_common_individuals(self, tables: list):
-        """
-        Generates a table containing all the mutations from all the origin tables but only for those individuals that
-        appear in all the origin tables.
-        Supposing that each origin table reflects a characteristic that the final sample set must have, this method
-        basically puts those characteristics in AND relationship by taking only the regions from the individuals that
-        have all the characteristics.
-        :param tables: The source tables which must have the same columns in the same order.
-        """
-        if len(tables) == 1:
-            return tables[0]
-        else:
-            # join 1st with 2nd with 3rd ... with nth on item_id
-            # TODO consider creating temporary tables selecting only the item_id before joining
-            stmt_join = reduce(
-                lambda table_1, table_2: table_1.join(table_2, tables[0].c.item_id == table_2.c.item_id),
-                tables)
-            # union of tables
-            select_all_from_each_table = map(lambda table_: select([table_]), tables)
-            # TODO consider selecting from union table only what is needed by the users of this method (parametric choice)
-            stmt_union = union(*select_all_from_each_table).alias()
-            # select from the union table only the item_id that exists in the join
-            stmt_as = \
-                select([stmt_union]) \
-                .where(exists(select()
-                              .select_from(stmt_join)
-                              .where(stmt_union.c.item_id == tables[0].c.item_id)
-                              ))
-            target_t_name = utils.random_t_name_w_prefix('intersect')
-            stmt_create_table = utils.stmt_create_table_as(target_t_name, stmt_as, default_schema_to_use_name)
-            if self.log_sql_commands:
-                utils.show_stmt(self.connection, stmt_create_table, self.logger.debug,
-                                'SELECT ALL FROM SOURCE TABLES WHERE item_id IS IN ALL SOURCE TABLES')
-            self.connection.execute(stmt_create_table)
-            # TODO drop partial tables ?
-            return Table(target_t_name, db_meta, autoload=True, autoload_with=self.connection,
-                         schema=default_schema_to_use_name)
-
     def get_variant_details(self, connection: Connection, variant: Mutation, which_details: List[Vocabulary],
                             assembly) -> list:
         self.connection = connection
+        stmt = self._stmt_variant_details(variant, which_details, assembly)
+        result = utils.execute_prepared(connection, 'variant_details', stmt, self.log_sql_commands, self.sql_logger)
+        if result.rowcount == 0:
+            return list()
+        else:
+            if result.rowcount > 1:
+                self.logger.error(f'user searched for variant: {str(variant)}, but two results were found')
+            final_result = result.fetchone().values()
+            result.close()
+            return final_result
+
+    @classmethod
+    def _stmt_variant_details(cls, variant: Mutation, which_details: List[Vocabulary], assembly) -> Selectable:
         global regions
         select_columns = []
         for att in which_details:
-            mapping = self.region_col_map.get(att)
+            mapping = cls.region_col_map.get(att)
             if mapping is not None:
                 select_columns.append(regions.c[mapping].label(att.name))
             else:
@@ -694,14 +762,4 @@ class TCGA(Source):
                         select([metadata.c.item_id])
                         .where(metadata.c.assembly == assembly)
                     ))
-        if self.log_sql_commands:
-            utils.show_stmt(connection, stmt, self.logger.debug, 'GET VARIANT DETAILS')
-        result = connection.execute(stmt)
-        if result.rowcount == 0:
-            return list()
-        else:
-            if result.rowcount > 1:
-                self.logger.error(f'user searched for variant: {str(variant)}, but two results were found')
-            final_result = result.fetchone().values()
-            result.close()
-            return final_result
+        return stmt
@@ -0,0 +1,180 @@
+"""
+Estimates the execution time of the requests from the history of the requests actually executed.
+Each executed request is stored in a local SQLite database together with a few features describing it (population size,
+region constraints, width of the genomic interval, sources and assembly). A linear model for each kind of operation is
+periodically fitted on that history and replaces the constant estimates hard-coded in the sources, when enough history
+is available.
+"""
+from data_sources.io_parameters import *
+from monitoring import metrics
+from typing import Dict, List, Sequence, Tuple
+from threading import RLock
+from loguru import logger
+import numpy
+import sqlite3
+import math
+import time
+
+HISTORY_DB_PATH = './execution_history.sqlite3'
+MIN_RECORDS_FOR_FIT = 20    # below this number of recorded executions, the estimator doesn't make predictions
+MAX_RECORDS_FOR_FIT = 5000  # only the most recent executions are used to fit the model
+REFIT_AFTER_RECORDS = 25    # the model of an operation is refitted after this number of new executions...
+REFIT_AFTER_SECONDS = 3600  # ...or after this number of seconds
+RIDGE_PENALTY = 1e-3
+
+
+class ExecutionFeatures:
+    """
+    The characteristics of a request that are relevant to predict its execution time.
+    """
+    def __init__(self, operation: str, assembly: Optional[str], sources: Sequence[str], population_size: Optional[int],
+                 num_region_constraints: int, interval_width: int):
+        self.operation = operation
+        self.assembly = assembly
+        self.sources = sorted(sources)
+        self.population_size = population_size
+        self.num_region_constraints = num_region_constraints
+        self.interval_width = interval_width
+
+    @classmethod
+    def of_request(cls, operation: str, meta_attrs: Optional[MetadataAttrs], region_attrs: Optional[RegionAttrs],
+                   sources: Sequence[str], population_size: Optional[int] = None,
+                   genomic_interval: Optional[GenomicInterval] = None):
+        num_region_constraints = 0
+        interval_width = 0
+        if region_attrs is not None:
+            for variants in [region_attrs.with_variants, region_attrs.with_variants_same_c_copy,
+                             region_attrs.with_variants_diff_c_copy, region_attrs.without_variants]:
+                num_region_constraints += len(variants) if variants else 0
+            if region_attrs.with_variants_in_reg is not None:
+                num_region_constraints += 1
+                interval_width += region_attrs.with_variants_in_reg.stop - region_attrs.with_variants_in_reg.start
+            elif region_attrs.with_variants_in_gene is not None:
+                num_region_constraints += 1
+        if genomic_interval is not None:
+            interval_width += genomic_interval.stop - genomic_interval.start
+        assembly = meta_attrs.assembly if meta_attrs is not None else None
+        return cls(operation, assembly, sources, population_size, num_region_constraints, interval_width)
+
+    def as_vector(self, default_population_size: float) -> List[float]:
+        population_size = self.population_size if self.population_size is not None else default_population_size
+        # germline variants are ~4 millions per individual, somatic mutations are few hundreds: the cost per individual
+        # depends a lot on the presence of 1000Genomes among the sources
+        with_germline_variants = 1.0 if '1000Genomes' in self.sources else 0.0
+        return [
+            1.0,
+            float(population_size),
+            float(population_size) * with_germline_variants,
+            float(self.num_region_constraints),
+            math.log1p(self.interval_width),
+            float(len(self.sources)),
+            1.0 if self.assembly == 'hg19' else 0.0
+        ]
+
+
+class _LinearModel:
+    def __init__(self, coefficients: numpy.ndarray, mean_population_size: float, num_records: int):
+        self.coefficients = coefficients
+        self.mean_population_size = mean_population_size
+        self.num_records = num_records
+        self.fitted_at = time.time()
+
+    def predict(self, features: ExecutionFeatures) -> float:
+        x = numpy.array(features.as_vector(self.mean_population_size))
+        return max(0.0, float(x @ self.coefficients))
+
+
+class TimeEstimator:
+
+    def __init__(self, history_db_path: str):
+        self.history_db_path = history_db_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = RLock()
+        self._models: Dict[str, _LinearModel] = {}
+        self._new_records: Dict[str, int] = {}
+        # operations without enough history -> (number of their records, time of the last fit)
+        self._insufficient_history: Dict[str, Tuple[int, float]] = {}
+
+    def _history(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.history_db_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS execution ('
+                             'recorded_at REAL, operation TEXT, assembly TEXT, sources TEXT, population_size INTEGER, '
+                             'num_region_constraints INTEGER, interval_width INTEGER, duration REAL, estimate REAL)')
+            self._db.commit()
+        return self._db
+
+    def record(self, features: ExecutionFeatures, duration_seconds: float):
+        """
+        Stores the actual execution time of a request and reports the error of the current model, if any.
+        """
+        # noinspection PyBroadException
+        try:
+            estimate = self.estimate(features)
+            if estimate is not None:
+                metrics.TIME_ESTIMATE_ERROR.observe(abs(estimate - duration_seconds), operation=features.operation)
+            with self._lock:
+                db = self._history()
+                db.execute('INSERT INTO execution VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (time.time(), features.operation, features.assembly, ','.join(features.sources),
+                            features.population_size, features.num_region_constraints, features.interval_width,
+                            duration_seconds, estimate))
+                db.commit()
+                self._new_records[features.operation] = self._new_records.get(features.operation, 0) + 1
+        except Exception:
+            # the history is an optimization: never fail a request because of it
+            logger.exception('unable to record the execution time of the request')
+
+    def estimate(self, features: ExecutionFeatures) -> Optional[float]:
+        """
+        :return: the estimated execution time in seconds of a request having the given features, or None if the
+        history of the same operation is not sufficient yet.
+        """
+        with self._lock:
+            if self._needs_fit(features.operation):
+                model = self._fit(features.operation)
+            else:
+                model = self._models.get(features.operation)
+        return model.predict(features) if model is not None else None
+
+    def _needs_fit(self, operation: str) -> bool:
+        new_records = self._new_records.get(operation, 0)
+        model = self._models.get(operation)
+        if model is not None:
+            return new_records >= REFIT_AFTER_RECORDS or time.time() - model.fitted_at > REFIT_AFTER_SECONDS
+        insufficient_history = self._insufficient_history.get(operation)
+        if insufficient_history is None:
+            return True
+        # without a model, the history is read again only once it may be sufficient
+        num_records, fitted_at = insufficient_history
+        return num_records + new_records >= MIN_RECORDS_FOR_FIT or time.time() - fitted_at > REFIT_AFTER_SECONDS
+
+    def _fit(self, operation: str) -> Optional[_LinearModel]:
+        rows = self._history().execute('SELECT assembly, sources, population_size, num_region_constraints, '
+                                       'interval_width, duration FROM execution WHERE operation = ? '
+                                       'ORDER BY recorded_at DESC LIMIT ?', (operation, MAX_RECORDS_FOR_FIT)).fetchall()
+        self._new_records[operation] = 0
+        if len(rows) < MIN_RECORDS_FOR_FIT:
+            self._models.pop(operation, None)
+            self._insufficient_history[operation] = (len(rows), time.time())
+            return None
+        self._insufficient_history.pop(operation, None)
+        known_population_sizes = [row[2] for row in rows if row[2] is not None]
+        mean_population_size = sum(known_population_sizes) / len(known_population_sizes) if known_population_sizes else 0
+        x = numpy.array([
+            ExecutionFeatures(operation, row[0], row[1].split(',') if row[1] else [], row[2], row[3], row[4])
+            .as_vector(mean_population_size)
+            for row in rows])
+        y = numpy.array([row[5] for row in rows])
+        # ridge regression: a small penalty keeps the system solvable when a feature is constant in the history
+        penalty = RIDGE_PENALTY * numpy.eye(x.shape[1])
+        penalty[0, 0] = 0   # the intercept is not penalized
+        coefficients = numpy.linalg.solve(x.T @ x + penalty, x.T @ y)
+        model = _LinearModel(coefficients, mean_population_size, len(rows))
+        self._models[operation] = model
+        metrics.TIME_ESTIMATE_FITTED_RECORDS.set(len(rows), operation=operation)
+        logger.debug(f'time estimate model for {operation} refitted on {len(rows)} executions')
+        return model
+
+
+estimator = TimeEstimator(HISTORY_DB_PATH)
@@ -0,0 +1,123 @@
+"""
+In-memory catalogs of the values available for the attributes of each source, together with the number of
+individuals (or annotations) having each value in each assembly. The catalog of a source is built from a single
+grouping query over all its attributes (see Source.value_catalog_stmt), so /values is answered from memory.
+Catalogs are rebuilt in background when the data version (database.data_version) changes; meanwhile, the previous
+catalog keeps being served.
+"""
+from data_sources.io_parameters import Vocabulary
+from sqlalchemy.engine import Connection
+from database import data_version
+import database.database as database
+from threading import Lock, Thread
+from typing import Any, Dict, Iterable, List, Optional
+from loguru import logger
+import time
+
+# name of the column counting the individuals of each group in the statements of the sources
+COUNT_COLUMN = Vocabulary.COUNT.name
+
+_lock = Lock()
+_catalogs: Dict[str, 'ValueCatalog'] = {}
+# names of the sources whose catalog is being built
+_building = set()
+
+
+class ValueCatalog:
+
+    def __init__(self, source_name: str, version: int):
+        self.source_name = source_name
+        self.version = version
+        self.built_at = time.time()
+        # attribute -> value -> assembly -> count
+        self._counts: Dict[Vocabulary, Dict[Any, Dict[Optional[str], int]]] = {}
+
+    def add(self, attribute: Vocabulary, value, assembly: Optional[str], count: int):
+        if value is None or value == '':
+            return
+        of_value = self._counts.setdefault(attribute, {}).setdefault(value, {})
+        of_value[assembly] = of_value.get(assembly, 0) + count
+
+    def attributes(self) -> List[Vocabulary]:
+        return list(self._counts.keys())
+
+    def values(self, attribute: Vocabulary) -> Optional[List]:
+        """
+        :return: the values of attribute (in any assembly), or None if the attribute is not in the catalog.
+        """
+        of_attribute = self._counts.get(attribute)
+        return list(of_attribute.keys()) if of_attribute is not None else None
+
+    def count(self, attribute: Vocabulary, value, assembly: Optional[str] = None) -> int:
+        """
+        :return: the number of individuals having value for attribute, in the given assembly or in any of them.
+        """
+        of_value = self._counts.get(attribute, {}).get(value, {})
+        if assembly is None:
+            return sum(of_value.values())
+        return of_value.get(assembly, 0)
+
+
+def _build(source_obj, connection: Connection, version: int) -> ValueCatalog:
+    start_time = time.time()
+    catalog = ValueCatalog(source_obj.pretty_name(), version)
+    result_proxy = connection.execute(source_obj.value_catalog_stmt(connection))
+    attributes = [Vocabulary[name] for name in result_proxy.keys() if name != COUNT_COLUMN]
+    for row in result_proxy:
+        assembly = row[Vocabulary.ASSEMBLY.name] if Vocabulary.ASSEMBLY in attributes else None
+        for attribute in attributes:
+            catalog.add(attribute, row[attribute.name], assembly, row[COUNT_COLUMN])
+    logger.info(f'catalog of values of {catalog.source_name} built in {round(time.time() - start_time, 2)} s '
+                f'(data version {version})')
+    return catalog
+
+
+def _rebuild_in_background(source_obj, version: int):
+    def rebuild():
+        try:
+            catalog = database.try_py_function(lambda connection: _build(source_obj, connection, version))
+            with _lock:
+                _catalogs[catalog.source_name] = catalog
+        except Exception:
+            logger.exception(f'unable to rebuild the catalog of values of {source_obj.pretty_name()}')
+        finally:
+            with _lock:
+                _building.discard(source_obj.pretty_name())
+
+    Thread(target=rebuild, name=f'value-catalog-{source_obj.pretty_name()}', daemon=True).start()
+
+
+def of(source_obj, connection: Connection) -> ValueCatalog:
+    """
+    Returns the catalog of values of source_obj (an instance of Source or AnnotInterface). The catalog is built with
+    the given connection only the first time; if the data version changed since then, the current catalog is returned
+    while the new one is built in background.
+    """
+    source_name = source_obj.pretty_name()
+    version = data_version.current()
+    with _lock:
+        catalog = _catalogs.get(source_name)
+        if catalog is not None:
+            if catalog.version != version and source_name not in _building:
+                _building.add(source_name)
+                _rebuild_in_background(source_obj, version)
+            return catalog
+    catalog = _build(source_obj, connection, version)
+    with _lock:
+        _catalogs.setdefault(source_name, catalog)
+        return _catalogs[source_name]
+
+
+def warm_up(source_classes: Iterable[type]):
+    """
+    Builds in background the catalogs of the given classes of sources, so that the first requests don't wait for them.
+    """
+    def build_all():
+        for source_class in source_classes:
+            try:
+                source_obj = source_class(logger)
+                database.try_py_function(lambda connection: of(source_obj, connection))
+            except Exception:
+                logger.exception(f'unable to build the catalog of values of {source_class.pretty_name()}')
+
+    Thread(target=build_all, name='value-catalog-warm-up', daemon=True).start()
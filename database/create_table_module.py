@@ -12,5 +12,5 @@ class CreateTableAs(Executable, ClauseElement):
 def visit_create_table_as(element, compiler, **kw):
     return "CREATE TABLE %s AS %s" % (
         element.name,
-        compiler.process(element.select, literal_binds=True)
+        compiler.process(element.select, **kw)
     )
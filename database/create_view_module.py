@@ -12,5 +12,5 @@ class CreateView(Executable, ClauseElement):
 def visit_create_view(element, compiler, **kw):
     return "CREATE VIEW %s AS %s" % (
         element.name,
-        compiler.process(element.select, literal_binds=True)
+        compiler.process(element.select, **kw)
     )
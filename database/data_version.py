@@ -0,0 +1,58 @@
+"""
+Token identifying the version of the data in the database. Every procedure changing the data (e.g. the load of new
+samples followed by the refresh of the precomputed counts) bumps it, so that anything derived from the data and kept
+in memory or by the clients can be invalidated by comparing tokens.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from threading import Lock
+from typing import Optional
+from database import database
+import time
+
+schema_name = 'rr'
+table_name = 'varsum_data_version'
+# seconds during which the token read from the database is reused
+CACHE_PERIOD = 10
+
+_lock = Lock()
+_cached_version: Optional[int] = None
+_cached_at: float = 0
+
+
+def bump(connection: Connection) -> int:
+    """
+    Increments the version of the data, as part of the transaction of connection (if any).
+    :return: the new version
+    """
+    global _cached_version
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS {schema_name}.{table_name} ('
+                            f'version bigint NOT NULL, updated timestamp with time zone NOT NULL)'))
+    version = connection.execute(text(f'UPDATE {schema_name}.{table_name} SET version = version + 1, updated = now() '
+                                      f'RETURNING version')).scalar()
+    if version is None:
+        version = 1
+        connection.execute(text(f'INSERT INTO {schema_name}.{table_name} VALUES (1, now())'))
+    with _lock:
+        _cached_version = None
+    return version
+
+
+def current() -> int:
+    """
+    :return: the version of the data (0 if it has never been bumped). The value can be up to CACHE_PERIOD seconds old.
+    """
+    global _cached_version, _cached_at
+    with _lock:
+        if _cached_version is not None and time.time() - _cached_at < CACHE_PERIOD:
+            return _cached_version
+
+    def read(connection: Connection) -> int:
+        if not connection.dialect.has_table(connection, table_name, schema=schema_name):
+            return 0
+        return connection.execute(text(f'SELECT version FROM {schema_name}.{table_name}')).scalar() or 0
+
+    version = database.try_py_function(read)
+    with _lock:
+        _cached_version, _cached_at = version, time.time()
+    return version
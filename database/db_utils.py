@@ -1,8 +1,16 @@
-from sqlalchemy import Table, text, select
+from sqlalchemy import Table, text, select, bindparam, column
 from sqlalchemy.engine import ResultProxy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import FromClause
+from sqlalchemy.types import TypeDecorator, TypeEngine
+from typing import List, Sequence, Tuple
 from prettytable import PrettyTable
-from database import create_view_module, create_table_module
+from database import create_view_module, create_table_module, explain_module
+from monitoring import metrics
 from datetime import datetime
+import itertools
+import hashlib
+import re
 
 
 # EXECUTORS
@@ -21,15 +29,84 @@ def exec_raw_query(query_string, connection, log_sql_statement: bool, log_functi
     return connection.execute(_query)
 
 
+def explain(stmt, connection, log_sql_statement: bool, log_function) -> dict:
+    """
+    Asks the query planner for the execution plan of stmt without executing it.
+    :return: the plan of the statement as returned by EXPLAIN (FORMAT JSON), i.e. a dictionary whose key "Plan" holds
+    the root node of the plan with the estimated rows ("Plan Rows") and cost ("Total Cost").
+    """
+    explain_stmt = explain_module.Explain(stmt)
+    if log_sql_statement:
+        show_stmt(connection, explain_stmt, log_function, 'EXPLAIN QUERY')
+    plan = connection.execute(explain_stmt).scalar()
+    return plan[0]
+
+
+def estimated_rows(stmt, connection) -> float:
+    """
+    :return: the number of rows returned by stmt, as estimated by the query planner
+    """
+    return explain(stmt, connection, False, None)['Plan']['Plan Rows']
+
+
 def drop_view(name: str, from_schema: str, connection, log_sql_stmt: bool, log_function):
     exec_raw_query('DROP VIEW "' + from_schema + '".' + name, connection, log_sql_stmt, log_function)
 
 
 def create_table_as(name: str, select_stmt, into_schema, connection, log_sql_stmt: bool, log_function):
-    compiled_select = select_stmt.compile(compile_kwargs={"literal_binds": True},
-                                          dialect=connection.dialect)
-    stmt = 'CREATE TABLE "' + into_schema + '".' + name + ' AS ' + str(compiled_select)
-    exec_raw_query(stmt, connection, log_sql_stmt, log_function)
+    stmt = stmt_create_table_as(name, select_stmt, into_schema)
+    if log_sql_stmt:
+        show_stmt(connection, stmt, log_function, 'CREATE TABLE AS')
+    connection.execute(stmt)
+    metrics.TEMP_OBJECTS_CREATED.inc(kind='table')
+
+
+_PYFORMAT_PARAMETER = re.compile(r'%\((\w+)\)s')
+
+
+def prepare_stmt(connection, name: str, stmt) -> Tuple[str, dict]:
+    """
+    Prepares stmt as a server-side statement of the session of connection, so that the plan of frequently repeated
+    statements (differing only in the values of their parameters) is cached by the database. The statement is prepared
+    once for each database connection and each shape of stmt (the SQL text with placeholders in place of the values).
+    :param name: a prefix of the name of the prepared statement
+    :return: the EXECUTE statement running the prepared statement and the values of its parameters
+    """
+    compiled_stmt = stmt.compile(dialect=connection.dialect)
+    parameter_names = []
+
+    def to_positional(match) -> str:
+        parameter_names.append(match.group(1))
+        return '$' + str(len(parameter_names))
+
+    body = _PYFORMAT_PARAMETER.sub(to_positional, compiled_stmt.string).replace('%%', '%')
+    statement_name = name + '_' + hashlib.md5(body.encode('utf-8')).hexdigest()[:16]
+    # prepared statements live as long as the database session, i.e. the DBAPI connection held by the pool
+    prepared_statements = connection.info.setdefault('prepared_statements', set())
+    if statement_name not in prepared_statements:
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute('PREPARE ' + statement_name + ' AS ' + body)
+        finally:
+            cursor.close()
+        prepared_statements.add(statement_name)
+        metrics.PREPARED_STATEMENTS.inc(statement=name)
+    processors = compiled_stmt._bind_processors
+    values = {parameter: processors[parameter](value) if parameter in processors else value
+              for parameter, value in compiled_stmt.construct_params().items()}
+    arguments = ', '.join('%(' + parameter + ')s' for parameter in parameter_names)
+    return 'EXECUTE ' + statement_name + (' (' + arguments + ')' if arguments else ''), values
+
+
+def execute_prepared(connection, name: str, stmt, log_sql_statement: bool, log_function) -> ResultProxy:
+    """
+    Executes stmt as a prepared statement (see prepare_stmt).
+    :return: a sqlalchemy.engine.ResultProxy object
+    """
+    if log_sql_statement:
+        show_stmt(connection, stmt, log_function, 'EXECUTE PREPARED ' + name.upper())
+    execute_stmt, values = prepare_stmt(connection, name, stmt)
+    return connection.execute(execute_stmt, values)
 
 
 # VISUALIZE RESULTS AND QUERIES
@@ -46,8 +123,10 @@ def show_stmt(connection, stmt, log_function, intro):
     # #substitued by instr below
     if intro is not None:
         log_function('###   ' + intro + '   ###')
-    compiled_stmt = stmt.compile(compile_kwargs={"literal_binds": True}, dialect=connection.dialect)
+    compiled_stmt = stmt.compile(dialect=connection.dialect)
     log_function(str(compiled_stmt))
+    if compiled_stmt.params:
+        log_function('PARAMETERS ' + str(compiled_stmt.params))
 
 
 def print_table_named(connection, db_meta, table_name: str, table_schema: str):
@@ -76,6 +155,43 @@ def stmt_create_table_as(name: str, select_stmt, into_schema):
     return create_table_module.CreateTableAs('"' + into_schema + '".' + name, select_stmt)
 
 
+# RELATIONS FROM PARAMETERS
+class _ArrayParameter(TypeDecorator):
+    """
+    A PostgreSQL array bound as a single parameter. In the statements compiled with literal_binds, it is rendered as an
+    ARRAY literal of the given item type.
+    """
+    impl = postgresql.ARRAY
+
+    def process_literal_param(self, value, dialect):
+        item_type = self.impl.item_type
+        render_item = item_type.literal_processor(dialect) or str
+        return f'ARRAY[{", ".join(render_item(item) for item in value)}]::{item_type.compile(dialect=dialect)}[]'
+
+
+_relation_counter = itertools.count()
+
+
+def values_relation(name: str, columns: Sequence[Tuple[str, TypeEngine]], rows: List[tuple]) -> FromClause:
+    """
+    :param columns: the name and the type of each column of the relation
+    :param rows: the tuples of the relation, in the order of columns
+    :return: a relation holding the given rows, built as the unnest of one array parameter per column, so that the
+    text of the statement does not grow with the number of rows. The planner can join it with a table like any other
+    relation.
+    """
+    suffix = next(_relation_counter)
+    parameters = [bindparam(f'{name}_{column_name}_{suffix}', [row[idx] for row in rows],
+                            type_=_ArrayParameter(column_type))
+                  for idx, (column_name, column_type) in enumerate(columns)]
+    column_names = ', '.join(column_name for column_name, _ in columns)
+    return text(f'SELECT {column_names} '
+                f'FROM unnest({", ".join(":" + parameter.key for parameter in parameters)}) AS v({column_names})') \
+        .bindparams(*parameters) \
+        .columns(*[column(column_name, column_type) for column_name, column_type in columns]) \
+        .alias(name)
+
+
 # OTHER
 def random_t_name_w_prefix(prefix: str):
     return prefix + datetime.now().strftime('_%Y_%m_%d_%H_%M_%S_%f')
@@ -0,0 +1,14 @@
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Executable, ClauseElement
+
+
+class Explain(Executable, ClauseElement):
+    def __init__(self, select):
+        self.select = select
+
+
+@compiles(Explain)
+def visit_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) %s" % (
+        compiler.process(element.select, **kw)
+    )
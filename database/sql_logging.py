@@ -0,0 +1,43 @@
+"""
+Logging of the SQL statements built by the sources and by the coordinator. Statements are logged at the custom level
+SQL, lower than DEBUG, so the sinks of the server log never receive them. Rendering a statement is expensive, so the
+statements of a request are rendered only if the request is sampled, which requires the dedicated sink added by
+configure(). Without it, no statement is ever rendered.
+"""
+from loguru import logger
+from typing import Callable
+import random
+
+LEVEL = 'SQL'
+# between TRACE (5) and DEBUG (10)
+logger.level(LEVEL, no=7, color='<magenta>')
+
+_sample_rate = 0.0
+
+
+def configure(sink, sample_rate: float, **sink_options):
+    """
+    Adds the sink of the SQL statements. Records are written by a background thread, so logging a statement does not
+    wait for the file.
+    :param sample_rate: fraction of the requests whose statements are logged
+    :param sink_options: further options of loguru's logger.add (e.g. format, rotation)
+    """
+    global _sample_rate
+    logger.add(sink, level=LEVEL, filter=lambda record: record['level'].name == LEVEL, enqueue=True, **sink_options)
+    _sample_rate = sample_rate
+
+
+def sample() -> bool:
+    """
+    :return: True if the statements of a new request must be logged
+    """
+    return _sample_rate > 0 and random.random() < _sample_rate
+
+
+def log_function(request_logger) -> Callable[[str], None]:
+    """
+    :return: a function logging its argument at level SQL with the given logger (carrying the request id)
+    """
+    def log(message: str):
+        request_logger.opt(depth=1).log(LEVEL, message)
+    return log
@@ -1,17 +1,21 @@
 import sys
 import database.database as database
+from database import sql_logging
 from loguru import logger
 from sqlalchemy.exc import SAWarning
 import warnings
 
-wrong_arguments_message = 'The first program argument must be either "server" or "tests" followed by database username, ' \
-                          'password and port. Lastly, the severity level of the log messages to see on the console.'
+wrong_arguments_message = 'The first program argument must be either "server", "tests", "aggregates" or "refresh" ' \
+                          'followed by database username, password and port. Lastly, the severity level of the log ' \
+                          'messages to see on the console and, optionally, the fraction of requests whose SQL ' \
+                          'statements are logged (default 0).'
 try:
     run = sys.argv[1]
     db_user = sys.argv[2]
     db_password = sys.argv[3]
     db_port = sys.argv[4]
     output_log_lvl = sys.argv[5]
+    sql_sample_rate = float(sys.argv[6]) if len(sys.argv) > 6 else 0.0
 except Exception:
     logger.error(wrong_arguments_message)
     sys.exit(1)
@@ -27,17 +31,27 @@ logger.add(sys.stderr,
            colorize=True,
            backtrace=True,
            diagnose=True)
-# log to file any message of any security level
+# log to file any message from level DEBUG, written by a background thread
 logger.add("./logs/log_{time}.log",
-           level='TRACE',
+           level='DEBUG',
            rotation='100 MB',
            format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
                   "<blue>{extra[request_id]}</blue> | "
                   "<level>{level: <8}</level> | "
                   "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
            colorize=False,
+           enqueue=True,
            backtrace=True,
            diagnose=True)
+# log to a separate file the SQL statements of a sample of the requests
+if sql_sample_rate > 0:
+    sql_logging.configure("./logs/sql_{time}.log",
+                          sql_sample_rate,
+                          rotation='100 MB',
+                          format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {extra[request_id]} | {function} - {message}",
+                          colorize=False,
+                          backtrace=False,
+                          diagnose=False)
 logger.configure(
     extra={
         'request_id': 'default'
@@ -58,5 +72,15 @@ if __name__ == '__main__':
 
         # noinspection PyUnresolvedReferences
         import tests.tests                              # this runs anything is in the tests.py module
+    elif run == 'aggregates':
+        database.config_db_engine_for_tests(db_user, db_password, db_port)
+        from data_sources.kgenomes import aggregates
+
+        aggregates.build()
+    elif run == 'refresh':
+        database.config_db_engine_for_tests(db_user, db_password, db_port)
+        from data_sources.kgenomes import aggregates
+
+        aggregates.refresh()
     else:
         logger.critical(wrong_arguments_message)
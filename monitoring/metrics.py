@@ -0,0 +1,259 @@
+"""
+In-process collection of the operational metrics of VarSum. Metrics are kept in memory (one registry per process) and
+rendered in the Prometheus text exposition format by the endpoint /metrics, so that any scraper can use them for
+capacity planning and alerts. No external dependency is required.
+"""
+from threading import RLock
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import time
+
+# upper bounds (seconds) of the buckets of latency histograms; requests to this API last from milliseconds to ~1 hour
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# upper bounds of the buckets of histograms counting rows
+ROW_COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{_escape_label_value(extra[1])}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    """
+    Base class of all metrics. A metric has a name, a description and an optional list of label names. Each
+    combination of label values identifies a separate time series.
+    """
+    kind: str = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = RLock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels.keys()) != set(self.label_names):
+            raise ValueError(f'Metric {self.name} requires the labels {self.label_names}. Got {tuple(labels.keys())}')
+        return tuple(labels[name] for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Returns a list of (sample name, formatted labels, value)"""
+        raise NotImplementedError('Any subclass of Metric must implement the abstract method "samples"')
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for sample_name, labels, value in self.samples():
+            lines.append(f'{sample_name}{labels} {_format_number(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.label_names, key), value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down. The value of a Gauge without labels can also be computed at collection time by
+    a function given with set_function (e.g. to read the status of the connection pool only when requested).
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[tuple, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        if self.label_names:
+            raise ValueError('set_function can be used only with gauges without labels')
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            # noinspection PyBroadException
+            try:
+                return [(self.name, '', self._function())]
+            except Exception:
+                # the source of this value is not available (e.g. database engine not configured yet)
+                return []
+        with self._lock:
+            return [(self.name, _format_labels(self.label_names, key), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts: Dict[tuple, List[int]] = {}
+        self._sums: Dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+                self._sums[key] = 0
+            for idx, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[idx] += 1
+                    break
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds spent inside the with statement, even if the block raises an exception."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                cumulative = 0
+                for upper_bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    result.append((self.name + '_bucket',
+                                   _format_labels(self.label_names, key, ('le', _format_number(float(upper_bound)))),
+                                   cumulative))
+                result.append((self.name + '_count', _format_labels(self.label_names, key), cumulative))
+                result.append((self.name + '_sum', _format_labels(self.label_names, key), self._sums[key]))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = RLock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'A metric named {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = Registry()
+
+# API
+REQUEST_LATENCY = registry.histogram('varsum_request_duration_seconds',
+                                     'Time spent answering a request, by endpoint and HTTP status code.',
+                                     ['endpoint', 'status'])
+COALESCED_REQUESTS = registry.counter('varsum_coalesced_requests_total',
+                                      'Requests answered with the response of an identical concurrent request, '
+                                      'i.e. executions saved.',
+                                      ['endpoint'])
+ADMISSION_QUEUE_LENGTH = registry.gauge('varsum_admission_queue_length',
+                                        'Requests waiting to be admitted, by priority class.',
+                                        ['priority_class'])
+ADMISSION_WAIT = registry.histogram('varsum_admission_wait_seconds',
+                                    'Time spent by the admitted requests in the queue, by priority class.',
+                                    ['priority_class'])
+ADMISSION_RUNNING_COST = registry.gauge('varsum_admission_running_cost_seconds',
+                                        'Sum of the estimated costs of the requests in execution.')
+ADMISSION_REJECTIONS = registry.counter('varsum_admission_rejections_total',
+                                        'Requests rejected with status 429, by priority class and reason.',
+                                        ['priority_class', 'reason'])
+# COORDINATOR AND SOURCES
+SOURCE_QUERY_DURATION = registry.histogram('varsum_source_query_duration_seconds',
+                                           'Time spent by a source to prepare its part of the answer, including the '
+                                           'creation of intermediate tables.',
+                                           ['source', 'operation'])
+AGGREGATE_QUERY_DURATION = registry.histogram('varsum_aggregate_query_duration_seconds',
+                                              'Time spent executing the statement merging the output of the sources.',
+                                              ['operation'])
+ROWS_RETURNED = registry.histogram('varsum_rows_returned',
+                                   'Number of rows returned to the user.',
+                                   ['operation'],
+                                   buckets=ROW_COUNT_BUCKETS)
+PRIVACY_BLOCKS = registry.counter('varsum_privacy_blocks_total',
+                                  'Number of results removed because the selected population is smaller than the '
+                                  'minimum size allowed by the source.',
+                                  ['source', 'operation'])
+TIME_ESTIMATE_ERROR = registry.histogram('varsum_time_estimate_error_seconds',
+                                         'Absolute difference between the estimated and the actual execution time of '
+                                         'a request.',
+                                         ['operation'])
+TIME_ESTIMATE_FITTED_RECORDS = registry.gauge('varsum_time_estimate_fitted_records',
+                                              'Number of executions used to fit the time estimate model.',
+                                              ['operation'])
+# DATABASE
+TEMP_OBJECTS_CREATED = registry.counter('varsum_temp_objects_created_total',
+                                        'Number of tables and views created in the temporary schema.',
+                                        ['kind'])
+PREPARED_STATEMENTS = registry.counter('varsum_prepared_statements_total',
+                                       'Number of statements prepared in a database session.',
+                                       ['statement'])
+DB_RECONNECTS = registry.counter('varsum_db_reconnects_total',
+                                 'Number of times the connection pool was disposed after a DatabaseError.',
+                                 ['origin'])
+POOL_SIZE = registry.gauge('varsum_db_pool_size', 'Configured size of the database connection pool.')
+POOL_CHECKED_OUT = registry.gauge('varsum_db_pool_checked_out', 'Database connections currently in use.')
+POOL_OVERFLOW = registry.gauge('varsum_db_pool_overflow', 'Database connections open beyond the pool size.')
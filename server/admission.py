@@ -0,0 +1,238 @@
+"""
+Admission control of the requests. Before execution, every request is given a cost (its estimated execution time in
+seconds, see data_sources/time_estimator.py) and put in the queue of its priority class. Requests are admitted while
+the sum of the costs of the running requests stays within TOTAL_COST_BUDGET, choosing among the queues in proportion to
+their weights, so that a few heavy ranking requests cannot starve the cheap ones. Requests that cannot be admitted
+within MAX_QUEUE_WAIT seconds, or whose client already has too many requests in progress, are rejected with
+429 Too Many Requests and a Retry-After header.
+"""
+from data_sources.io_parameters import *
+from data_sources.coordinator import AskUserIntervention
+from data_sources.time_estimator import ExecutionFeatures
+import data_sources.time_estimator as time_estimator
+from monitoring import metrics
+from contextlib import contextmanager
+from threading import Condition
+from typing import Dict, Sequence
+import collections
+import math
+import time
+
+TOTAL_COST_BUDGET = 3600.0          # sum of the estimated seconds of work of the requests running at the same time
+MAX_CONCURRENT_PER_CLIENT = 4
+MAX_QUEUE_WAIT = 30.0               # seconds
+MAX_QUEUE_LENGTH = 100              # for each priority class
+MAX_RETRY_AFTER = 600               # seconds
+
+INTERACTIVE = 'interactive'
+AGGREGATE = 'aggregate'
+RANKING = 'ranking'
+PRIORITY_WEIGHTS = {
+    INTERACTIVE: 8,
+    AGGREGATE: 3,
+    RANKING: 1
+}
+PRIORITY_CLASS_OF_OPERATION = {
+    'values_of_attribute': INTERACTIVE,
+    'annotate': INTERACTIVE,
+    'variants_in_genomic_interval': INTERACTIVE,
+    'linkage_in_genomic_interval': AGGREGATE,
+    'donor_distribution': AGGREGATE,
+    'variant_distribution': AGGREGATE,
+    'variant_frequency_matrix': AGGREGATE,
+    'download_donors': AGGREGATE,
+    'population_items': AGGREGATE,
+    'rank_variants_by_freq': RANKING,
+    'differential_variants': RANKING,
+    'gene_burden': RANKING
+}
+# cost of the operations when the time estimator has not enough history yet
+FALLBACK_COST = {
+    'values_of_attribute': 0.5,
+    'annotate': 1,
+    'variants_in_genomic_interval': 5,
+    'linkage_in_genomic_interval': 10,
+    'donor_distribution': 10,
+    'variant_distribution': 10,
+    'variant_frequency_matrix': 30,
+    'download_donors': 10,
+    'population_items': 10,
+    'rank_variants_by_freq': 600,
+    'differential_variants': 1200,
+    'gene_burden': 1200
+}
+FALLBACK_COST_PER_INDIVIDUAL = 9    # seconds to rank the variants of one individual of 1000Genomes
+
+
+class AdmissionRejected(AskUserIntervention):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f'The server is busy ({reason}). Retry after {retry_after} seconds.', 429)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def estimate_cost(operation: str, meta_attrs: Optional[MetadataAttrs], region_attrs: Optional[RegionAttrs],
+                  sources: Sequence[str], population_size: Optional[int] = None) -> float:
+    learned_estimate = time_estimator.estimator.estimate(
+        ExecutionFeatures.of_request(operation, meta_attrs, region_attrs, sources, population_size))
+    if learned_estimate is not None:
+        return learned_estimate
+    elif population_size is not None and operation == 'rank_variants_by_freq':
+        return FALLBACK_COST_PER_INDIVIDUAL * population_size
+    else:
+        return FALLBACK_COST[operation]
+
+
+class Ticket:
+    """
+    The admission of a request. While the request executes, its cost can be revised with update_population_size as soon
+    as the size of the selected population is known.
+    """
+    def __init__(self, controller, operation: str, priority_class: str, client: str, cost: float,
+                 meta_attrs: Optional[MetadataAttrs], region_attrs: Optional[RegionAttrs], sources: Sequence[str],
+                 fixed_cost: bool):
+        self.controller = controller
+        self.operation = operation
+        self.priority_class = priority_class
+        self.client = client
+        self.cost = cost
+        self.meta_attrs = meta_attrs
+        self.region_attrs = region_attrs
+        self.sources = sources
+        self.fixed_cost = fixed_cost
+        self.enqueued_at = time.monotonic()
+
+    def update_population_size(self, population_size: int):
+        if not self.fixed_cost:
+            self.controller.update_cost(self, estimate_cost(self.operation, self.meta_attrs, self.region_attrs,
+                                                            self.sources, population_size))
+
+
+class AdmissionController:
+
+    def __init__(self, cost_budget: float, max_concurrent_per_client: int, max_queue_wait: float,
+                 max_queue_length: int, priority_weights: Dict[str, int]):
+        self.cost_budget = cost_budget
+        self.max_concurrent_per_client = max_concurrent_per_client
+        self.max_queue_wait = max_queue_wait
+        self.max_queue_length = max_queue_length
+        self.priority_weights = priority_weights
+        self._condition = Condition()
+        self._queues: Dict[str, collections.deque] = {name: collections.deque() for name in priority_weights}
+        # weighted fair queuing: each class accumulates cost/weight of the admitted requests; the class with the
+        # lowest virtual time is served first
+        self._virtual_time: Dict[str, float] = {name: 0.0 for name in priority_weights}
+        self._running_cost = 0.0
+        self._running_requests = 0
+        self._running_per_client: Dict[str, int] = collections.defaultdict(int)
+
+    @contextmanager
+    def admit(self, operation: str, client: str, meta_attrs: Optional[MetadataAttrs] = None,
+              region_attrs: Optional[RegionAttrs] = None, sources: Optional[Sequence[str]] = None,
+              lightweight: bool = False):
+        """
+        Blocks until the request can be executed and yields its Ticket; the resources of the request are released at
+        the end of the with statement.
+        :param lightweight: True for requests not executing the operation (dry-run or time estimates), which are
+        executed with a minimal cost in the interactive class.
+        :raise AdmissionRejected: if the request cannot be admitted
+        """
+        if lightweight:
+            priority_class = INTERACTIVE
+            cost = FALLBACK_COST['values_of_attribute']
+        else:
+            priority_class = PRIORITY_CLASS_OF_OPERATION[operation]
+            cost = estimate_cost(operation, meta_attrs, region_attrs, sources or [])
+        ticket = Ticket(self, operation, priority_class, client, min(cost, self.cost_budget), meta_attrs,
+                        region_attrs, sources or [], lightweight)
+        self._enter(ticket)
+        try:
+            yield ticket
+        finally:
+            self._leave(ticket)
+
+    def _enter(self, ticket: Ticket):
+        with self._condition:
+            if self._running_per_client.get(ticket.client, 0) >= self.max_concurrent_per_client:
+                self._reject(ticket, 'too many concurrent requests from the same client')
+            queue = self._queues[ticket.priority_class]
+            if len(queue) >= self.max_queue_length:
+                self._reject(ticket, 'queue full')
+            if not queue:
+                # a class that was idle doesn't accumulate credit over the active ones
+                active_classes_time = [self._virtual_time[name] for name, q in self._queues.items() if q]
+                self._virtual_time[ticket.priority_class] = max(self._virtual_time[ticket.priority_class],
+                                                                min(active_classes_time, default=0.0))
+            queue.append(ticket)
+            metrics.ADMISSION_QUEUE_LENGTH.set(len(queue), priority_class=ticket.priority_class)
+            deadline = ticket.enqueued_at + self.max_queue_wait
+            while not self._can_start(ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(ticket)
+                    metrics.ADMISSION_QUEUE_LENGTH.set(len(queue), priority_class=ticket.priority_class)
+                    self._condition.notify_all()
+                    self._reject(ticket, 'cost budget exhausted')
+                self._condition.wait(remaining)
+            queue.remove(ticket)
+            metrics.ADMISSION_QUEUE_LENGTH.set(len(queue), priority_class=ticket.priority_class)
+            metrics.ADMISSION_WAIT.observe(time.monotonic() - ticket.enqueued_at, priority_class=ticket.priority_class)
+            self._virtual_time[ticket.priority_class] += ticket.cost / self.priority_weights[ticket.priority_class]
+            self._running_cost += ticket.cost
+            self._running_requests += 1
+            self._running_per_client[ticket.client] += 1
+            metrics.ADMISSION_RUNNING_COST.set(self._running_cost)
+            # another queued request may fit in the remaining budget
+            self._condition.notify_all()
+
+    def _can_start(self, ticket: Ticket) -> bool:
+        """
+        Scans the head of the queues by increasing virtual time and admits the first request fitting the budget. A
+        head that has been waiting for more than half of MAX_QUEUE_WAIT reserves the budget for itself, so that cheap
+        requests cannot overtake an expensive one forever.
+        """
+        heads = [queue[0] for queue in self._queues.values() if queue]
+        heads.sort(key=lambda t: self._virtual_time[t.priority_class])
+        now = time.monotonic()
+        for head in heads:
+            if self._running_cost + head.cost <= self.cost_budget:
+                return head is ticket
+            elif now - head.enqueued_at > self.max_queue_wait / 2:
+                return False
+        return False
+
+    def _leave(self, ticket: Ticket):
+        with self._condition:
+            self._running_cost -= ticket.cost
+            self._running_requests -= 1
+            self._running_per_client[ticket.client] -= 1
+            if self._running_per_client[ticket.client] == 0:
+                del self._running_per_client[ticket.client]
+            metrics.ADMISSION_RUNNING_COST.set(self._running_cost)
+            self._condition.notify_all()
+
+    def update_cost(self, ticket: Ticket, new_cost: float):
+        """
+        Revises the cost of a running request. The request is already admitted and always completes: an increase
+        exceeding the budget only delays the admission of the queued requests until some budget is released.
+        """
+        with self._condition:
+            new_cost = min(new_cost, self.cost_budget)
+            self._running_cost += new_cost - ticket.cost
+            ticket.cost = new_cost
+            metrics.ADMISSION_RUNNING_COST.set(self._running_cost)
+            self._condition.notify_all()
+
+    def _reject(self, ticket: Ticket, reason: str):
+        metrics.ADMISSION_REJECTIONS.inc(priority_class=ticket.priority_class, reason=reason)
+        raise AdmissionRejected(reason, self._retry_after())
+
+    def _retry_after(self) -> int:
+        # the average cost of the running requests approximates the time after which some budget is released
+        if self._running_requests == 0:
+            return 1
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(self._running_cost / self._running_requests)))
+
+
+controller = AdmissionController(TOTAL_COST_BUDGET, MAX_CONCURRENT_PER_CLIENT, MAX_QUEUE_WAIT, MAX_QUEUE_LENGTH,
+                                 PRIORITY_WEIGHTS)
@@ -1,10 +1,17 @@
 import connexion
 from data_sources.io_parameters import *
-from flask import redirect
-from data_sources.coordinator import Coordinator, AskUserIntervention, NoDataFromSources, TimeEstimate
+from flask import redirect, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+from data_sources.coordinator import Coordinator, AskUserIntervention, NoDataFromSources, TimeEstimate, gen_var_sources, \
+    annot_sources
+from data_sources import value_catalog
+from server import admission, coalescing, http_cache, populations
+from server.admission import AdmissionRejected
+from monitoring import metrics as monitoring_metrics
 import sqlalchemy.exc
 from prettytable import PrettyTable
 from loguru import logger
+import time
 
 
 class ReqParamKeys:
@@ -58,9 +65,24 @@ class ReqParamKeys:
 
     GEN_VAR_SOURCES = 'source'
 
+    DRY_RUN = 'dry_run'
+
+    POPULATION_ID = 'population_id'
+
+    CASE = 'case'
+    CONTROL = 'control'
+    ORDER_BY = 'order_by'
+
+    VARIANT_LIST = 'variants'
+    OUT_FORMAT = 'format'
+
 
 connexion_app = connexion.App(__name__, specification_dir='./')  # internally it starts flask
 flask_app = connexion_app.app
+# number of reverse proxies in front of the server (it listens on localhost only) whose X-Forwarded-For is trusted
+TRUSTED_PROXIES = 1
+if TRUSTED_PROXIES > 0:
+    flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app, x_for=TRUSTED_PROXIES)
 base_path = '/popstudy/'
 api_doc_relative_path = 'api/ui/'
 request_incremental_index = 0   # used to identify every new request
@@ -69,6 +91,7 @@ request_incremental_index = 0   # used to identify every new request
 def run():
     # do this only after the declaration of the api endpoint handlers
     connexion_app.add_api('api_definition.yml')  # <- yml located inside the specification dir
+    value_catalog.warm_up(list(gen_var_sources.values()) + list(annot_sources.values()))
     connexion_app.run(host='localhost',
                       port=51992,
                       debug=True,
@@ -81,7 +104,10 @@ def donor_grouping(body):
     def go():
         req_logger.info(f'new request to /donor_distribution with request_body: {body}')
         params = prepare_body_parameters(body)
-        result = Coordinator(req_logger, params[8]).donor_distribution(params[2], params[0], params[1])
+        with admit('donor_distribution', params) as ticket:
+            result = Coordinator(req_logger, params[8], dry_run=params[10], population_items=params[11],
+                                 population_observer=ticket.update_population_size)\
+                .donor_distribution(params[2], params[0], params[1])
         return result
     req_logger = unique_logger()
     return try_and_catch(go, req_logger)
@@ -91,7 +117,25 @@ def variant_grouping(body):
     def go():
         req_logger.info(f'new request to /variant_distribution with request_body: {body}')
         params = prepare_body_parameters(body)
-        result = Coordinator(req_logger, params[8]).variant_distribution(params[2], params[0], params[1], params[3])
+        with admit('variant_distribution', params) as ticket:
+            result = Coordinator(req_logger, params[8], dry_run=params[10], population_items=params[11],
+                                 population_observer=ticket.update_population_size)\
+                .variant_distribution(params[2], params[0], params[1], params[3])
+        return result
+    req_logger = unique_logger()
+    return try_and_catch(go, req_logger)
+
+
+def variant_frequency_matrix(body):
+    def go():
+        req_logger.info(f'new request to /variant_frequency_matrix with {len(body[ReqParamKeys.VARIANT_LIST])} variants')
+        params = prepare_body_parameters(body)
+        variant_list = parse_to_mutation_array(body[ReqParamKeys.VARIANT_LIST])
+        with admit('variant_frequency_matrix', params) as ticket:
+            result = Coordinator(req_logger, params[8], dry_run=params[10], population_items=params[11],
+                                 population_observer=ticket.update_population_size)\
+                .variant_frequency_matrix(params[2], params[0], params[1], variant_list,
+                                          body.get(ReqParamKeys.OUT_FORMAT) or 'rows')
         return result
     req_logger = unique_logger()
     return try_and_catch(go, req_logger)
@@ -101,7 +145,10 @@ def most_common_variants(body):
     def go():
         req_logger.info(f'new request to /most_common_variants with request_body: {body}')
         params = prepare_body_parameters(body)
-        result = Coordinator(req_logger, params[8]).rank_variants_by_freq(params[0], params[1], False, params[6], params[5], params[9])
+        with admit('rank_variants_by_freq', params, lightweight=params[9]) as ticket:
+            result = Coordinator(req_logger, params[8], dry_run=params[10], population_items=params[11],
+                                 population_observer=ticket.update_population_size)\
+                .rank_variants_by_freq(params[0], params[1], False, params[6], params[5], params[9])
         return result
     req_logger = unique_logger()
     return try_and_catch(go, req_logger)
@@ -111,7 +158,46 @@ def rarest_variants(body):
     def go():
         req_logger.info(f'new request to /rarest_variants with request_body: {body}')
         params = prepare_body_parameters(body)
-        result = Coordinator(req_logger, params[8]).rank_variants_by_freq(params[0], params[1], True, params[4], params[5], params[9])
+        with admit('rank_variants_by_freq', params, lightweight=params[9]) as ticket:
+            result = Coordinator(req_logger, params[8], dry_run=params[10], population_items=params[11],
+                                 population_observer=ticket.update_population_size)\
+                .rank_variants_by_freq(params[0], params[1], True, params[4], params[5], params[9])
+        return result
+    req_logger = unique_logger()
+    return try_and_catch(go, req_logger)
+
+
+def differential_variants(body):
+    def go():
+        req_logger.info(f'new request to /differential_variants with request_body: {body}')
+        groups = []
+        for key in [ReqParamKeys.CASE, ReqParamKeys.CONTROL]:
+            if body[key].get(ReqParamKeys.POPULATION_ID) is not None:
+                raise AskUserIntervention(f'Parameter {ReqParamKeys.POPULATION_ID} is not supported by this '
+                                          f'endpoint. Please define the groups with "having_meta" and '
+                                          f'"having_variants".', 400)
+            group_params = prepare_body_parameters(body[key])
+            groups.extend([group_params[0], group_params[1]])
+        sources = body.get(ReqParamKeys.GEN_VAR_SOURCES)
+        dry_run = body.get(ReqParamKeys.DRY_RUN) or False
+        with admission.controller.admit('differential_variants', client_id(), groups[0], groups[1],
+                                        sources or list(gen_var_sources.keys()), dry_run):
+            result = Coordinator(req_logger, sources, dry_run=dry_run)\
+                .differential_variants(*groups, body.get(ReqParamKeys.ORDER_BY) or 'p_value',
+                                       body.get(ReqParamKeys.OUT_LIMIT))
+        return result
+    req_logger = unique_logger()
+    return try_and_catch(go, req_logger)
+
+
+def gene_burden(body):
+    def go():
+        req_logger.info(f'new request to /gene_burden with request_body: {body}')
+        params = prepare_body_parameters(body)
+        with admit('gene_burden', params) as ticket:
+            result = Coordinator(req_logger, params[8], dry_run=params[10], population_items=params[11],
+                                 population_observer=ticket.update_population_size)\
+                .gene_burden(params[0], params[1], body.get(ReqParamKeys.GENE_TYPE_IN_VALUES_ENDPOINT))
         return result
     req_logger = unique_logger()
     return try_and_catch(go, req_logger)
@@ -121,7 +207,10 @@ def download_donors(body):
     def go():
         req_logger.info(f'new request to /download_donors with request_body: {body}')
         params = prepare_body_parameters(body)
-        result = Coordinator(req_logger, params[8]).download_donors(params[0], params[1])
+        with admit('download_donors', params) as ticket:
+            result = Coordinator(req_logger, params[8], dry_run=params[10], population_items=params[11],
+                                 population_observer=ticket.update_population_size)\
+                .download_donors(params[0], params[1])
         return result
     req_logger = unique_logger()
     return try_and_catch(go, req_logger)
@@ -135,7 +224,8 @@ def values(attribute):
             req_logger.info('response says the attribute is not valid')
             return f'Attribute {attribute} is not a valid parameter for this request', 400
         else:
-            result = Coordinator(req_logger).values_of_attribute(item)
+            with admit('values_of_attribute'):
+                result = Coordinator(req_logger).values_of_attribute(item)
             return result
     req_logger = unique_logger()
     return try_and_catch(go, req_logger)
@@ -147,12 +237,14 @@ def annotate(body):
         assembly = body.get(ReqParamKeys.ASSEMBLY)
         if assembly:
             assembly = assembly.lower()
-        if body.get(ReqParamKeys.STOP):
-            interval = parse_genomic_interval_from_dict(body)
-            result = Coordinator(req_logger).annotate_interval(interval, assembly)
-        else:
-            variant = parse_variant_from_dict(body)
-            result = Coordinator(req_logger).annotate_variant(variant, assembly)
+        dry_run = body.get(ReqParamKeys.DRY_RUN) or False
+        with admit('annotate', lightweight=dry_run):
+            if body.get(ReqParamKeys.STOP):
+                interval = parse_genomic_interval_from_dict(body)
+                result = Coordinator(req_logger, dry_run=dry_run).annotate_interval(interval, assembly)
+            else:
+                variant = parse_variant_from_dict(body)
+                result = Coordinator(req_logger, dry_run=dry_run).annotate_variant(variant, assembly)
         return result
     req_logger = unique_logger()
     return try_and_catch(go, req_logger)
@@ -162,19 +254,64 @@ def variants_in_region(body):
     def go():
         req_logger.info(f'new request to /variants_in_region with request_body: {body}')
         optional_params = prepare_body_parameters(body)
-        if body.get(ReqParamKeys.STOP):
-            interval = parse_genomic_interval_from_dict(body)
-            result = Coordinator(req_logger, optional_params[8]) \
-                .variants_in_genomic_interval(interval, optional_params[0], optional_params[1])
-        else:
-            gene = parse_gene_from_dict(body)
-            result = Coordinator(req_logger, optional_params[8])\
-                .variants_in_gene(gene, optional_params[0], optional_params[1])
+        with admit('variants_in_genomic_interval', optional_params) as ticket:
+            if body.get(ReqParamKeys.STOP):
+                interval = parse_genomic_interval_from_dict(body)
+                result = Coordinator(req_logger, optional_params[8], dry_run=optional_params[10],
+                                     population_items=optional_params[11],
+                                     population_observer=ticket.update_population_size) \
+                    .variants_in_genomic_interval(interval, optional_params[0], optional_params[1])
+            else:
+                gene = parse_gene_from_dict(body)
+                result = Coordinator(req_logger, optional_params[8], dry_run=optional_params[10],
+                                     population_items=optional_params[11],
+                                     population_observer=ticket.update_population_size)\
+                    .variants_in_gene(gene, optional_params[0], optional_params[1])
+        return result
+    req_logger = unique_logger()
+    return try_and_catch(go, req_logger)
+
+
+def linkage(body):
+    def go():
+        req_logger.info(f'new request to /linkage with request_body: {body}')
+        optional_params = prepare_body_parameters(body)
+        with admit('linkage_in_genomic_interval', optional_params) as ticket:
+            coordinator = Coordinator(req_logger, optional_params[8], dry_run=optional_params[10],
+                                      population_items=optional_params[11],
+                                      population_observer=ticket.update_population_size)
+            if body.get(ReqParamKeys.STOP):
+                interval = parse_genomic_interval_from_dict(body)
+                result = coordinator.linkage_in_genomic_interval(interval, optional_params[0], optional_params[1])
+            else:
+                gene = parse_gene_from_dict(body)
+                result = coordinator.linkage_in_gene(gene, optional_params[0], optional_params[1])
         return result
     req_logger = unique_logger()
     return try_and_catch(go, req_logger)
 
 
+def create_population(body):
+    def go():
+        req_logger.info(f'new request to /populations with request_body: {body}')
+        params = prepare_body_parameters(body)
+        with admit('population_items', params):
+            items = Coordinator(req_logger, params[8], population_items=params[11]).population_items_of(params[0], params[1])
+        population = populations.registry.add(params[0], items)
+        return {
+            'population_id': population.population_id,
+            'expires_in': populations.TTL,
+            'columns': ['SOURCE', 'POPULATION_SIZE'],
+            'rows': [[source_name, size] for source_name, size in population.sizes().items()]
+        }
+    req_logger = unique_logger()
+    return try_and_catch(go, req_logger)
+
+
+def metrics():
+    return monitoring_metrics.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @connexion_app.route(base_path)
 def home():
     # redirect to base_path + api_doc_relative_path
@@ -182,6 +319,23 @@ def home():
     return redirect(api_doc_relative_path)
 
 
+# ###########################       ADMISSION CONTROL
+def admit(operation: str, params: Optional[tuple] = None, lightweight: bool = False):
+    """
+    Returns a context manager waiting for the admission of the request to the server (see module admission).
+    :param params: the output of prepare_body_parameters, if available.
+    """
+    if params is None:
+        return admission.controller.admit(operation, client_id(), lightweight=lightweight)
+    sources = params[8] or list(gen_var_sources.keys())
+    return admission.controller.admit(operation, client_id(), params[0], params[1], sources, lightweight or params[10])
+
+
+def client_id():
+    # behind the trusted reverse proxies, ProxyFix sets remote_addr to the address of the client they forwarded
+    return request.remote_addr
+
+
 # ###########################       TRANSFORM INPUT
 def prepare_body_parameters(body):
     var_sources = body.get(ReqParamKeys.GEN_VAR_SOURCES)
@@ -237,7 +391,19 @@ def prepare_body_parameters(body):
 
     include_download_url = body.get(ReqParamKeys.INCLUDE_DOWNLOAD_URL) or False
 
-    return meta, variants, by_attributes, target_variant, out_min_frequency, out_limit, out_max_frequency, include_download_url, var_sources, out_time_estimate_only
+    dry_run = body.get(ReqParamKeys.DRY_RUN) or False
+
+    # a population handle replaces the population filters
+    population_items = None
+    population_id = body.get(ReqParamKeys.POPULATION_ID)
+    if population_id is not None:
+        population = populations.registry.get(population_id)
+        meta, variants, population_items = population.meta_attrs, None, population.items
+    elif meta is None:
+        raise AskUserIntervention(f'The population must be defined either by the metadata attributes or by '
+                                  f'{ReqParamKeys.POPULATION_ID}.', 400)
+
+    return meta, variants, by_attributes, target_variant, out_min_frequency, out_limit, out_max_frequency, include_download_url, var_sources, out_time_estimate_only, dry_run, population_items
 
 
 def parse_to_mutation_array(dict_array_of_mutations):
@@ -310,6 +476,49 @@ def print_output_table(output_dictionary):
 
 # ###########################       ERROR HANDLING
 def try_and_catch(function, request_logger, *args, **kwargs):
+    start_time = time.perf_counter()
+    endpoint = request_endpoint_name()
+
+    def on_shared():
+        request_logger.info('an identical request is in progress: waiting for its response')
+        monitoring_metrics.COALESCED_REQUESTS.inc(endpoint=endpoint)
+
+    body = request.get_json(silent=True)
+    request_fingerprint = coalescing.fingerprint(endpoint, request.view_args, body)
+    entity_tag = http_cache.etag(request_fingerprint) if http_cache.cacheable(endpoint) else None
+    # a request on an expired population handle must fail with UnknownPopulation instead of being not modified
+    if entity_tag is not None and request.if_none_match.contains_weak(entity_tag) and known_population(body):
+        request_logger.info('response not modified')
+        response = '', 304, http_cache.headers(endpoint, entity_tag)
+    else:
+        # identical concurrent requests are executed once
+        response = coalescing.requests_in_flight.do(
+            request_fingerprint,
+            lambda: _try_and_catch(function, request_logger, *args, **kwargs),
+            on_shared)
+        # responses carrying their own headers (e.g. time estimates) are not cached
+        if response[1] == 200 and len(response) == 2:
+            response = response[0], 200, http_cache.headers(endpoint, entity_tag)
+    monitoring_metrics.REQUEST_LATENCY.observe(time.perf_counter() - start_time,
+                                               endpoint=endpoint,
+                                               status=str(response[1]))
+    return response
+
+
+def known_population(body) -> bool:
+    """
+    :return: False if the body refers to a population handle that is no longer available.
+    """
+    population_id = body.get(ReqParamKeys.POPULATION_ID) if isinstance(body, dict) else None
+    return population_id is None or populations.registry.has(population_id)
+
+
+def request_endpoint_name():
+    # the rule (e.g. /popstudy/api/values/<attribute>) has a limited set of values, unlike the request path
+    return request.url_rule.rule if request.url_rule is not None else request.path
+
+
+def _try_and_catch(function, request_logger, *args, **kwargs):
     # noinspection PyBroadException
     try:
         result = function(*args, **kwargs)
@@ -325,6 +534,9 @@ def try_and_catch(function, request_logger, *args, **kwargs):
         return bad_genomic_interval_parameters(e.args[0], request_logger)
     except ContradictingRegionAttributes as e:
         return contradicting_region_attributes(request_logger)
+    except AdmissionRejected as e:
+        request_logger.info(f'Request not admitted: {e.reason}')
+        return e.response_body, e.proposed_status_code, {'Retry-After': str(e.retry_after)}
     except AskUserIntervention as e:
         request_logger.info(f'Asking for user intervention with response {e.proposed_status_code}')
         return e.response_body, e.proposed_status_code
@@ -333,7 +545,8 @@ def try_and_catch(function, request_logger, *args, **kwargs):
         # don't delete the braces, or Flask can't unpack the result correctly
         return (e.response_body, e.proposed_status_code) if e.response_body is not None else service_unavailable_message(request_logger)
     except TimeEstimate as e:
-        return e.response_body, e.proposed_status_code
+        # estimates depend on the execution history, not only on the data
+        return e.response_body, e.proposed_status_code, {'Cache-Control': 'no-store'}
     except sqlalchemy.exc.OperationalError:  # database connection not available / user canceled query
         request_logger.exception('database connection not available / user canceled query')
         return service_unavailable_message(request_logger)
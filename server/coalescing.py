@@ -0,0 +1,64 @@
+"""
+Coalescing of identical concurrent requests. The first request with a given fingerprint executes, while the identical
+requests arriving before its completion wait for the same response and receive a copy of it (notices included), without
+querying the database again.
+"""
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Optional
+import copy
+import hashlib
+import json
+
+
+def fingerprint(endpoint: str, path_parameters: Optional[dict], body: Optional[Any]) -> str:
+    """
+    Returns a key identifying the request independently of the order of the keys in the JSON objects.
+    """
+    canonical = json.dumps([endpoint, path_parameters, body], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.exception: Optional[BaseException] = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, function: Callable[[], Any], on_shared: Optional[Callable[[], None]] = None):
+        """
+        Executes function, unless another thread is already executing a call with the same key. In that case, it waits
+        for the other call to complete and returns a copy of its result (or raises the same exception).
+        :param on_shared: called before waiting for the result of another thread
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+        if not is_leader:
+            if on_shared is not None:
+                on_shared()
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return copy.deepcopy(call.result)
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+requests_in_flight = SingleFlight()
@@ -0,0 +1,62 @@
+"""
+HTTP caching of the responses. Every successful response carries an ETag derived from the fingerprint of the request
+(see coalescing.fingerprint) and from the data version (see database/data_version.py), so the tag changes only when the
+data is reloaded. A request whose header If-None-Match contains the current tag is answered with 304 Not Modified
+before any work is done. The header Cache-Control tells clients and reverse proxies for how long a response can be
+reused without asking again, according to MAX_AGE.
+"""
+from database import data_version
+from typing import Optional
+from loguru import logger
+import hashlib
+
+# seconds of validity of the responses of each endpoint (path relative to the base path of the API); responses of
+# endpoints not listed here must be revalidated (with the ETag) at each use
+MAX_AGE = {
+    'values/<attribute>': 86400,
+    'annotate': 86400,
+    'variants_in_region': 3600
+}
+
+# endpoints whose responses must never be reused, because they create something on the server
+NOT_CACHEABLE = {'populations'}
+
+
+def _relative_path(endpoint: str) -> str:
+    return endpoint.split('/api/', 1)[-1]
+
+
+def etag(request_fingerprint: str) -> Optional[str]:
+    """
+    :return: the entity tag of the response to the request with the given fingerprint, or None if the data version is
+    not available.
+    """
+    try:
+        version = data_version.current()
+    except Exception:
+        logger.exception('unable to read the data version: responses are not tagged')
+        return None
+    return hashlib.sha256(f'{request_fingerprint}:{version}'.encode('utf-8')).hexdigest()[:32]
+
+
+def cacheable(endpoint: str) -> bool:
+    return _relative_path(endpoint) not in NOT_CACHEABLE
+
+
+def cache_control(endpoint: str) -> str:
+    if not cacheable(endpoint):
+        return 'no-store'
+    max_age = MAX_AGE.get(_relative_path(endpoint))
+    if max_age:
+        return f'public, max-age={max_age}'
+    return 'no-cache'
+
+
+def headers(endpoint: str, entity_tag: Optional[str]) -> dict:
+    """
+    :return: the caching headers of a successful response.
+    """
+    result = {'Cache-Control': cache_control(endpoint)}
+    if entity_tag is not None and cacheable(endpoint):
+        result['ETag'] = f'"{entity_tag}"'
+    return result
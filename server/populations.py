@@ -0,0 +1,86 @@
+"""
+Population handles. The endpoint /populations resolves a population (having_meta + having_variants) once in each
+source and keeps the item_id of its individuals in memory; the returned population_id can replace the population
+filters in the requests to the other endpoints, which so avoid rebuilding the same tables of metadata and regions.
+A handle expires TTL seconds after its last use, or as soon as the data version changes (the individuals could be
+different), and the oldest handles are discarded beyond MAX_POPULATIONS.
+"""
+from data_sources.io_parameters import MetadataAttrs
+from data_sources.coordinator import AskUserIntervention
+from database import data_version
+from threading import Lock
+from typing import Dict, List
+import collections
+import time
+import uuid
+
+TTL = 3600                  # seconds
+MAX_POPULATIONS = 1000
+
+
+class Population:
+    def __init__(self, meta_attrs: MetadataAttrs, items: Dict[str, List[int]], version: int):
+        self.population_id = uuid.uuid4().hex
+        self.meta_attrs = meta_attrs
+        self.items = items      # source name -> item_id of the individuals
+        self.version = version
+        self.expires_at = time.time() + TTL
+
+    def sizes(self) -> Dict[str, int]:
+        return {source_name: len(items) for source_name, items in self.items.items()}
+
+
+class UnknownPopulation(AskUserIntervention):
+    def __init__(self, population_id: str):
+        super().__init__(f'The population {population_id} does not exist or has expired. Define it again through '
+                         f'the endpoint /populations.', 404)
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = Lock()
+        self._populations: Dict[str, Population] = collections.OrderedDict()    # least recently used first
+
+    def add(self, meta_attrs: MetadataAttrs, items: Dict[str, List[int]]) -> Population:
+        population = Population(meta_attrs, items, data_version.current())
+        with self._lock:
+            self._discard_expired()
+            self._populations[population.population_id] = population
+            while len(self._populations) > MAX_POPULATIONS:
+                self._populations.popitem(last=False)
+        return population
+
+    def get(self, population_id: str) -> Population:
+        """
+        Returns the population and extends its lifetime. Raises UnknownPopulation if it doesn't exist or it expired.
+        """
+        version = data_version.current()
+        with self._lock:
+            self._discard_expired()
+            population = self._populations.get(population_id)
+            if population is None or population.version != version:
+                self._populations.pop(population_id, None)
+                raise UnknownPopulation(population_id)
+            population.expires_at = time.time() + TTL
+            self._populations.move_to_end(population_id)
+            return population
+
+    def has(self, population_id: str) -> bool:
+        """
+        :return: True if the population exists and is not expired, without extending its lifetime.
+        """
+        version = data_version.current()
+        with self._lock:
+            population = self._populations.get(population_id)
+            return population is not None and population.version == version and population.expires_at > time.time()
+
+    def _discard_expired(self):
+        now = time.time()
+        expired = [population_id for population_id, population in self._populations.items()
+                   if population.expires_at <= now]
+        for population_id in expired:
+            del self._populations[population_id]
+
+
+registry = Registry()
@@ -0,0 +1,228 @@
+"""
+Regression checks on the execution plans of the statements generated by the sources. For each kind of region
+constraint, the statements of KGenomes and TCGA are built in dry-run mode (no table is created) and explained; the
+checks assert that the table of regions is read through its indexes, i.e. on (chrom, start, ref, alt), on id and on
+item_id, and never with a sequential scan.
+
+Run them with
+    python main.py tests <db_user> <db_password> <db_port> <log level>
+against a database created by benchmarks/synthetic_db.py with scale "small" or bigger: on smaller tables the planner
+rightly prefers sequential scans.
+FrequencyFunctions compares instead the computation of the allele frequency in data_sources/allele_frequency.py with
+the database functions it replaces.
+"""
+from data_sources.io_parameters import *
+from data_sources.source_interface import do_not_notify
+from data_sources.kgenomes.kgenomes import KGenomes
+from data_sources.tcga.tcga import TCGA
+from data_sources import allele_frequency
+from database import database, db_utils
+from sqlalchemy import text, select, func
+from typing import List
+from loguru import logger
+import unittest
+import random
+import numpy
+import sys
+
+INDEX_SCANS = {'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'}
+# the population size up to which the ranking of variants is expected to scan the variants of each individual by index
+KGENOMES_INDEXED_RANKING_MAX_POPULATION = 149
+
+
+def scans_of_relation(plan_node: dict, relation_name: str) -> List[str]:
+    """
+    :return: the node types of the plan (and its sub-plans) reading the table relation_name
+    """
+    scans = [plan_node['Node Type']] if plan_node.get('Relation Name') == relation_name else []
+    for child in plan_node.get('Plans', []):
+        scans.extend(scans_of_relation(child, relation_name))
+    return scans
+
+
+class RegionTablePlans:
+    """
+    Checks common to the sources. Subclasses set source_class and region_table_name.
+    """
+    source_class = None
+    region_table_name: str = None
+
+    @classmethod
+    def setUpClass(cls):
+        # two variants of the same individual with an ID, so that every constraint selects a non-empty population
+        query = text(f'SELECT r.chrom, r.start, r.ref, r.alt, r.id, m.assembly '
+                     f'FROM rr.{cls.region_table_name} AS r JOIN dw.genomes_metadata_3 AS m ON r.item_id = m.item_id '
+                     f'WHERE r.item_id = (SELECT item_id FROM rr.{cls.region_table_name} WHERE id IS NOT NULL LIMIT 1) '
+                     f'AND r.id IS NOT NULL '
+                     f'ORDER BY r.chrom, r.start '
+                     f'LIMIT 2')
+        rows = database.try_py_function(lambda connection: connection.execute(query).fetchall())
+        if len(rows) < 2:
+            raise unittest.SkipTest(f'rr.{cls.region_table_name} does not contain enough variants')
+        cls.variants = [Mutation(row[0], row[1], row[2], row[3]) for row in rows]
+        cls.variant_ids = [Mutation(_id=row[4]) for row in rows]
+        cls.meta = MetadataAttrs(assembly=rows[0][5])
+        cls.interval = GenomicInterval(rows[0][0], max(0, rows[0][1] - 100000), rows[0][1] + 100000)
+
+    def new_source(self, notify_message=do_not_notify):
+        source = self.source_class(logger, notify_message)
+        source.dry_run = True
+        return source
+
+    def explain(self, build_stmt) -> dict:
+        """
+        :param build_stmt: a function accepting a Connection and returning the statement to explain
+        """
+        return database.try_py_function(
+            lambda connection: db_utils.explain(build_stmt(connection), connection, False, logger.debug))
+
+    def assert_index_scans_only(self, plan: dict):
+        scans = scans_of_relation(plan['Plan'], self.region_table_name)
+        self.assertTrue(scans, f'{self.region_table_name} is not read by the plan')
+        self.assertNotIn('Seq Scan', scans, f'sequential scan on {self.region_table_name}')
+        self.assertTrue(INDEX_SCANS.intersection(scans), f'no index scan on {self.region_table_name}: {scans}')
+
+    def require(self, constraint: Vocabulary):
+        if constraint not in self.source_class.avail_region_constraints:
+            self.skipTest(f'{self.source_class.pretty_name()} does not support {constraint.name}')
+
+    def assert_donors_plan(self, region_attrs: RegionAttrs):
+        source = self.new_source()
+        self.assert_index_scans_only(self.explain(
+            lambda connection: source.donors(connection, [Vocabulary.DONOR_ID], self.meta, region_attrs, False)))
+
+    # REGION CONSTRAINT KINDS
+    def test_with_variant_by_coordinates(self):
+        self.assert_donors_plan(RegionAttrs(with_variants=self.variants[:1]))
+
+    def test_with_variant_by_id(self):
+        self.assert_donors_plan(RegionAttrs(with_variants=self.variant_ids[:1]))
+
+    def test_with_all_of_variants(self):
+        self.assert_donors_plan(RegionAttrs(with_variants=[self.variants[0], self.variant_ids[1]]))
+
+    def test_with_variants_same_chromosome_copy(self):
+        self.require(Vocabulary.WITH_VARIANT_SAME_C_COPY)
+        self.assert_donors_plan(RegionAttrs(with_variants_same_c_copy=self.variants))
+
+    def test_with_variants_different_chromosome_copies(self):
+        self.require(Vocabulary.WITH_VARIANT_DIFF_C_COPY)
+        self.assert_donors_plan(RegionAttrs(with_variants_diff_c_copy=self.variants))
+
+    def test_with_variants_in_genomic_interval(self):
+        self.assert_donors_plan(RegionAttrs(with_variants_in_genomic_region=self.interval))
+
+    def test_without_variant(self):
+        self.assert_donors_plan(RegionAttrs(without_variants=self.variants[:1]))
+
+    def test_with_and_without_variants(self):
+        self.assert_donors_plan(RegionAttrs(with_variants=self.variants[:1], without_variants=self.variants[1:]))
+
+    def test_with_variants_in_genomic_interval_and_without_variant(self):
+        self.assert_donors_plan(RegionAttrs(with_variants=self.variants[:1],
+                                            with_variants_in_genomic_region=self.interval,
+                                            without_variants=self.variants[1:]))
+
+    def test_with_variant_without_carriers(self):
+        source = self.new_source()
+        absent_variant = Mutation(self.variants[0].chrom, self.variants[0].start, self.variants[0].ref, 'NNNNN')
+        region_attrs = RegionAttrs(with_variants=[absent_variant])
+        if not source.carriers_from_regions:
+            # precomputed statistics may predate the last loads: the constraint is evaluated on the table of regions
+            self.assert_donors_plan(region_attrs)
+            return
+        # the carriers counted by selectivity answer before any statement on the table of regions
+        with self.assertRaises(EmptyResult):
+            database.try_py_function(
+                lambda connection: source.donors(connection, [Vocabulary.DONOR_ID], self.meta, region_attrs, False))
+
+    # OTHER STATEMENTS FILTERING THE TABLE OF REGIONS
+    def test_variant_occurrence(self):
+        source = self.new_source()
+        self.assert_index_scans_only(self.explain(
+            lambda connection: source.variant_occurrence(connection, [Vocabulary.GENDER], self.meta, RegionAttrs(),
+                                                         self.variants[0])))
+
+    def test_variants_in_region(self):
+        source = self.new_source()
+        self.assert_index_scans_only(self.explain(
+            lambda connection: source.variants_in_region(connection, self.interval, [Vocabulary.CHROM, Vocabulary.START],
+                                                         self.meta, RegionAttrs())))
+
+
+class KGenomesPlans(RegionTablePlans, unittest.TestCase):
+    source_class = KGenomes
+    region_table_name = 'kgenomes_red'
+
+    def test_rank_variants_of_small_population(self):
+        population_sizes = []
+
+        def notify_message(msg_type: SourceMessage.Type, msg: str):
+            if msg_type == SourceMessage.Type.POPULATION_SIZE:
+                population_sizes.append(int(msg))
+
+        source = self.new_source(notify_message)
+        region_attrs = RegionAttrs(with_variants=self.variants[:1])
+        stmt = database.try_py_function(
+            lambda connection: source.rank_variants_by_frequency(connection, self.meta, region_attrs, False, None, 10,
+                                                                 False))
+        if population_sizes[0] > KGENOMES_INDEXED_RANKING_MAX_POPULATION:
+            self.skipTest(f'the population of {population_sizes[0]} individuals may be ranked by a sequential scan')
+        self.assert_index_scans_only(self.explain(lambda connection: stmt))
+
+
+class TCGAPlans(RegionTablePlans, unittest.TestCase):
+    source_class = TCGA
+    region_table_name = 'tcga_dnaseq_2'
+
+
+class FrequencyFunctions(unittest.TestCase):
+    """
+    Compares the database functions rr.mut_frequency_new_* with the SQL expression and the vectorized function of
+    allele_frequency on random cases concentrated around the critical values of the inputs.
+    """
+    CASES_PER_ASSEMBLY = 300
+
+    @staticmethod
+    def random_cases(assembly: str, rng: random.Random) -> List[tuple]:
+        par_start, par_stop = allele_frequency.PAR_BOUNDS[assembly]
+        starts = [par_start - 1, par_start, par_start + 1, par_stop - 1, par_stop, par_stop + 1, 0]
+        cases = []
+        for _ in range(FrequencyFunctions.CASES_PER_ASSEMBLY):
+            chrom = rng.choice([1, 22, 23, 23, 24, 25])
+            start = rng.choice(starts + [rng.randrange(0, 250000000)])
+            males = rng.choice([0, rng.randrange(0, 2000)])
+            females = rng.choice([0, rng.randrange(0, 2000)])
+            occurrence = rng.choice([0, rng.randrange(0, 2 * (males + females) + 1)])
+            cases.append((occurrence, males, females, chrom, start))
+        return cases
+
+    def compare(self, assembly: str, db_function):
+        cases = self.random_cases(assembly, random.Random(assembly))
+        columns = [select([db_function(*case), allele_frequency.frequency_expression(*case, assembly)])
+                   for case in cases]
+
+        def evaluate(connection):
+            return [connection.execute(stmt).fetchone() for stmt in columns]
+        from_db = database.try_py_function(evaluate)
+        vectorized = allele_frequency.frequency(*numpy.array(cases).T, assembly)
+        for case, (expected, from_expression), from_numpy in zip(cases, from_db, vectorized):
+            with self.subTest(case=case):
+                self.assertAlmostEqual(float(expected), float(from_expression), places=9)
+                self.assertAlmostEqual(float(expected), from_numpy, places=9)
+
+    def test_hg19(self):
+        self.compare('hg19', func.rr.mut_frequency_new_hg19)
+
+    def test_grch38(self):
+        self.compare('grch38', func.rr.mut_frequency_new_grch38)
+
+
+def run():
+    suite = unittest.defaultTestLoader.loadTestsFromModule(sys.modules[__name__])
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    if not result.wasSuccessful():
+        sys.exit(1)
+
+
+run()